@@ -4,6 +4,7 @@ from PyQt5 import QtWidgets
 from PyQt5.QtCore import pyqtSlot
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from gui_action.plot_blitmanager import BlitManager
+from gui_action.waveform_pyramid import WaveformPyramid
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 import numpy as np
 from instruments.CAEN.Qdigitizer import QDigitizer
@@ -15,7 +16,8 @@ class DigitizerPlotWidget(QtWidgets.QWidget):
     """
     Plot widget for the digitizer data.
 
-    Uses a blitmanager for faster rendering.
+    Uses a blitmanager for faster rendering. The data is plotted through a min/max waveform pyramid which is built
+    once per update, zooming and panning then only selects the fitting resolution from the pyramid.
     """
 
     def __init__(self, *args, **kwargs):
@@ -38,6 +40,8 @@ class DigitizerPlotWidget(QtWidgets.QWidget):
         self.samples = None
         self.post_trigger_size = None
         self.sample_rate = None
+        self.pyramid = None
+        self.xlim_cid = None
 
     def connect_signals_slots(self):
         """ Connect all the signals from the digitizer to the plotwindow. """
@@ -57,16 +61,22 @@ class DigitizerPlotWidget(QtWidgets.QWidget):
         Plot the digitizer data.
         If there is not yet a blitmanager, intialize one.
         """
+        self.pyramid = WaveformPyramid(times, data, int(self.digitizer.max_plot_points))
         if not self.blitmanager:
             self.init_blitmanager(times, data, plotinfo)
         else:
             # for count, line in enumerate(self.lines, start=0):
             self.logger.debug('updating digitizer plot')
-            self.lines.set_xdata(times)
-            self.lines.set_ydata(data)
+            self.lines.set_data(*self.pyramid.view(*self.ax.get_xlim()))
             self.annotation.set_text(plotinfo)
             self.blitmanager.update()
 
+    def xlim_changed(self, ax):
+        """ Select the resolution of the plotted data for the new time range when zooming or panning. """
+        if self.pyramid is None:
+            return
+        self.lines.set_data(*self.pyramid.view(*ax.get_xlim()))
+
     def init_blitmanager(self, times, data, plotinfo):
         """
         Initialize the blitmanager for quicker rendering of the plotdata.
@@ -75,7 +85,10 @@ class DigitizerPlotWidget(QtWidgets.QWidget):
         if self.blitmanager:
             self.blitmanager = None
 
-        self.lines, = self.ax.plot(times, data, animated=True)
+        self.lines, = self.ax.plot(*self.pyramid.view(), animated=True)
+        if self.xlim_cid is not None:
+            self.ax.callbacks.disconnect(self.xlim_cid)
+        self.xlim_cid = self.ax.callbacks.connect('xlim_changed', self.xlim_changed)
         self.annotation = self.ax.annotate(plotinfo, (0, 1), xycoords="axes fraction", xytext=(10, -10),
                                            textcoords="offset points", ha="left", va="top", animated=True)
         self.ax.set_ylabel('counts')
@@ -103,6 +116,8 @@ class DigitizerPlotWidget(QtWidgets.QWidget):
         """
         if self.blitmanager:
             self.logger.info('fitting digitizer plot to window')
+            # fit to the full time range, not to the currently zoomed part of the data
+            self.lines.set_data(*self.pyramid.view())
             self.blitmanager.redraw_canvas_digitizer()
 
 
@@ -46,19 +46,25 @@ class PowerMeterPlotWidget(QtWidgets.QWidget):
         self.logger_plot.info(' Disconnecting signals from powermeter plotwiget')
         self.powermeter.measurement_complete_multiple.disconnect(self.plot)
 
-    @pyqtSlot(list, list, str)
+    @pyqtSlot(np.ndarray, np.ndarray, str)
     def plot(self, times, power, plotinfo):
         """
         Plot the powermeter data.
-        Append the new powermeter data to the old log, discard the oldest values.
+        Shift the new powermeter data into the end of the log in place, discarding the oldest values. Emits without
+        data are ignored.
         """
-        self.log_power = np.append(self.log_power, power)
+        if len(power) == 0:
+            self.logger_plot.debug('no powermeter data to plot')
+            return
+        k = min(len(power), len(self.log_power))
+        self.log_power[:-k] = self.log_power[k:]
+        self.log_power[-k:] = power[-k:]
 
         if not self.blitmanager:
             self.init_blitmanager(plotinfo)
         else:
             self.logger_plot.info('updating powermeter plot')
-            self.line.set_ydata(1000*self.log_power[-2001:-1])
+            self.line.set_ydata(1000 * self.log_power)
             self.annotation.set_text(plotinfo)
         self.blitmanager.update()
 
@@ -69,7 +75,7 @@ class PowerMeterPlotWidget(QtWidgets.QWidget):
         """
         self.blitmanager = None
         self.logger_plot.info('Initializing blitmanager powermeter. ')
-        self.line, = self.ax.plot(self.log_time, 1000 * self.log_power[-2001:-1], animated=True)
+        self.line, = self.ax.plot(self.log_time, 1000 * self.log_power, animated=True)
         self.annotation = self.ax.annotate(plotinfo, (0, 1), xycoords="axes fraction", xytext=(10, -10),
                                            textcoords="offset points", ha="left", va="top", animated=True)
         self.ax.set_ylabel('power [mW]')
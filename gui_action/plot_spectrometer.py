@@ -62,7 +62,7 @@ class SpectrometerPlotWidget(QtWidgets.QWidget):
         """ Plot the dark spectrum. """
         self.logger_plot.info('plotting dark spectrum')
         plotinfo = 'Dark Spectrum'
-        if not self.blitmanager:
+        if not self.blitmanager or self._axis_changed(intensities):
             self.init_blitmanager(intensities, plotinfo)
         self.line.set_ydata(intensities)
         self.annotation.set_text(plotinfo)
@@ -73,7 +73,7 @@ class SpectrometerPlotWidget(QtWidgets.QWidget):
         """ Plot the lamp spectrum. """
         self.logger_plot.info('plotting lamp spectrum')
         plotinfo = 'Lamp Spectrum'
-        if not self.blitmanager:
+        if not self.blitmanager or self._axis_changed(intensities):
             self.init_blitmanager(intensities, plotinfo)
         self.line.set_ydata(intensities)
         self.annotation.set_text(plotinfo)
@@ -88,7 +88,7 @@ class SpectrometerPlotWidget(QtWidgets.QWidget):
         Plots using a blitmanager for increased performance.
         """
         plotinfo = self.define_plotinfo()
-        if not self.blitmanager:
+        if not self.blitmanager or self._axis_changed(intensities):
             self.init_blitmanager(intensities, self.spectrometer.plotinfo)
             return
         elif self.spectrometer.transmission:
@@ -115,6 +115,10 @@ class SpectrometerPlotWidget(QtWidgets.QWidget):
             self.logger_plot.info('updating blitmanager spectrometer')
             self.blitmanager.update()
 
+    def _axis_changed(self, intensities):
+        """ Return True if the number of pixels changed, after changing the region of interest or binning """
+        return self.line is not None and len(self.line.get_xdata()) != len(intensities)
+
     def init_blitmanager(self, intensities, plotinfo):
         """
         Initialize the blitmanager for faster rendering of the graphs. Two artists,
@@ -123,6 +127,9 @@ class SpectrometerPlotWidget(QtWidgets.QWidget):
         self.logger_plot.info(f'Initializing blitmanager spectrometerplot')
         if self.blitmanager:
             self.blitmanager = None
+            self.line.remove()
+            self.annotation.remove()
+            self.ax.relim()
         self.line, = self.ax.plot(self.spectrometer.wavelengths, intensities, animated=True)
         self.annotation = self.ax.annotate(plotinfo, (0, 1), xycoords="axes fraction", xytext=(10, -10),
                                            textcoords="offset points", ha="left", va="top", animated=True)
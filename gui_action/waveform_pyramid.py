@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class WaveformPyramid:
+    """
+    Multi-resolution min/max decimation of a uniformly sampled waveform, for plotting long records.
+
+    Level k of the pyramid holds the minimum and maximum of every bin of 2^k samples. The pyramid is built once per
+    new waveform, after which any time range is served from the coarsest level that still has enough bins to fill
+    the plot. Plotting the minimum and maximum of every bin keeps narrow spikes visible, unlike averaging.
+    """
+
+    def __init__(self, times: np.ndarray, data: np.ndarray, max_points: int = 4000):
+        """
+        :param times: time of every sample, uniformly spaced
+        :param data: waveform
+        :param max_points: maximum number of points returned for a view
+        """
+        self.times = times
+        self.data = data
+        self.max_points = max_points
+        self.samples = len(data)
+        self.dt = (times[-1] - times[0]) / (self.samples - 1) if self.samples > 1 else 1.
+        self.levels = [(data, data)]
+        minima, maxima = data, data
+        while len(minima) > max_points // 2:
+            if len(minima) % 2:
+                minima, maxima = np.append(minima, minima[-1]), np.append(maxima, maxima[-1])
+            minima = np.minimum(minima[0::2], minima[1::2])
+            maxima = np.maximum(maxima[0::2], maxima[1::2])
+            self.levels.append((minima, maxima))
+
+    def view(self, tmin=None, tmax=None):
+        """
+        Return the decimated waveform between two times. Without decimation the samples themselves are returned,
+        otherwise the minimum and maximum of every bin, both at the start time of the bin.
+
+        :param tmin: start time of the view, start of the waveform if None
+        :param tmax: end time of the view, end of the waveform if None
+        :returns: times, data
+        """
+        start = 0 if tmin is None else int(np.clip(np.floor((tmin - self.times[0]) / self.dt), 0, self.samples))
+        stop = self.samples if tmax is None else int(np.clip(np.ceil((tmax - self.times[0]) / self.dt) + 1, 0,
+                                                             self.samples))
+        if stop - start <= self.max_points:
+            return self.times[start:stop], self.data[start:stop]
+        level = 1
+        while level < len(self.levels) - 1 and (stop - start) >> level > self.max_points // 2:
+            level += 1
+        factor = 1 << level
+        minima, maxima = self.levels[level]
+        bins = slice(start // factor, -(-stop // factor))
+        times = self.times[0] + np.arange(bins.start, bins.start + len(minima[bins])) * factor * self.dt
+        return np.repeat(times, 2), np.column_stack((minima[bins], maxima[bins])).ravel()
@@ -31,7 +31,7 @@ class PowerMeterWidget(QtWidgets.QWidget):
         self.powermeter.measurement_complete_multiple.disconnect(self.handle_measurement)
         self.ui.pushButton_zero.clicked.disconnect(self.powermeter.zero)
 
-    @pyqtSlot(list, list, str)
+    @pyqtSlot(np.ndarray, np.ndarray, str)
     def handle_measurement(self, times, power, plotinfo):
         """ Format the power shown in the widget depending on the magnitude. """
         # set the right unit depending on the incoming power
@@ -63,7 +63,7 @@ class SpectrometerWidget(QtWidgets.QWidget):
         """ Measure a dark spectrum if none present, otherwise remove the darkspectrum and any other saved spectra. """
         if not any(self.spectrometer.dark):
             self.logger_widget.info('Requesting dark spectrum from widget')
-            QTimer.singleShot(0, self.spectrometer.measure_dark)
+            QTimer.singleShot(0, self.spectrometer.measure_new_dark)
             self.ui.groupBox_alignment.setEnabled(False)
         else:
             self.logger_widget.info('Resetting dark spectrum and possibly lamp spectrum from widget')
@@ -1,11 +1,12 @@
-import unicodedata
 import instruments.CAEN as CAENlib
-import scipy.ndimage.interpolation as sp
+from instruments.CAEN import pulseprocessing
+from instruments.CAEN.ringbuffer import EventRingBuffer
+from instruments.CAEN.convergence import ConvergenceMonitor
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QTimer, QMutex, QMutexLocker
 import time
+import threading
 import logging
 import numpy as np
-import scipy.ndimage as sp
 
 
 class QDigitizer(CAENlib.Digitizer, QObject):
@@ -34,6 +35,19 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         self.connected = False
         self.measuring = False
         self.pulses_per_measurement = 1
+        self.events_per_block = 64
+        self.ring_buffer_slots = 4
+        self.ring_buffer_policy = 'block'
+        self.ring_buffer = None
+        self.acquisition_stop = threading.Event()
+        self.acquisition_error = None
+        self.adc_bits = 14
+        self.dll_calls_per_pulse = 0
+        self.raw_recorder = None
+        self.raw_point = 0
+        self.convergence_enabled = False
+        self.convergence = ConvergenceMonitor()
+        self.last_pulses_measured = 0
         self.last_pulses = []
         self.measurement_mode = 'single pulse'
         self.data_channel = 0
@@ -41,12 +55,17 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         self.added_pulses = np.empty(0)
         self.average_pulses = np.empty(0)
         self.single_photon_counts = np.empty(0)
+        self.list_mode = False
+        self.photon_times = []
+        self.photon_counts = []
+        self.photon_samples = 0
         self.pulse_counter = 0
         self.compression_factor = 1
         self.jitter_correction_enabled = False
         self.jitter_channel = 1
         self.jitter_startsample = 0
-        self.max_plot_points = 2e4
+        self.max_plot_points = 20000
+        self.time_vectors = {}
         self.plotinfo = None
 
     def init_device(self):
@@ -60,6 +79,7 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         self.acquisition_mode = CAENlib.AcqMode.SW_CONTROLLED
         self.external_trigger_mode = CAENlib.TriggerMode.ACQ_ONLY
         self.external_trigger_level = CAENlib.IOLevel.TTL
+        self.cache_settings()
 
     @pyqtSlot()
     def connect(self):
@@ -84,32 +104,86 @@ class QDigitizer(CAENlib.Digitizer, QObject):
     @pyqtSlot()
     def measure(self):
         """
-        Performs repeated single-event measurements with the number of measurements set by the pulses per
-        measurement attribute or by the input value. Can also read single measurement.
+        Performs repeated block transfer measurements until the number of pulses set by the pulses per measurement
+        attribute is reached. Each block transfer reads all events stored in the digitizer, up to the block transfer
+        size, after which all pulses in the block are processed at once. Can also read single measurement.
 
-        If a maximum measuring polltime is set
+        Acquisition and processing run in parallel. An acquisition thread starts a measurement session and reads the
+        blocks into a ring buffer while this thread processes the blocks from the ring buffer, so the digitizer
+        keeps being read out while the previous block is processed. If the ring buffer is full the acquisition thread
+        waits for the processing (or drops the block, depending on the ring buffer policy).
+
+        If a raw recorder is attached, every event is queued for recording to disk before processing, together with
+        the raw point index.
+
+        If a maximum measuring polltime is set, the measurement is finished after the first block past the polltime.
+        If convergence is enabled, the measurement is finished after the first block at which the convergence monitor
+        reaches its target relative error or total counts, with the pulses per measurement as maximum.
         """
         with(QMutexLocker(self.mutex)):
             self.measuring = True
             tstart = time.time()
             self.logger_q_instrument.info(f'started measuring {self.pulses_per_measurement} pulse(s)')
-            for pulse in range(self.pulses_per_measurement):
-                data = self.measurement_single_event()
-                self.logger_q_instrument.debug(f'data = {data}')
-                data = self._jitter_correction(data)
-                data = self._invert_data(data)
-                data = self._process_data(data)
-
-                tcurrent = time.time()
-                if self.polltime_enabled and (tcurrent - tstart) > (0.8 * self.polltime_measurement):
-                    self.logger_q_instrument.info(f'measurement past polltime, finishing after {pulse + 1} pulses')
-                    break
-                elif (tcurrent - tstart) > (0.8 * self.polltime_measurement):
-                    self.logger_q_instrument.debug(f'{pulse} out of {self.pulses_per_measurement}, emitting data')
-                    self._emit_pulses_plotting(data)
-                    tstart = time.time()
-
-            self.logger_q_instrument.info(f'measurement finishing after {pulse + 1} pulses')
+            dll_calls = self.dll_calls
+            self._update_block_transfer_size()
+            active_channels = self.active_channels
+            # read all settings needed for processing before the acquisition thread starts using the digitizer
+            self.adc_bits = self.adc_number_of_bits
+            ring = self._prepare_ring_buffer(active_channels)
+            self.acquisition_stop.clear()
+            self.acquisition_error = None
+            acquisition = threading.Thread(target=self._acquire, args=(ring, active_channels),
+                                           name='digitizer acquisition', daemon=True)
+            acquisition.start()
+            pulses = 0
+            data = None
+            self.convergence.reset()
+            try:
+                while pulses < self.pulses_per_measurement:
+                    slot, block = ring.begin_read()
+                    if slot is None:
+                        break
+                    try:
+                        block = block[:, :self.pulses_per_measurement - pulses]
+                        self.logger_q_instrument.debug(f'processing block of {block.shape[1]} pulses')
+                        if self.raw_recorder:
+                            self.raw_recorder.record(block, self.raw_point)
+                        data = self._jitter_correction(block)
+                        data = self._invert_data(data)
+                        data = self._process_data(data)[-1]
+                        pulses += block.shape[1]
+                    finally:
+                        ring.end_read(slot)
+
+                    if self.convergence_enabled and self.convergence.converged():
+                        self.logger_q_instrument.info(f'measurement converged after {pulses} pulses, relative error '
+                                                      f'{self.convergence.relative_error():.4f}')
+                        break
+                    tcurrent = time.time()
+                    if self.polltime_enabled and (tcurrent - tstart) > (0.8 * self.polltime_measurement):
+                        self.logger_q_instrument.info(f'measurement past polltime, finishing after {pulses} pulses')
+                        break
+                    elif (tcurrent - tstart) > (0.8 * self.polltime_measurement):
+                        self.logger_q_instrument.debug(f'{pulses} out of {self.pulses_per_measurement}, emitting data')
+                        self._emit_pulses_plotting(data)
+                        tstart = time.time()
+            finally:
+                self.acquisition_stop.set()
+                ring.close()
+                acquisition.join()
+
+            if self.acquisition_error:
+                self.measuring = False
+                raise self.acquisition_error
+            if data is None:
+                self.logger_q_instrument.warning('measurement stopped before any block was read, nothing to emit')
+                self.measuring = False
+                return
+            self.dll_calls_per_pulse = (self.dll_calls - dll_calls) / max(pulses, 1)
+            self.last_pulses_measured = pulses
+            self.logger_q_instrument.info(f'measurement finishing after {pulses} pulses, '
+                                          f'{self.dll_calls_per_pulse:.2f} digitizer library calls per pulse, '
+                                          f'ring buffer {ring.stats()}')
 
         self._emit_pulses_plotting(data)
         self.measurement_done.emit()
@@ -117,6 +191,64 @@ class QDigitizer(CAENlib.Digitizer, QObject):
 
         return data
 
+    def _acquire(self, ring: EventRingBuffer, active_channels):
+        """
+        Acquisition thread of a measurement. Starts a measurement session and reads blocks of events into the ring
+        buffer until the number of pulses per measurement is read or the measurement is stopped. Blocks read while
+        the ring buffer is full and the policy is to drop are read into the session event buffer and discarded.
+
+        :param ring: ring buffer to read the blocks into
+        :param active_channels: channels to read
+        """
+        events = 0
+        try:
+            self.start_session()
+            while events < self.pulses_per_measurement and not self.acquisition_stop.is_set():
+                slot, out = ring.begin_write()
+                if slot is None and ring.closed:
+                    break
+                block = self.read_event_block(active_channels, out=out, stop=self.acquisition_stop.is_set)
+                if not block.shape[1]:
+                    continue
+                if slot is None:
+                    ring.drop(block.shape[1])
+                    continue
+                ring.end_write(slot, block.shape[1], block.shape[2])
+                events += block.shape[1]
+        except Exception as e:
+            self.logger_q_instrument.error(f'digitizer acquisition failed after {events} events: {e}')
+            self.acquisition_error = e
+        finally:
+            try:
+                self.finish_session()
+            finally:
+                ring.close()
+
+    def _prepare_ring_buffer(self, active_channels):
+        """
+        Return an empty ring buffer with slots sized for a block transfer with the current settings. The ring buffer
+        of the previous measurement is reused if the settings did not change.
+        """
+        shape = (len(active_channels), self.max_num_events_blt, self.record_length)
+        ring = self.ring_buffer
+        if ring is None or ring.shape != shape or ring.slots != self.ring_buffer_slots \
+                or ring.policy != self.ring_buffer_policy:
+            self.logger_q_instrument.info(f'allocating ring buffer of {self.ring_buffer_slots} blocks of {shape}')
+            ring = EventRingBuffer(self.ring_buffer_slots, shape, self.ring_buffer_policy)
+            self.ring_buffer = ring
+        ring.reset()
+        return ring
+
+    def _update_block_transfer_size(self):
+        """
+        Set the maximum number of events per block transfer to the block size, limited by the number of buffers the
+        channel memory is divided in and by the number of pulses per measurement.
+        """
+        events = max(1, min(self.events_per_block, self.buffer_organization, self.pulses_per_measurement))
+        if events != self.max_num_events_blt:
+            self.max_num_events_blt = events
+        return events
+
     def _emit_pulses_plotting(self, data):
         """ Emit the data for plotting """
         self.logger_q_instrument.info('emitting digitizer data to plotwindow.')
@@ -131,22 +263,25 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         elif self.measurement_mode == 'single photon counting':
             times, data, plotinfo = self._compress_single_photon_counts()
             plotinfo = plotinfo + '\n' + self.plotinfo if self.plotinfo else plotinfo
-            self.logger_q_instrument.debug(f'times = {times*1000000}, data = {data}, plotinfo = {plotinfo}')
-            self.logger_q_instrument.debug(f'len times = {len(times)}, len data = {len(data)}')
-            self.logger_q_instrument.debug(f'max value counts unedited = {np.max(self.single_photon_counts)}')
+            # the photon histogram of all list mode data is only built for debug logging
+            if self.logger_q_instrument.isEnabledFor(logging.DEBUG):
+                self.logger_q_instrument.debug(f'times = {times*1000000}, data = {data}, plotinfo = {plotinfo}')
+                self.logger_q_instrument.debug(f'len times = {len(times)}, len data = {len(data)}')
+                self.logger_q_instrument.debug(f'max value counts unedited = '
+                                               f'{np.max(self.photon_histogram(), initial=0)}')
             self.measurement_complete.emit(times, data, plotinfo)
 
     def _invert_data(self, data: np.ndarray):
         """ Invert the data """
         self.logger_q_instrument.debug('inverting data')
-        max_counts = pow(2, self.adc_number_of_bits) - 1
-        data = -(data - max_counts)
-        return data
+        return pulseprocessing.invert(data, self.adc_bits)
 
     def _process_data(self, data):
         """
         Send the data through average pulses or single photon counting routine if that measurement mode is enabled
         otherwise do nothing
+
+        :param data: block of pulses [pulses][samples]
         """
         if self.measurement_mode == 'single photon counting':
             self._single_photon_counting(data)
@@ -159,177 +294,146 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         Correct for the jitter in the signal which is present with regards to the trigger input. Connect
         trigger TTL form laser via attenuator to input channel. Trigger will be registered taken when a treshold is
         passed on the input signal.
-        :param data: single event measurement [channels][samples]
+        :param data: block of event measurements [channels][pulses][samples]
         :type data: np.ndarray
+        :returns: corrected data channel [pulses][samples]
         """
         if not self.jitter_correction_enabled or len(data) == 1:
             self.logger_q_instrument.debug(f'no jitter correction, data shape = {np.shape(data)}, '
                                            f'channels = {self.active_channels}')
             return data[0]
-        else:
-            self.logger_q_instrument.debug(f'data for jitter correction = {np.shape(data)}')
-            # get the correct channels. channel order based on channel index.
-            data, jitter = (data[0], data[1]) if self.data_channel < self.jitter_channel else (data[1], data[0])
-        # check if valid signal - jitter pulse through attenuator should have an amplitude of around 1500 counts
-        if (jitterspread := np.max(jitter)-np.min(jitter)) < 100:
-            self.logger_q_instrument.warning(f'jitter signal spread = {jitterspread} - no significant signal, '
-                                             f'please check jitter signal connection. No correction applied')
-            return data
-        else:
-            self.logger_q_instrument.debug(f'jittersignal spread = {jitterspread} - good signal - '
-                                           f'correcting for jitter')
-            # get indice of pulse start by comparing to treshold. trigger pulse is positive.
-            treshold = np.min(jitter) + int(0.5 * jitterspread)
-            self.logger_q_instrument.debug(f'treshold = {treshold}, max = {np.max(jitter)}, min = {np.min(jitter)}, '
-                                           f'first value = {jitter[0]}')
-            over_treshold = np.argmax(jitter > treshold)
-            if not self.jitter_startsample:
-                self.logger_q_instrument.debug(f'first jitter correction sigal, set startsample'
-                                               f' indice at {over_treshold}')
-                self.jitter_startsample = over_treshold
-                return data
-            else:
-                shift = self.jitter_startsample - over_treshold
-                self.logger_q_instrument.debug(f'shifting pulse with {shift} samples')
-                if shift == 0:
-                    return data
-                # data is shifted, data outside boundary replaced with neighbour value. This is acceptable because
-                # shift is maximum one sample
-                elif shift > 0:
-                    data = np.hstack((data[(shift-1):-1], np.ones(shift)*data[-1]))
-                else:
-                    shift = abs(shift)
-                    data = np.hstack((np.ones(shift)*data[0], data[0:-shift]))
-
+        self.logger_q_instrument.debug(f'data for jitter correction = {np.shape(data)}')
+        # get the correct channels. channel order based on channel index.
+        data, jitter = (data[0], data[1]) if self.data_channel < self.jitter_channel else (data[1], data[0])
+        # jitter pulse through attenuator should have an amplitude of around 1500 counts, pulses without a valid
+        # jitter signal are not corrected
+        data, valid, self.jitter_startsample = pulseprocessing.jitter_correction(data, jitter, self.jitter_startsample)
+        if (invalid := np.count_nonzero(~valid)):
+            self.logger_q_instrument.warning(f'{invalid} out of {len(valid)} pulses without significant jitter signal, '
+                                             f'please check jitter signal connection. No correction applied to these')
+        self.logger_q_instrument.debug(f'jitter correction startsample = {self.jitter_startsample}')
         return data
 
     def _plot_single_pulse(self, data):
         """
         Select only the datachannel from the data and make a corresponding timevector to emit to plotwindow.
-        Compress the data if number of samples is above a set value (avoid plotting extremely lengthy data)
+        The data is emitted at full resolution, the plotwindow decimates it for plotting.
         :param data: single event measurement [channels][samples]
         :returns: times (time array), data (data array), plotinfo (string)
         """
         self.logger_q_instrument.info('selecting plotdata single pulse')
-        samples = len(data)
-        if samples > self.max_plot_points:
-            times, data, plotinfo, _ = self._compress_long_data(data, samples)
-        else:
-            plotinfo = 'uncompressed data'
-            times = np.linspace(0, (samples - 1) / self.sample_rate, samples)
-
-        return times, data, plotinfo
-
-    def _find_next_power_two(self, n):
-        """
-        Find the (positive) power of two closes to n. For example, input n = 17 returns 32.
-        Smallest output is 2^1 or 1. All values smaller or equal to one (also negative) return 2.
+        times = self._time_vector(len(data))
+        return times, data, f'{len(data)} samples'
 
-        :param n: input value
-        :type n: int
-        :returns: closest power of two to input value n
+    def _time_vector(self, samples, step=1):
         """
-        self.logger_q_instrument.debug(f'finding highest power of 2 that {n} can be divided by')
-        # return values outside of range to 1
-        n = 1 if n <= 1 else n
-        # decrement `n` (to handle cases when `n` itself
-        # is a power of 2)
-        n = n - 1
-        # do till only one bit is left
-        while n & n - 1:
-            n = n & n - 1  # unset rightmost bit
-        # `n` is now a power of two (less than `n`)
-        # increase n by one if n is 0
-        n = 1 if n == 0 else n
-        # return next power of 2
-        return n << 1
-
-    def _compress_long_data(self, data, samples):
-        """
-        Compress the data with a factor which is the smallest power of two to make the number of datapoints smaller
-        than the maximum set number of datapoints to plot.
+        Return the time vector for a number of samples, each step samples apart. Time vectors are cached as they are
+        the same for every emit with the same settings.
 
-        :param data: data to compress
-        :param samples: number of samples in the data
-        :returns data: compressed data
+        :param samples: number of time points
+        :param step: number of digitizer samples per time point
         """
-
-        self.logger_q_instrument.info('compressing long data for plotting')
-        maindivision = int(samples // self.max_plot_points)
-        compressionfactor = self._find_next_power_two(maindivision)
-
-        data = np.reshape(data, (int(samples // compressionfactor), int(compressionfactor)))
-        data = np.mean(data, axis=1)
-        times = np.linspace(0, (samples - 1) / self.sample_rate, int(samples // compressionfactor))
-        mu = unicodedata.lookup('greek small letter mu')
-        plotinfo = f'data compressed for plotting in {compressionfactor * 1/self.sample_rate * 1e6} {mu}s timebins'
-        return times, data, plotinfo, compressionfactor
+        key = (samples, step)
+        if key not in self.time_vectors:
+            self.logger_q_instrument.debug(f'creating time vector for {samples} samples with step {step}')
+            if len(self.time_vectors) > 8:
+                self.time_vectors.clear()
+            self.time_vectors[key] = np.linspace(0, (samples - 1) * step / self.sample_rate, samples)
+        return self.time_vectors[key]
 
     def _average_pulses(self, data):
         """
         Take the average of multiple pulses. To take the average, the pulses need to be normalized.
 
-        :param data: [samples]
+        :param data: [pulses][samples]
         :type data: np.ndarray
         """
-        self.logger_q_instrument.debug('taking average of pulses')
-        self.pulse_counter += 1
-        # subtract the average of the first 30 datapoints.
-        data = data - np.mean(data[0:30])
-        data = data / np.max(data)
-        self.logger_q_instrument.debug(f'tried to divide by {np.max(data)}')
-        try:
-            self.logger_q_instrument.debug('adding pulse')
-            self.average_pulses = (self.average_pulses * (self.pulse_counter - 1) + data) / self.pulse_counter
-        except ValueError as e:
-            self.logger_q_instrument.info(f'could not add pulse to added pulses, resetting added pulses {e}')
-            self.pulse_counter = 1
-            self.average_pulses = data
+        self.logger_q_instrument.debug(f'taking average of {len(data)} pulses')
+        if self.pulse_counter and np.shape(self.average_pulses) != data.shape[1:]:
+            self.logger_q_instrument.info('number of samples changed, resetting averaged pulses')
+        data = pulseprocessing.normalize(data)
+        self.convergence.add_integrals(np.sum(data, axis=1))
+        self.average_pulses, self.pulse_counter = pulseprocessing.accumulate_average(
+            self.average_pulses, self.pulse_counter, data)
 
     def _compress_average_pulses(self):
-        """ Compress the averaged pulses for plotting if the length exceeds the maximum plot length """
+        """ Create the time vector and plotinfo for the averaged pulses, the plotwindow decimates them for plotting """
         self.logger_q_instrument.info('creating time vector and plotinfo averageing')
         samples = len(self.average_pulses)
-        if samples > self.max_plot_points:
-            times, data, compinfo, _ = self._compress_long_data(self.average_pulses, samples)
-        else:
-            self.logger_q_instrument.debug('uncompressed data')
-            data = self.average_pulses
-            compinfo = 'uncompressed data'
-            times = np.linspace(0, (samples - 1) / self.sample_rate, samples)
-
-        return times, data, compinfo
+        times = self._time_vector(samples)
+        return times, self.average_pulses, f'{samples} samples'
 
     def _single_photon_counting(self, data):
         """
         Register single photon counts by counting the data which is higher than the user-set treshold value.
-        Only registers a count when previous value is below treshold. A scipy filter is used for this operation as
-        it is much faster than a loop.
+        Only registers a count when previous value is below treshold. The counts of all pulses in the block are found
+        at once by comparing each sample to the previous one.
 
-        Add all the counts to the single photon counts attribute which grows with each measurement until it is reset
-        :param data: single event measurement [samples]
+        Add all the counts to the single photon counts attribute which grows with each measurement until it is reset.
+        In list mode only the sample indices of the counts are stored per pulse, see _register_photon_times.
+        :param data: block of event measurements [pulses][samples]
         :type data: np.ndarray
-        :returns: single photon counts array
         """
-        self.logger_q_instrument.info('counting single photon counts over treshold')
-        self.pulse_counter += 1
-
-        data_over_treshold = data > self.single_photon_counting_treshold
-        filter_doublecounts = np.array([1, 0])
-        data_corrected = data_over_treshold > sp.maximum_filter(
-            data_over_treshold, footprint=filter_doublecounts, mode='constant', cval=-np.inf)
-        data_corrected = data_corrected.astype(int)
+        self.logger_q_instrument.info(f'counting single photon counts over treshold in {len(data)} pulses')
         self.logger_q_instrument.debug(f'single photon treshold = {self.single_photon_counting_treshold}')
-        self.logger_q_instrument.debug(f'single photon over treshold = {data_over_treshold}')
-        self.logger_q_instrument.debug(f'single photon counts: {data_corrected}')
-        try:
-            self.logger_q_instrument.debug('adding pulse single photon counts')
-            self.single_photon_counts += data_corrected
-        except ValueError as e:
-            self.logger_q_instrument.info(f'number of samples changed, resetting single photon counts and pulse '
-                                          f'counter. full error message: {e}')
-            self.pulse_counter = 1
-            self.single_photon_counts = data_corrected
+        counts = pulseprocessing.photon_edges(data, self.single_photon_counting_treshold)
+        self.convergence.add_counts(np.count_nonzero(counts), len(counts))
+        if self.list_mode:
+            self._register_photon_times(counts)
+            return
+        if self.pulse_counter and np.shape(self.single_photon_counts) != data.shape[1:]:
+            self.logger_q_instrument.info('number of samples changed, resetting single photon counts and pulse counter')
+        self.single_photon_counts, self.pulse_counter = pulseprocessing.accumulate_counts(
+            self.single_photon_counts, self.pulse_counter, counts)
+
+    def _register_photon_times(self, counts):
+        """
+        Store the single photon counts of a block of pulses in list mode, as the sample indices of the counts and the
+        number of counts per pulse. Resets the stored counts if the number of samples changed.
+
+        :param counts: photon counts [pulses][samples] (bool)
+        """
+        if self.pulse_counter and self.photon_samples != counts.shape[1]:
+            self.logger_q_instrument.info('number of samples changed, resetting photon times and pulse counter')
+            self.photon_times, self.photon_counts, self.pulse_counter = [], [], 0
+        times, counts_per_pulse = pulseprocessing.photon_times(counts)
+        self.photon_times.append(times)
+        self.photon_counts.append(counts_per_pulse)
+        self.photon_samples = counts.shape[1]
+        self.pulse_counter += len(counts)
+
+    @property
+    def list_mode_active(self):
+        """ Single photon counts are stored in list mode """
+        return self.list_mode and self.measurement_mode == 'single photon counting'
+
+    def list_mode_data(self):
+        """
+        Return the list mode single photon counts. The counts of pulse i are times[offsets[i]:offsets[i + 1]], with
+        offsets the cumulative sum of the counts per pulse starting at 0.
+
+        :returns: sample indices of all photon counts (uint32), number of photon counts per pulse (uint32)
+        """
+        if not self.photon_times:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32)
+        # join the stored blocks once, so the next call only joins the blocks added since
+        self.photon_times = [np.concatenate(self.photon_times)]
+        self.photon_counts = [np.concatenate(self.photon_counts)]
+        return self.photon_times[0], self.photon_counts[0]
+
+    def photon_histogram(self, binning: int = 1):
+        """
+        Return the single photon counts per bin of a number of samples. In list mode the histogram is built from the
+        photon times.
+
+        :param binning: number of samples per bin
+        """
+        if self.list_mode:
+            times, _ = self.list_mode_data()
+            return pulseprocessing.photon_histogram(times, self.photon_samples, binning)
+        if binning == 1:
+            return self.single_photon_counts
+        return np.reshape(self.single_photon_counts, (-1, binning)).sum(axis=1)
 
     def set_compression_factor(self, factor: str):
         """ Sets the compression factor for single photon counting """
@@ -343,32 +447,23 @@ class QDigitizer(CAENlib.Digitizer, QObject):
 
     def _compress_single_photon_counts(self):
         """
-        Compress single photon counts by the set compression factor for plotting. Do check if chosen compression
-        factor is enough.
+        Compress single photon counts by the set compression factor for plotting. The plotwindow decimates the
+        compressed counts further if needed.
         """
 
         self.logger_q_instrument.debug(f'compressing single photon counts with {self.compression_factor}')
         # factors are chosen such that this has 0 remainder
-        samples = len(self.single_photon_counts)
+        single_photon_counts = self.photon_histogram()
+        samples = len(single_photon_counts)
         bins = samples // self.compression_factor
-        data = np.reshape(self.single_photon_counts, (bins, self.compression_factor))
+        data = np.reshape(single_photon_counts, (bins, self.compression_factor))
         data = np.mean(data, axis=1)
         data = data - np.min(data)
         # only divide by max data if not all zero
         if maxdata := np.max(data):
             data = data/maxdata
-        # check length again to see if additional compression is needed
-        if (samples := len(data)) > self.max_plot_points:
-            self.logger_q_instrument.debug('additional compression single photon counts needed')
-            times, data, _, additional_compressionfactor = self._compress_long_data(data, samples)
-            totalfactor = self.compression_factor*additional_compressionfactor
-            mu = unicodedata.lookup('greek small letter mu')
-            plotinfo = f'{self.pulse_counter} pulses - for plotting, compression increased by' \
-                       f' {additional_compressionfactor} to {totalfactor/self.sample_rate*1_000_000:.3f} {mu}s'
-        else:
-            self.logger_q_instrument.debug('no additional compression done')
-            times = np.linspace(0, (samples - 1)*self.compression_factor / self.sample_rate, samples)
-            plotinfo = f'{self.pulse_counter} pulses'
+        times = self._time_vector(len(data), self.compression_factor)
+        plotinfo = f'{self.pulse_counter} pulses'
 
         return times, data, plotinfo
 
@@ -416,8 +511,11 @@ class QDigitizer(CAENlib.Digitizer, QObject):
         """ Clear the registered single photon counts and multiple measurements average. Set pulse counter to 0 """
         self.logger_q_instrument.info('clearing measurements')
         self.single_photon_counts = np.empty(0)
+        self.photon_times = []
+        self.photon_counts = []
+        self.photon_samples = 0
         self.average_pulses = np.empty(0)
-        self.jitter_startsample = np.empty(0)
+        self.jitter_startsample = 0
         self.pulse_counter = 0
 
     @pyqtSlot(int)
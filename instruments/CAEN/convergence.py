@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class ConvergenceMonitor:
+    """
+    Estimates the statistical uncertainty of a decay measurement while measuring, to stop a measurement point once
+    it is measured accurately enough.
+
+    For single photon counting the photon counts are Poisson distributed, the relative error of the total intensity
+    is 1/sqrt(counts). For averaging the per pulse integrals of the normalized pulses are tracked with Welford's
+    running mean and variance (merged per block), the relative error is the standard error of the mean integral
+    divided by the mean integral.
+    """
+
+    def __init__(self, target_relative_error=0.01, target_counts=0, min_pulses=100):
+        """
+        :param target_relative_error: relative error at which the measurement is converged, 0 to disable
+        :param target_counts: total photon counts at which the measurement is converged, 0 to disable
+        :param min_pulses: minimum number of pulses before the measurement can be converged
+        """
+        self.target_relative_error = target_relative_error
+        self.target_counts = target_counts
+        self.min_pulses = min_pulses
+        self.reset()
+
+    def reset(self):
+        """ Start monitoring a new measurement point """
+        self.pulses = 0
+        self.counts = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add_counts(self, counts: int, pulses: int):
+        """ Add the total photon counts of a block of pulses """
+        self.counts += int(counts)
+        self.pulses += pulses
+
+    def add_integrals(self, integrals: np.ndarray):
+        """ Add the integrals of a block of normalized pulses, merging the block mean and variance (Chan et al.) """
+        if not len(integrals):
+            return
+        n = len(integrals)
+        mean = np.mean(integrals)
+        m2 = np.sum((integrals - mean) ** 2)
+        total = self.pulses + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.pulses * n / total
+        self.pulses = total
+
+    def relative_error(self):
+        """ Return the current relative error estimate, infinite if it cannot be estimated yet """
+        if self.counts:
+            return 1 / np.sqrt(self.counts)
+        if self.pulses > 1 and self.mean:
+            return np.sqrt(self.m2 / (self.pulses - 1) / self.pulses) / abs(self.mean)
+        return np.inf
+
+    def converged(self):
+        """ Return True if the target relative error or total counts are reached after the minimum pulses """
+        if self.pulses < self.min_pulses:
+            return False
+        if self.target_counts and self.counts >= self.target_counts:
+            return True
+        return bool(self.target_relative_error) and self.relative_error() <= self.target_relative_error
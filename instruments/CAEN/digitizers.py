@@ -5,6 +5,7 @@ import os
 import numpy as np
 import instruments.CAEN.definitions as definitions
 from instruments.CAEN.definitions import AcqMode, IOLevel, TriggerMode, TriggerPolarity
+from instruments.CAEN.readoutlatency import AdaptiveReadoutLatency, FALLBACK_LATENCY, backoff_wait
 from pathlib import Path
 import logging
 
@@ -12,7 +13,30 @@ import logging
 # Add location of digitizer dll library to path
 os.environ['PATH'] = os.path.dirname(__file__) + os.pathsep + 'lib' + os.pathsep + 'x86_64' ';' + os.environ['PATH']
 pathdigilib = Path(__file__).parent / 'lib/x86_64/CAENDigitizer.dll'
-_lib = windll.LoadLibrary(str(pathdigilib))
+
+
+class CountingLibrary:
+    """
+    Forwards all function calls to the digitizer library and counts them, used to check how many library calls are
+    made per measured pulse.
+    """
+    def __init__(self, library):
+        self._library = library
+        self.calls = 0
+
+    def __getattr__(self, name):
+        function = getattr(self._library, name)
+
+        def counted(*args):
+            self.calls += 1
+            return function(*args)
+
+        # store the wrapper so the library function is only looked up once
+        setattr(self, name, counted)
+        return counted
+
+
+_lib = CountingLibrary(windll.LoadLibrary(str(pathdigilib)))
 
 
 def list_available_devices():
@@ -81,7 +105,39 @@ class Digitizer(DigitizerHandle):
         self.buffer = c_char_p()
         self.buffer_size = c_uint32(0)
         self.event = pointer(definitions.UINT16_EVENT())
-        self.rl = 0   # parameter only used for enabling wait time in read data function
+        self.rl = 0   # parameter only used for the readout latency at long record lengths
+        self.adaptive_readout = True
+        self.readout_latency = AdaptiveReadoutLatency()
+        self.session_active = False
+        self.event_buffer = None
+        self.settings_cache = {}
+
+    @property
+    def dll_calls(self):
+        """ Total number of calls made to the digitizer library """
+        return _lib.calls
+
+    def cache_settings(self):
+        """
+        Read the board information and the settings read during measurements into the settings cache. Cached
+        settings are returned without calling the library until they are invalidated by the corresponding setter.
+        """
+        self.logger_instrument.info('caching digitizer settings')
+        self.invalidate_settings()
+        for setting in ['adc_number_of_bits', 'number_of_channels', 'record_length', 'post_trigger_size',
+                        'max_num_events_blt', 'buffer_organization', 'channel_enable_mask']:
+            getattr(self, setting)
+
+    def invalidate_settings(self, *settings):
+        """
+        Remove settings from the settings cache, so they are read from the digitizer the next time.
+
+        :param settings: names of the settings to remove, all settings if none given
+        """
+        if not settings:
+            self.settings_cache.clear()
+        for setting in settings:
+            self.settings_cache.pop(setting, None)
 
     @property
     def buffer_size_max(self):
@@ -93,15 +149,18 @@ class Digitizer(DigitizerHandle):
     @property
     def sample_rate(self):
         """ Return sample rate in samples/s """
-        self.logger_instrument.info('Requesting sample rate')
+        self.logger_instrument.debug('Requesting sample rate')
         return definitions.SampleRate[definitions.ModelNumber[self.model]] * 1e6
 
     @property
     def record_length(self):
         """ Gets the record length """
+        if 'record_length' in self.settings_cache:
+            return self.settings_cache['record_length']
         return_value = c_uint32(0)
         handle_error(_lib.CAEN_DGTZ_GetRecordLength(self._handle, byref(return_value)))
         self.logger_instrument.info(f'record length = {return_value.value} samples per channel')
+        self.settings_cache['record_length'] = return_value.value
         return return_value.value
 
     @record_length.setter
@@ -120,48 +179,63 @@ class Digitizer(DigitizerHandle):
         elif value > 10:
             value = 10
             self.logger_instrument.warning(f'specified record length too big, set to maximum value: {value}')
+        self.finish_session()
         self.rl = value
         post_trigger_size = self.post_trigger_size
         buffer_size = self.buffer_size_max
         record_length = buffer_size // (1 << (10 - value))
         set_value = c_uint32(record_length)
         handle_error(_lib.CAEN_DGTZ_SetRecordLength(self._handle, set_value))
+        # setting the record length changes the buffer organization
+        self.invalidate_settings('record_length', 'buffer_organization', 'max_num_events_blt')
         self.logger_instrument.info(f'set record length to {record_length} samples per channel')
         self.post_trigger_size = post_trigger_size
 
     def manual_record_length(self, value):
         """ Sets the record length to a manual value """
+        self.finish_session()
         set_value = c_uint32(value)
         handle_error(_lib.CAEN_DGTZ_SetRecordLength(self._handle, set_value))
+        self.invalidate_settings('record_length', 'buffer_organization', 'max_num_events_blt', 'post_trigger_size')
         self.logger_instrument.info(f'set record length to manual value of {value} samples')
 
     @property
     def post_trigger_size(self):
         """ Get/sets the post trigger size """
+        if 'post_trigger_size' in self.settings_cache:
+            return self.settings_cache['post_trigger_size']
         return_value = c_uint32(0)
         handle_error(_lib.CAEN_DGTZ_GetPostTriggerSize(self._handle, byref(return_value)))
         self.logger_instrument.info(f'Requested post trigger size, is {return_value.value}')
+        self.settings_cache['post_trigger_size'] = return_value.value
         return return_value.value
 
     @post_trigger_size.setter
     def post_trigger_size(self, value):
         self.logger_instrument.info(f'setting post trigger size to {value}')
+        self.finish_session()
         set_value = c_uint32(value)
         handle_error(_lib.CAEN_DGTZ_SetPostTriggerSize(self._handle, set_value))
+        self.invalidate_settings('post_trigger_size')
 
     @property
     def max_num_events_blt(self):
         """ Get/Sets the maximum number of events per block transfer """
+        if 'max_num_events_blt' in self.settings_cache:
+            return self.settings_cache['max_num_events_blt']
         return_value = c_uint32(0)
         handle_error(_lib.CAEN_DGTZ_GetMaxNumEventsBLT(self._handle, byref(return_value)))
         self.logger_instrument.info(f'Max num events per block transfer = {return_value.value}')
+        self.settings_cache['max_num_events_blt'] = return_value.value
         return return_value.value
 
     @max_num_events_blt.setter
     def max_num_events_blt(self, value):
         self.logger_instrument.info(f'Setting max num events per block transfer to {value}')
+        self.finish_session()
         set_value = c_uint32(value)
         handle_error(_lib.CAEN_DGTZ_SetMaxNumEventsBLT(self._handle, set_value))
+        self.invalidate_settings('max_num_events_blt')
 
     @property
     def buffer_organization(self):
@@ -171,10 +245,13 @@ class Digitizer(DigitizerHandle):
         :return:
             Buffer code
         """
+        if 'buffer_organization' in self.settings_cache:
+            return self.settings_cache['buffer_organization']
         address = 0x800c
         value = c_int32(0)
         handle_error(_lib.CAEN_DGTZ_ReadRegister(self._handle, address, byref(value)))
         self.logger_instrument.debug(f'Number of buffers per channel memory = {1 << value.value}')
+        self.settings_cache['buffer_organization'] = 1 << value.value
         return 1 << value.value
 
     @buffer_organization.setter
@@ -182,23 +259,29 @@ class Digitizer(DigitizerHandle):
         address = 0x800c
         set_value = c_int32(set_value)
         handle_error(_lib.CAEN_DGTZ_WriteRegister(self._handle, address, set_value))
+        self.invalidate_settings('buffer_organization', 'max_num_events_blt')
         self.logger_instrument.debug(f'Number of buffers per channel memory set to {1 << set_value.value}')
 
     @property
     def number_of_channels(self):
         """ Returns the number of channels this digitizer has """
-
+        if 'number_of_channels' in self.settings_cache:
+            return self.settings_cache['number_of_channels']
         board_info = definitions.BoardInfo()
         _lib.CAEN_DGTZ_GetInfo(self._handle, byref(board_info))
         self.logger_instrument.debug(f'Number of channels on board  = {board_info.Channels}')
+        self.settings_cache['number_of_channels'] = board_info.Channels
         return board_info.Channels
 
     @property
     def adc_number_of_bits(self):
         """ Returns the number of ADC bits """
+        if 'adc_number_of_bits' in self.settings_cache:
+            return self.settings_cache['adc_number_of_bits']
         board_info = definitions.BoardInfo()
         _lib.CAEN_DGTZ_GetInfo(self._handle, byref(board_info))
         self.logger_instrument.debug(f'requested number of adc bits, is {board_info.ADC_NBits}')
+        self.settings_cache['adc_number_of_bits'] = board_info.ADC_NBits
         return board_info.ADC_NBits
 
     @property
@@ -232,9 +315,12 @@ class Digitizer(DigitizerHandle):
         Get the enabled channel mask. Each enabled channel corresponds to a bit e.g. '1101' or 13 means channels
         0, 2 and 3 enabled
         """
+        if 'channel_enable_mask' in self.settings_cache:
+            return self.settings_cache['channel_enable_mask']
         return_value = c_uint32(0)
         handle_error(_lib.CAEN_DGTZ_GetChannelEnableMask(self._handle, byref(return_value)))
         self.logger_instrument.debug(f'Channel enable mask  = {return_value.value}')
+        self.settings_cache['channel_enable_mask'] = bin(return_value.value)
         return bin(return_value.value)
 
     @channel_enable_mask.setter
@@ -244,8 +330,10 @@ class Digitizer(DigitizerHandle):
         :param value: mask (bit per channel -> 13 corresponds to 1101 or channels [0, 2, 3]
         """
         self.logger_instrument.debug(f'Setting channel enable mask to {value}')
+        self.finish_session()
         set_value = c_uint32(value)
         handle_error(_lib.CAEN_DGTZ_SetChannelEnableMask(self._handle, set_value))
+        self.invalidate_settings('channel_enable_mask')
 
     def set_channel_gain(self, channel, value):
         self.logger_instrument.debug(f'setting channel {channel} gain to {value}')
@@ -587,10 +675,13 @@ class Digitizer(DigitizerHandle):
 
         self.board_info = self._hardware_info()
         self.buffer = pointer(c_char())
+        self.cache_settings()
 
     def close(self):
         """ Close the Digitizer connection. """
         self.logger_instrument.info('closing digitizer')
+        self.finish_session()
+        self.invalidate_settings()
         handle_error(_lib.CAEN_DGTZ_Reset(self._handle))
         handle_error(_lib.CAEN_DGTZ_CloseDigitizer(self._handle))
 
@@ -639,6 +730,44 @@ class Digitizer(DigitizerHandle):
         self.free_event()
         self.free_readout_buffer()
 
+    def start_session(self):
+        """
+        Start a measurement session. The readout buffer and event are allocated and the acquisition is started once,
+        after which events can be read continuously with read_single_event until finish_session is called. Does
+        nothing if a session is already active.
+        """
+        if self.session_active:
+            return
+        self.logger_instrument.info('starting measurement session')
+        self.allocate_event_buffer()
+        self.start_measurement()
+        self.session_active = True
+
+    def allocate_event_buffer(self):
+        """
+        Allocate the array events of a block transfer are decoded into. The array is sized for the current record
+        length, active channels and maximum number of events per block transfer and is reused for every block of the
+        session, so no arrays are allocated while reading events. The events are kept as the uint16 samples of the
+        digitizer, they are only converted to float where the processing needs it.
+        """
+        shape = (len(self.active_channels), self.max_num_events_blt, self.record_length)
+        if self.event_buffer is None or self.event_buffer.shape != shape:
+            self.logger_instrument.info(f'allocating event buffer with shape {shape}')
+            self.event_buffer = np.zeros(shape, dtype=np.uint16)
+        return self.event_buffer
+
+    def finish_session(self):
+        """
+        Stop the acquisition and free the buffers of the active measurement session. Called when a measurement point
+        is finished and by every setter which changes the buffer size or acquisition settings. Does nothing if no
+        session is active.
+        """
+        if not self.session_active:
+            return
+        self.logger_instrument.info('finishing measurement session')
+        self.session_active = False
+        self.finish_measurement()
+
     def allocate_event(self):
         """
         This function allocates the memory buffer for the decoded event data. The size of the buffer is calculated
@@ -676,18 +805,22 @@ class Digitizer(DigitizerHandle):
 
         return evtptr, event_info
 
-    def decode_event(self, evtptr, active_channels):
+    def decode_event(self, evtptr, active_channels, out=None):
         """
         Decode an event into data.
 
+        The channel data is not copied element by element but read through a NumPy view over the ctypes buffer of
+        the decoded event (see channel_view). If an output array is given the data is copied into that array without
+        allocating, otherwise a new array is returned.
+
         :param evtptr: Pointer to the event to be decoded, is returned from GetEventInfo
-        :return: measurement data as [channels][samples]
+        :param active_channels: channels to decode
+        :param out: optional preallocated uint16 array [channels][samples] with at least the channel size as samples
+        :return: measurement data as [channels][samples] (uint16)
         """
 
         self.logger_instrument.debug(f'Decode Event {evtptr}')
         handle_error(_lib.CAEN_DGTZ_DecodeEvent(self._handle, evtptr, byref(self.event)))
-        number_of_channels = len(self.active_channels)
-        self.logger_instrument.debug(f'digitzier decode active channels = {self.active_channels}')
 
         channel_size = 0
         for channel in active_channels:
@@ -696,11 +829,25 @@ class Digitizer(DigitizerHandle):
                 break
 
         self.logger_instrument.debug(f'digitizer channel size = {channel_size}')
-        data = np.zeros((number_of_channels, channel_size))
+        if out is None:
+            out = np.empty((len(active_channels), channel_size), dtype=np.uint16)
+        else:
+            out = out[:, :channel_size]
 
         for count, channel in enumerate(active_channels):
-            data[count] = self.event.contents.DataChannel[channel][0:channel_size]
-        return data
+            np.copyto(out[count], self.channel_view(channel, channel_size))
+        return out
+
+    def channel_view(self, channel, channel_size):
+        """
+        Return a NumPy view straight over the samples of a channel of the last decoded event. The view shares memory
+        with the event buffer, so it is only valid until the next event is decoded or the event is freed.
+
+        :param channel: channel to view
+        :param channel_size: number of samples in the channel
+        :return: uint16 array [samples]
+        """
+        return np.ctypeslib.as_array(self.event.contents.DataChannel[channel], shape=(channel_size,))
 
     def decode_only(self, ptr):
         """ Decode the event to which the pointer points. """
@@ -717,18 +864,13 @@ class Digitizer(DigitizerHandle):
         self.logger_instrument.debug('CAEN DT57xx Read data')
         self.buffer_size = c_uint32(0)
         readmode = c_uint32(readoutmode)
-        # not pretty but without this wait for longer record lengths the readout will crash
-        if 7 < self.rl < 10:
-            time.sleep(0.2)
-        elif self.rl == 10:
-            time.sleep(0.5)
-        _lib.CAEN_DGTZ_ReadData(self._handle, readmode, self.buffer, byref(self.buffer_size))
+        handle_error(_lib.CAEN_DGTZ_ReadData(self._handle, readmode, self.buffer, byref(self.buffer_size)))
         self.logger_instrument.debug(f"ReadData self.buffersizesize.value : {self.buffer_size}")
         return self.buffer_size.value
 
     def read_readout_status(self):
         """ Read the Readout Status register. """
-        self.logger_instrument.info('Read CAEN DT57xx Acquisition Status Register')
+        self.logger_instrument.debug('Read CAEN DT57xx Acquisition Status Register')
         address = 0xEF04
         status = c_int32(0)
         handle_error(_lib.CAEN_DGTZ_ReadRegister(self._handle, address, byref(status)))
@@ -766,7 +908,7 @@ class Digitizer(DigitizerHandle):
         NOTE: the value of this register cannot exceed the maximum number of available buffers according to the
         register address 0x800C (max num events BLT).
         """
-        self.logger_instrument.info('Read CAEN DT57xx Events Stored Register')
+        self.logger_instrument.debug('Read CAEN DT57xx Events Stored Register')
         address = 0x812C
         events = c_int32(0)
         handle_error(_lib.CAEN_DGTZ_ReadRegister(self._handle, address, byref(events)))
@@ -789,28 +931,136 @@ class Digitizer(DigitizerHandle):
         self.logger_instrument.debug('DT57XX Stopped acquisition with software command')
         handle_error(_lib.CAEN_DGTZ_SWStopAcquisition(self._handle))
 
+    def wait_for_events(self, stop=None):
+        """
+        Wait until the digitizer has an event ready for readout. The readout status register is polled with a growing
+        interval. At long record lengths reading out directly after the event is ready crashes the digitizer (DT5724),
+        so the readout waits a bit longer and until the event is counted in the events stored register. This latency is
+        the fixed fallback latency, or if adaptive readout is enabled the latency learned per record length by the
+        adaptive readout latency, which is raised after failed readouts and with probing lowered below the fallback.
+
+        :param stop: optional function returning True when the wait should be abandoned, checked at every poll
+        :return: True if events are ready, False if the wait was stopped
+        """
+        stopped = stop or (lambda: False)
+        backoff_wait(lambda: self.read_readout_status() & 1 or stopped())
+        if stopped():
+            return False
+        if self.adaptive_readout:
+            latency = self.readout_latency.latency(self.rl)
+        else:
+            latency = FALLBACK_LATENCY.get(self.rl, 0)
+        if latency:
+            time.sleep(latency)
+            backoff_wait(lambda: self.events_stored() > 0 or stopped())
+        return not stopped()
+
+    def read_ready_data(self, stop=None):
+        """
+        Wait for events and read them out with a block transfer. A failed or empty readout is registered with the
+        adaptive readout latency, which raises the latency for this record length, and is retried once after the
+        raised latency.
+
+        :param stop: optional function returning True when waiting for events should be abandoned
+        :return: size of the data read in bytes, 0 if the wait was stopped
+        """
+        if not self.wait_for_events(stop):
+            return 0
+        try:
+            size = self.read_data(definitions.ReadMode.POLLING_MBLT.value)
+        except definitions.Error as e:
+            if not self.adaptive_readout:
+                raise
+            self.logger_instrument.warning(f'readout failed with error {e}')
+            size = 0
+        if not self.adaptive_readout:
+            return size
+        if size:
+            self.readout_latency.success(self.rl)
+            return size
+        self.readout_latency.failure(self.rl)
+        time.sleep(self.readout_latency.latency(self.rl))
+        backoff_wait(lambda: self.read_readout_status() & 1 or (stop is not None and stop()))
+        if stop is not None and stop():
+            return 0
+        return self.read_data(definitions.ReadMode.POLLING_MBLT.value)
+
+    def read_single_event(self, active_channels, out=None):
+        """
+        Wait for an event in the running acquisition, read it out and decode it. Buffers must have been allocated and
+        the acquisition started, either by start_measurement or by start_session.
+
+        :param active_channels: channels to decode
+        :param out: optional preallocated array [channels][samples] to decode the event into
+        :return: data [channels][samples]
+        """
+        self.read_ready_data()
+        evtptr, _ = self.get_event_info(0)
+        return self.decode_event(evtptr, active_channels, out)
+
+    def read_event_block(self, active_channels, out=None, stop=None):
+        """
+        Wait for events in the running acquisition and read out all stored events, up to the maximum number of events
+        per block transfer, with a single block transfer. All events in the readout buffer are decoded.
+
+        The events are decoded into the given array, or into the event buffer of the session if no array is given.
+        The returned array is a view on that buffer which is overwritten by the next block. Without either buffer, a
+        new array is allocated.
+
+        :param active_channels: channels to decode
+        :param out: optional preallocated array [channels][events][samples] to decode the events into
+        :param stop: optional function returning True when waiting for events should be abandoned
+        :return: data [channels][events][samples], without events if the wait was stopped
+        """
+        if not self.read_ready_data(stop) and stop is not None and stop():
+            return np.zeros((len(active_channels), 0, 0), dtype=np.uint16)
+        num_events = self.get_num_events()
+        self.logger_instrument.debug(f'read {num_events} events in block transfer')
+        if out is None:
+            out = self.event_buffer if self.session_active else None
+        if out is None:
+            out = np.zeros((len(active_channels), max(num_events, 1), self.record_length), dtype=np.uint16)
+        num_events = min(num_events, out.shape[1])
+        channel_size = 0
+        for event_index in range(num_events):
+            evtptr, _ = self.get_event_info(event_index)
+            channel_size = self.decode_event(evtptr, active_channels, out[:, event_index]).shape[-1]
+        return out[:, :num_events, :channel_size]
+
+    def measurement_event_block(self):
+        """
+        Perform a block transfer measurement of multiple events. If a measurement session is active the events are
+        read from the running acquisition, otherwise the buffers are allocated and freed around the readout.
+
+        :return: data [channels][events][samples]
+        """
+        self.logger_instrument.debug('measure a block of events')
+        active_channels = self.active_channels
+        if self.session_active:
+            return self.read_event_block(active_channels)
+        self.start_measurement()
+        data = self.read_event_block(active_channels)
+        self.finish_measurement()
+
+        return data
+
     def measurement_single_event(self):
         """
         Perform a measurement of a single event. Steps involved: Allocate memory, start acquisition,
         check for data, read data, decode data, stop acquisition, free memory.
 
+        If a measurement session is active, the allocation and start/stop steps are skipped and the event is read
+        from the running acquisition.
+
         :return: data [channels][samples]
         """
         self.logger_instrument.debug('measure a single event')
         # check it here such that the correct number is used if channels are changed in meantime
         active_channels = self.active_channels
+        if self.session_active:
+            return self.read_single_event(active_channels)
         self.start_measurement()
-        # check if data is present, otherwise wait
-        while self.read_readout_status() & 1 == 0:
-            time.sleep(0.001)
-        # not pretty but necessary wait for longer record times to prevent digitizer from crashing (only for DT5724)
-        if 7 < self.rl < 10:
-            time.sleep(0.2)
-        elif self.rl == 10:
-            time.sleep(0.4)
-        self.read_data(definitions.ReadMode.POLLING_MBLT.value)
-        evtptr, _ = self.get_event_info(0)
-        data = self.decode_event(evtptr, active_channels)
+        data = self.read_single_event(active_channels)
         self.finish_measurement()
 
         return data
@@ -0,0 +1,176 @@
+"""
+Vectorized processing of blocks of digitizer pulses.
+
+All functions take a block of pulses as [pulses][samples] and process the whole block with array operations. The
+results are equal to processing the pulses one by one in the order they are in the block, which is how the QDigitizer
+used to process them.
+
+The pulses are read as the uint16 samples of the digitizer. Inverting keeps the integer type, the pulses are only
+converted to float by the normalization of the averaging mode.
+"""
+import numpy as np
+
+JITTER_MIN_SPREAD = 100   # minimum spread in adc counts of a valid jitter (trigger) signal
+BASELINE_SAMPLES = 30     # number of samples at the start of a pulse used as baseline for normalization
+
+
+def jitter_shifts(jitter: np.ndarray, startsample: int):
+    """
+    Determine for every pulse in the block how many samples it has to be shifted to correct for the jitter with
+    regards to the trigger. The trigger moment is the first sample of the jitter signal over the treshold halfway
+    between its minimum and maximum. Pulses with a jitter signal spread below JITTER_MIN_SPREAD are not shifted.
+
+    If no start sample is set yet, the first valid pulse sets it.
+
+    :param jitter: jitter signals [pulses][samples]
+    :param startsample: reference sample of the trigger, 0 if not set yet
+    :returns: shifts [pulses], valid [pulses] (bool), startsample
+    """
+    minimum = np.min(jitter, axis=1)
+    spread = np.max(jitter, axis=1) - minimum
+    valid = spread >= JITTER_MIN_SPREAD
+    treshold = minimum + np.trunc(0.5 * spread)
+    over_treshold = np.argmax(jitter > treshold[:, np.newaxis], axis=1)
+
+    shifts = np.zeros(len(jitter), dtype=int)
+    first = 0
+    if not startsample:
+        # every valid pulse sets the start sample as long as it is zero, the first nonzero one sticks.
+        setting = np.flatnonzero(valid & (over_treshold != 0))
+        if not len(setting):
+            return shifts, valid, startsample
+        first = setting[0] + 1
+        startsample = over_treshold[setting[0]]
+    shifts[first:] = np.where(valid[first:], startsample - over_treshold[first:], 0)
+    return shifts, valid, startsample
+
+
+def shift_pulses(data: np.ndarray, shifts: np.ndarray):
+    """
+    Shift every pulse by its number of samples. Samples shifted in from outside the pulse are replaced with the
+    neighbouring edge value. A positive shift of s moves the pulse s - 1 samples to the left, a negative shift moves
+    the pulse to the right.
+
+    Pulses are shifted per group of equal shift, there are only a few different shifts in a block.
+
+    :param data: pulses [pulses][samples]
+    :param shifts: shift per pulse [pulses]
+    :returns: shifted pulses [pulses][samples]
+    """
+    offsets = np.where(shifts > 0, shifts - 1, shifts)
+    if not offsets.any():
+        return data
+    samples = data.shape[1]
+    shifted = data.copy()
+    for offset in np.unique(offsets):
+        if offset == 0:
+            continue
+        rows = np.flatnonzero(offsets == offset)
+        if offset > 0:
+            shifted[rows, :samples - offset] = data[rows, offset:]
+            shifted[rows, samples - offset:] = data[rows, -1:]
+        else:
+            offset = -offset
+            shifted[rows, offset:] = data[rows, :samples - offset]
+            shifted[rows, :offset] = data[rows, :1]
+    return shifted
+
+
+def jitter_correction(data: np.ndarray, jitter: np.ndarray, startsample: int):
+    """
+    Correct a block of pulses for the jitter with regards to the trigger.
+
+    :param data: pulses [pulses][samples]
+    :param jitter: jitter signals belonging to the pulses [pulses][samples]
+    :param startsample: reference sample of the trigger, 0 if not set yet
+    :returns: corrected pulses [pulses][samples], valid [pulses] (bool), startsample
+    """
+    shifts, valid, startsample = jitter_shifts(jitter, startsample)
+    return shift_pulses(data, shifts), valid, startsample
+
+
+def invert(data: np.ndarray, adc_number_of_bits: int):
+    """ Invert the pulses with regards to the maximum adc value. """
+    max_counts = pow(2, adc_number_of_bits) - 1
+    return max_counts - data
+
+
+def normalize(data: np.ndarray):
+    """ Subtract the baseline of every pulse and divide by its maximum. """
+    data = data - np.mean(data[:, 0:BASELINE_SAMPLES], axis=1, keepdims=True)
+    data /= np.max(data, axis=1, keepdims=True)
+    return data
+
+
+def accumulate_average(average: np.ndarray, counter: int, data: np.ndarray):
+    """
+    Add a block of normalized pulses to the running average. The average is restarted if the number of samples
+    changed.
+
+    :param average: running average [samples]
+    :param counter: number of pulses in the running average
+    :param data: normalized pulses [pulses][samples]
+    :returns: average [samples], counter
+    """
+    if np.shape(average) != data.shape[1:]:
+        average = np.zeros(data.shape[1])
+        counter = 0
+    total = counter + len(data)
+    average = (average * counter + np.sum(data, axis=0)) / total
+    return average, total
+
+
+def photon_edges(data: np.ndarray, treshold):
+    """
+    Find the single photon counts in a block of pulses. A count is registered at every sample over the treshold of
+    which the previous sample is not over the treshold.
+
+    :param data: pulses [pulses][samples]
+    :param treshold: adc value over which a spike is counted as photon
+    :returns: photon counts [pulses][samples] (bool)
+    """
+    over_treshold = data > treshold
+    edges = over_treshold.copy()
+    edges[:, 1:] &= ~over_treshold[:, :-1]
+    return edges
+
+
+def accumulate_counts(counts: np.ndarray, counter: int, edges: np.ndarray):
+    """
+    Add the photon counts of a block of pulses to the counts histogram. The histogram is restarted if the number of
+    samples changed.
+
+    :param counts: photon counts per sample [samples]
+    :param counter: number of pulses in the counts
+    :param edges: photon counts [pulses][samples] (bool)
+    :returns: counts [samples], counter
+    """
+    if np.shape(counts) != edges.shape[1:]:
+        counts = np.zeros(edges.shape[1], dtype=int)
+        counter = 0
+    counts += np.count_nonzero(edges, axis=0)
+    return counts, counter + len(edges)
+
+
+def photon_times(edges: np.ndarray):
+    """
+    Convert the photon counts of a block of pulses to list mode: the sample indices of all photon counts, pulse after
+    pulse, and the number of photon counts per pulse.
+
+    :param edges: photon counts [pulses][samples] (bool)
+    :returns: sample indices of the photon counts (uint32), number of photon counts per pulse [pulses] (uint32)
+    """
+    _, samples = np.nonzero(edges)
+    return samples.astype(np.uint32), np.count_nonzero(edges, axis=1).astype(np.uint32)
+
+
+def photon_histogram(times: np.ndarray, samples: int, binning: int = 1):
+    """
+    Histogram list mode photon counts in bins of a number of samples.
+
+    :param times: sample indices of the photon counts
+    :param samples: number of samples per pulse
+    :param binning: number of samples per bin
+    :returns: photon counts per bin [ceil(samples / binning)]
+    """
+    return np.bincount(times // binning, minlength=-(-samples // binning))
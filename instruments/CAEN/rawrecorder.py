@@ -0,0 +1,143 @@
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+
+class NpyStream:
+    """
+    Append-only .npy file. Arrays are appended along the first axis, the length in the header is written when the
+    stream is closed. The file can be opened with np.load, also memory-mapped with mmap_mode='r'.
+    """
+
+    HEADER_SIZE = 128   # fixed header size so it can be rewritten in place, multiple of 64 as the .npy format wants
+
+    def __init__(self, filename, dtype, shape: tuple):
+        """
+        :param filename: file to write
+        :param dtype: data type of the array
+        :param shape: shape of a single entry of the array, the first axis is the number of entries
+        """
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.length = 0
+        self.file = open(filename, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        """ Write the .npy version 1.0 header for the current length """
+        shape = (self.length,) + self.shape
+        header = f"{{'descr': '{self.dtype.str}', 'fortran_order': False, 'shape': {shape}, }}"
+        header = header.ljust(self.HEADER_SIZE - 10 - 1) + '\n'
+        self.file.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1'))
+
+    def append(self, array: np.ndarray):
+        """ Append entries [entries][shape] to the file, returns the number of bytes written """
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        array.tofile(self.file)
+        self.length += len(array)
+        return array.nbytes
+
+    def close(self):
+        """ Write the final length in the header and close the file """
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+
+
+class RawPulseRecorder:
+    """
+    Records every digitizer event to disk on a background writer thread. The events are stored as uint16 in
+    {filename}_raw_pulses.npy [events][channels][samples] with the measurement point number of every event in
+    {filename}_raw_points.npy [events]. In experiments the point number is the raster point number of the measurement
+    grid, see statemachine/scanplanner.py, so it does not depend on the scan order.
+
+    Blocks are passed to the writer through a bounded queue. If the writer cannot keep up and the queue is full the
+    block is dropped and counted, so the acquisition never waits for the disk.
+    """
+
+    def __init__(self, filename, queue_depth=32):
+        """
+        :param filename: base filename of the raw files, without extension
+        :param queue_depth: maximum number of blocks waiting to be written
+        """
+        self.logger_instrument = logging.getLogger('instrument.digitizer.rawrecorder')
+        self.filename = filename
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.pulses = None
+        self.points = None
+        self.events_written = 0
+        self.bytes_written = 0
+        self.time_writing = 0.
+        self.dropped_blocks = 0
+        self.dropped_events = 0
+        self.high_water = 0
+        self.error = None
+        self.time_started = time.time()
+        self.writer = threading.Thread(target=self._write, name='raw pulse writer', daemon=True)
+        self.writer.start()
+        self.logger_instrument.info(f'recording raw pulses to {filename}_raw_pulses.npy')
+
+    def record(self, block: np.ndarray, point: int):
+        """
+        Queue a block of events for writing. The block is copied, so the buffer it is in can be reused directly.
+
+        :param block: events [channels][events][samples]
+        :param point: index of the measurement point the events belong to
+        """
+        events = np.ascontiguousarray(block.transpose(1, 0, 2), dtype=np.uint16)
+        try:
+            self.queue.put_nowait((point, events))
+        except queue.Full:
+            self.dropped_blocks += 1
+            self.dropped_events += len(events)
+            self.logger_instrument.warning(f'raw pulse writer queue full, dropped {len(events)} events '
+                                           f'({self.dropped_events} in total)')
+            return
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def _write(self):
+        """ Writer thread, writes the queued blocks until the recorder is closed """
+        while (item := self.queue.get()) is not None:
+            if self.error:
+                continue
+            point, events = item
+            try:
+                tstart = time.perf_counter()
+                if self.pulses is None:
+                    self.pulses = NpyStream(f'{self.filename}_raw_pulses.npy', np.uint16, events.shape[1:])
+                    self.points = NpyStream(f'{self.filename}_raw_points.npy', np.int32, ())
+                if events.shape[1:] != self.pulses.shape:
+                    raise ValueError(f'event shape changed from {self.pulses.shape} to {events.shape[1:]}')
+                self.bytes_written += self.pulses.append(events)
+                self.bytes_written += self.points.append(np.full(len(events), point))
+                self.events_written += len(events)
+                self.time_writing += time.perf_counter() - tstart
+            except (OSError, ValueError) as e:
+                self.logger_instrument.error(f'raw pulse recording stopped: {e}')
+                self.error = e
+
+    def close(self):
+        """ Write the remaining queued blocks, close the files and log the recording statistics """
+        self.queue.put(None)
+        self.writer.join()
+        if self.pulses is not None:
+            self.pulses.close()
+            self.points.close()
+        stats = self.stats()
+        self.logger_instrument.info(f'raw pulse recording finished: {stats}')
+        return stats
+
+    def stats(self):
+        """ Return the recording statistics as dictionary """
+        megabytes = self.bytes_written / 1e6
+        return {'events written': self.events_written,
+                'MB written': round(megabytes, 1),
+                'write throughput MB/s': round(megabytes / self.time_writing, 1) if self.time_writing else 0.,
+                'average rate MB/s': round(megabytes / (time.time() - self.time_started), 1),
+                'queue high water': self.high_water,
+                'queue depth': self.queue.maxsize,
+                'dropped blocks': self.dropped_blocks,
+                'dropped events': self.dropped_events}
@@ -0,0 +1,155 @@
+import json
+import logging
+import time
+
+# Fixed waits in seconds before reading out an event at the long record lengths (rl setting 8 to 10). Without a wait
+# the DT5724 crashes at these record lengths. These are known to be safe and are where the adaptive readout latency
+# starts, it only goes below them when probing.
+FALLBACK_LATENCY = {8: 0.4, 9: 0.4, 10: 0.9}
+
+
+def backoff_wait(condition, initial=0.0005, maximum=0.02, factor=2):
+    """
+    Poll a condition until it is true, doubling the time between polls from the initial to the maximum interval.
+    Polls often directly after starting to wait, when an event is most likely to arrive at high trigger rates,
+    without hammering the digitizer registers when the triggers are slow.
+
+    :param condition: function returning True when done waiting
+    :param initial: first poll interval in seconds
+    :param maximum: maximum poll interval in seconds
+    :param factor: factor by which the poll interval grows
+    :returns: number of polls done
+    """
+    interval = initial
+    polls = 1
+    while not condition():
+        time.sleep(interval)
+        interval = min(interval * factor, maximum)
+        polls += 1
+    return polls
+
+
+class AdaptiveReadoutLatency:
+    """
+    Learns the wait between an event being ready and reading it out, per record length setting.
+
+    A record length starts at its known safe fallback latency, or at the safe latency learned in an earlier session.
+    After a number of successful readouts in a row the latency counts as safe and, with probing, is lowered by the
+    decrease factor, also below the fallback, to find a shorter wait. A failed readout marks its latency as unsafe:
+    a failed probe returns to the last safe latency and doubles the successes needed before probing again, a failure
+    at a safe latency raises the latency. When probing, latencies at or below an unsafe latency are never used again.
+    Without probing the latency is only lowered after it was raised, never below the fallback.
+
+    With a file, the safe and unsafe latencies per record length are saved, so the next session starts at the learned
+    latency and does not probe the unsafe latencies again.
+    """
+
+    def __init__(self, fallback: dict = None, decrease=0.8, successes_to_decrease=10, step_up=2.,
+                 minimum=0.01, maximum=2., probing=False, filename=None):
+        """
+        :param fallback: known safe latency in seconds per record length setting, 0 for settings not in the dictionary
+        :param decrease: factor by which the latency is lowered after enough successful readouts
+        :param successes_to_decrease: number of successful readouts in a row before lowering the latency
+        :param step_up: factor by which the latency is raised after a failed readout at a safe latency
+        :param minimum: lowest latency in seconds other than no wait at all
+        :param maximum: maximum latency in seconds
+        :param probing: lower the latency below the fallback latency to find the shortest safe wait
+        :param filename: json file the learned latencies are stored in, None to not store them
+        """
+        self.logger_instrument = logging.getLogger('instrument.digitizer.readoutlatency')
+        self.fallback = FALLBACK_LATENCY if fallback is None else fallback
+        self.decrease = decrease
+        self.successes_to_decrease = successes_to_decrease
+        self.step_up = step_up
+        self.minimum = minimum
+        self.maximum = maximum
+        self.probing = probing
+        self.filename = filename
+        self.learned = {}
+        self.load()
+        self.reset()
+
+    def load(self):
+        """ Load the learned latencies, start from the fallback latencies if the file does not exist or is invalid """
+        if self.filename is None:
+            return
+        try:
+            with open(self.filename) as f:
+                self.learned = {int(rl): {'safe': entry['safe'], 'unsafe': entry['unsafe']}
+                                for rl, entry in json.load(f).items()}
+        except FileNotFoundError:
+            self.learned = {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger_instrument.warning(f'could not read readout latencies {self.filename}, starting from the '
+                                           f'fallback latencies: {e}')
+            self.learned = {}
+
+    def save(self):
+        """ Write the learned latencies to the file """
+        if self.filename is None:
+            return
+        self.learned = {rl: {'safe': self.safe[rl], 'unsafe': self.unsafe.get(rl, -1.)} for rl in self.safe}
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(self.learned, f)
+        except OSError as e:
+            self.logger_instrument.warning(f'could not write readout latencies {self.filename}: {e}')
+
+    def latency(self, rl: int):
+        """ Return the current latency for the record length setting """
+        return self.latencies.get(rl, self.safe.get(rl, self.fallback.get(rl, 0)))
+
+    def success(self, rl: int):
+        """ Register a successful readout, mark the latency safe and lower it after enough successes in a row """
+        self.successes[rl] = self.successes.get(rl, 0) + 1
+        if self.successes[rl] < self.required.get(rl, self.successes_to_decrease):
+            return
+        self.successes[rl] = 0
+        latency = self.latency(rl)
+        if self.safe.get(rl) != latency:
+            self.safe[rl] = latency
+            self.save()
+        floor = 0 if self.probing else self.fallback.get(rl, 0)
+        lowered = latency * self.decrease
+        if lowered < max(floor, self.minimum):
+            lowered = floor
+        if lowered >= latency or (self.probing and lowered <= self.unsafe.get(rl, -1.)):
+            return
+        self.latencies[rl] = lowered
+        self.logger_instrument.debug(f'readout latency for record length {rl} lowered to {lowered * 1000:.1f} ms')
+
+    def failure(self, rl: int):
+        """ Register a failed readout, return to the safe latency after a failed probe, otherwise raise the latency """
+        latency = self.latency(rl)
+        safe = self.safe.get(rl, self.fallback.get(rl, 0))
+        self.successes[rl] = 0
+        self.failures[rl] = self.failures.get(rl, 0) + 1
+        self.unsafe[rl] = max(self.unsafe.get(rl, -1.), latency)
+        if latency < safe:
+            self.required[rl] = 2 * self.required.get(rl, self.successes_to_decrease)
+            self.latencies[rl] = safe
+            self.logger_instrument.warning(f'readout at record length {rl} failed after {latency * 1000:.1f} ms '
+                                           f'probing a shorter latency, back to {safe * 1000:.1f} ms, probing again '
+                                           f'after {self.required[rl]} successful readouts')
+        else:
+            self.latencies[rl] = min(max(latency * self.step_up, self.minimum), self.maximum)
+            self.safe[rl] = self.latencies[rl]
+            self.logger_instrument.warning(f'readout at record length {rl} failed after {latency * 1000:.1f} ms, '
+                                           f'readout latency raised to {self.latencies[rl] * 1000:.1f} ms')
+        self.save()
+
+    def reset(self):
+        """ Start again at the learned latencies, or the fallback latencies for record lengths without """
+        self.safe = {rl: entry['safe'] for rl, entry in self.learned.items()}
+        self.unsafe = {rl: entry['unsafe'] for rl, entry in self.learned.items()}
+        self.latencies = dict(self.fallback)
+        self.latencies.update(self.safe)
+        self.required = {}
+        self.successes = {}
+        self.failures = {}
+
+    def stats(self):
+        """ Return the current, safe and fallback latency in seconds and the number of failures per record length """
+        return {rl: {'latency': self.latency(rl), 'safe': self.safe.get(rl, self.fallback.get(rl, 0)),
+                     'fallback': self.fallback.get(rl, 0), 'failures': self.failures.get(rl, 0)}
+                for rl in sorted(self.latencies)}
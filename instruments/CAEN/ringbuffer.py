@@ -0,0 +1,131 @@
+import logging
+import threading
+import numpy as np
+
+
+class EventRingBuffer:
+    """
+    Bounded ring buffer of preallocated event blocks, used to pass raw digitizer events from the acquisition thread
+    to the processing thread without allocating arrays while measuring.
+
+    The buffer holds a fixed number of slots of shape [channels][events][samples] of raw uint16 adc samples. The
+    acquisition thread takes a free slot with begin_write, reads a block transfer into it and hands it over with
+    end_write. The processing thread takes the oldest filled slot with begin_read and gives it back with end_read once
+    processed.
+
+    If all slots are filled, the acquisition thread waits for the processing thread to free a slot (backpressure).
+    With the 'drop' policy it does not wait but gets no slot, the block read in that case is counted as dropped.
+    """
+
+    POLICIES = ('block', 'drop')
+
+    def __init__(self, slots: int, shape: tuple, policy: str = 'block'):
+        """
+        :param slots: number of event blocks the buffer can hold
+        :param shape: shape of a single event block [channels][events][samples]
+        :param policy: 'block' to let the producer wait for a free slot, 'drop' to drop blocks when full
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown ring buffer policy {policy}, choose from {self.POLICIES}')
+        self.logger_instrument = logging.getLogger('instrument.digitizer.ringbuffer')
+        self.slots = max(2, slots)
+        self.shape = tuple(shape)
+        self.policy = policy
+        self.buffer = np.zeros((self.slots,) + self.shape, dtype=np.uint16)
+        self.events = np.zeros(self.slots, dtype=int)
+        self.samples = np.zeros(self.slots, dtype=int)
+        self.condition = threading.Condition()
+        self.head = 0
+        self.tail = 0
+        self.filled = 0
+        self.closed = False
+        self.overruns = 0
+        self.dropped_blocks = 0
+        self.dropped_events = 0
+        self.high_water = 0
+
+    def reset(self):
+        """ Empty the buffer and reset the counters, the slots themselves are reused. """
+        with self.condition:
+            self.head = 0
+            self.tail = 0
+            self.filled = 0
+            self.closed = False
+            self.overruns = 0
+            self.dropped_blocks = 0
+            self.dropped_events = 0
+            self.high_water = 0
+
+    def close(self):
+        """ Close the buffer, waiting producers and consumers return without a slot. """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def begin_write(self):
+        """
+        Get the next free slot to read a block of events into. Waits for a free slot if the buffer is full, unless
+        the policy is to drop blocks.
+
+        :returns: slot index and the slot array [channels][events][samples], (None, None) if no slot is available
+        """
+        with self.condition:
+            if self.filled == self.slots:
+                self.overruns += 1
+                if self.policy == 'drop':
+                    return None, None
+                self.logger_instrument.debug('ring buffer full, waiting for processing')
+                while self.filled == self.slots and not self.closed:
+                    self.condition.wait()
+            if self.closed:
+                return None, None
+            return self.head, self.buffer[self.head]
+
+    def end_write(self, slot: int, events: int, samples: int):
+        """
+        Hand a written slot over to the consumer.
+
+        :param slot: slot index returned by begin_write
+        :param events: number of events read into the slot
+        :param samples: number of samples per event
+        """
+        with self.condition:
+            self.events[slot] = events
+            self.samples[slot] = samples
+            self.head = (self.head + 1) % self.slots
+            self.filled += 1
+            self.high_water = max(self.high_water, self.filled)
+            self.condition.notify_all()
+
+    def drop(self, events: int):
+        """ Register a block of events which was read but could not be stored. """
+        with self.condition:
+            self.dropped_blocks += 1
+            self.dropped_events += events
+        self.logger_instrument.warning(f'ring buffer full, dropped block of {events} events')
+
+    def begin_read(self, timeout=None):
+        """
+        Get the oldest filled slot. Waits until a slot is filled, the buffer is closed or the timeout passed.
+
+        :param timeout: maximum time to wait in seconds, None to wait until a slot is filled or the buffer is closed
+        :returns: slot index and the events in the slot [channels][events][samples], (None, None) if none available
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.filled or self.closed, timeout) or not self.filled:
+                return None, None
+            slot = self.tail
+            return slot, self.buffer[slot, :, :self.events[slot], :self.samples[slot]]
+
+    def end_read(self, slot: int):
+        """ Give a processed slot back to the producer. """
+        with self.condition:
+            self.tail = (slot + 1) % self.slots
+            self.filled -= 1
+            self.condition.notify_all()
+
+    def stats(self):
+        """ Return the buffer counters as dictionary """
+        with self.condition:
+            return {'slots': self.slots, 'high water': self.high_water, 'overruns': self.overruns,
+                    'dropped blocks': self.dropped_blocks, 'dropped events': self.dropped_events}
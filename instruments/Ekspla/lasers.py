@@ -1,13 +1,12 @@
 from ctypes import c_int, c_double, c_char_p, byref, windll
 import time
 import logging.config
-import numpy
 import win32com.client
 import re
-import asyncio
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QMutex, QMutexLocker
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QMutex, QMutexLocker, QTimer
 from pathlib import Path
 import os
+from instruments.Ekspla.stability import PowerStabilityMonitor, SettleTimeModel
 
 # Adds laser dll library path to environment path
 path_lib = Path(__file__).parent / 'lib64'
@@ -17,6 +16,9 @@ os.environ['PATH'] += os.pathsep + str(path_lib)
 # Constants
 MINIMUM_WAVELENGTH = 190
 MAXIMUM_WAVELENGTH = 2300
+# Registers that only change when they are set, with the time in seconds a read value is reused. Written values are
+# cached directly.
+REGISTER_TTL = {("CPU8000:16", "Output Energy level"): 1., ("CPU8000:16", "Power"): 1.}
 
 
 def list_available_devices():
@@ -54,6 +56,12 @@ class QLaser(QObject):
         self.measuring = False
         self.handle = c_int()
         self.setpoint_wavelength = None
+        self.stability = PowerStabilityMonitor(window=5, min_samples=5, tolerance=0.05, max_age=2.)
+        self.settle_model = SettleTimeModel()
+        self.last_setpoint_wavelength = None
+        self.settle_step = None
+        self._settle_generation = 0
+        self._register_cache = {}
         path_dll = str(Path(__file__).parent / 'lib64/REMOTECONTROL64.dll')
         self.rcdll = windll.LoadLibrary(path_dll)
 
@@ -103,14 +111,6 @@ class QLaser(QObject):
         #        except LaserError as e:
         #            self.logger.warning('Register {} not recognized'.format(reg))
 
-    async def set_wavelength(self, wl):
-        """
-        This method will sleep for `waittime` to move laser components.
-        """
-        self.wavelength = wl
-        # Wait for waittime to allow the laser to settle
-        asyncio.sleep(self.waittime)
-
     @property
     def output(self):
         """
@@ -207,6 +207,7 @@ class QLaser(QObject):
         """ Set a register value. """
 
         self.logger.debug(f'setting laser register double, dev = {dev}, reg = {reg}, val = {val}')
+        self._register_cache.pop((dev, reg), None)
         d = c_char_p(bytes(dev, 'utf-8'))
         r = c_char_p(bytes(reg, 'utf-8'))
         v = c_double(val)
@@ -217,9 +218,15 @@ class QLaser(QObject):
             time.sleep(self.polltime)
             e = self.rcdll.rcSetRegFromDoubleA2(self.handle, d, r, v, c_int(0))
         self._is_error(e)
+        if (dev, reg) in REGISTER_TTL:
+            self._register_cache[(dev, reg)] = (float(val), time.monotonic())
 
     def _get_register_double(self, dev, reg):
-        """ Retrieve a register value. """
+        """ Retrieve a register value. Registers in REGISTER_TTL are served from the cache while fresh. """
+        if (dev, reg) in self._register_cache:
+            value, t = self._register_cache[(dev, reg)]
+            if time.monotonic() - t < REGISTER_TTL[(dev, reg)]:
+                return value
         self.logger.debug(f'getting laser register double, dev = {dev}, reg = {reg}')
         d = c_char_p(bytes(dev, 'utf-8'))
         r = c_char_p(bytes(reg, 'utf-8'))
@@ -233,6 +240,8 @@ class QLaser(QObject):
             e = self.rcdll.rcGetRegAsDouble2(self.handle, d, r, byref(resp),
                                        self.timeout, None)
         self._is_error(e)
+        if (dev, reg) in REGISTER_TTL:
+            self._register_cache[(dev, reg)] = (resp.value, time.monotonic())
         return resp.value
 
     def _is_error(self, e):
@@ -268,6 +277,7 @@ class QLaser(QObject):
         c_path = c_char_p(bytes(str(path_config), 'utf-8'))
         c_devicename = c_char_p(bytes(device_name, 'utf-8'))
         self._is_error(self.rcdll.rcConnect2(byref(self.handle), connection_type, c_devicename, c_path))
+        self._register_cache = {}
         self.connected = True
         self.logger.info('laser connected')
 
@@ -276,13 +286,16 @@ class QLaser(QObject):
         """ Turns the laser off and disconnects """
         self.logger.info('disconnecting from laser')
         self.measuring = False
+        self._settle_generation += 1
         self.energylevel = 'Off'
         self._is_error(self.rcdll.rcDisconnect2(self.handle))
 
     @pyqtSlot()
     def measure(self):
         """Measure the current values of the laser.
-        A single measurement should last around 0.25 seconds.
+        The registers are read in one locked snapshot. The stability is decided from the rolling power window with
+        the power of this snapshot, without waiting for more power readings, and the energy level and output are
+        reused from the register cache while fresh.
         
         Returns: 
             | float: wavelength
@@ -297,8 +310,9 @@ class QLaser(QObject):
             wavelength = self.wavelength
             energylevel = self.energylevel
             power = self.power
-            stable = self.is_stable()
             output = self.output
+        self.stability.add(power)
+        stable = self.stability.stable()
         self.measuring = False
         self.measurement_complete.emit(wavelength, energylevel, power, stable, output)
         return wavelength, energylevel, power, stable, output
@@ -306,32 +320,80 @@ class QLaser(QObject):
     @pyqtSlot()
     def is_stable(self):
         """ Returns True if no fluctuation in Power higher than 5% occurs
-        between now and 5 polltimes
-        
+        in the rolling window of power readings, see PowerStabilityMonitor.
+
+        Adds a new power reading to the window, and more readings polltime apart while the window has too few readings
+        to decide.
+
         Returns:
             (bool): True/False depending on stability
         """
         self.logger.debug('measuring if laser stable')
-        p = []
-        for _ in range(5):
-            p.append(self.power)
+        self.stability.add(self.power)
+        while not self.stability.enough_samples():
             time.sleep(self.polltime)
-        return numpy.std(p) / numpy.mean(p) < 0.05
+            self.stability.add(self.power)
+        return self.stability.stable()
 
     @pyqtSlot()
     def set_wavelength_to_setpoint(self):
         """
         Set the wavelength to the setpoint. Setpoint must be defined before calling the function.
 
-        Return only when the laser has reached a stable state, emit a signal when ready.
+        Returns directly after setting the wavelength. The settle wait is scheduled on the event loop of the laser
+        thread, see _poll_settled, so the laser thread keeps handling measurements while the laser settles. The laser
+        stable signal is emitted when the laser is stable. A new setpoint cancels the settle wait of the previous one.
         """
-        self.wavelength = self.setpoint_wavelength
-        time.sleep(0.1)
-        while not self.is_stable():
-            time.sleep(0.1)
-        self.logger.info(f'laser stable at {self.setpoint_wavelength}')
+        self._settle_generation += 1
+        with(QMutexLocker(self.mutex)):
+            self.settle_step = self.wavelength_step(self.setpoint_wavelength)
+            self.wavelength = self.setpoint_wavelength
+            self.stability.start_settling(self.setpoint_wavelength)
+        generation = self._settle_generation
+        QTimer.singleShot(int(self.waittime * 1000), lambda: self._poll_settled(generation))
+
+    def _poll_settled(self, generation):
+        """
+        Add one power reading to the stability window. If the laser is stable, finish the settle, otherwise poll again
+        after polltime. Nothing to do if the settle wait was cancelled by a new setpoint or by disconnecting.
+
+        :param generation: settle wait the poll belongs to
+        """
+        if generation != self._settle_generation:
+            return
+        with(QMutexLocker(self.mutex)):
+            self.stability.add(self.power)
+        if self.stability.stable():
+            self._finish_settle()
+        else:
+            QTimer.singleShot(int(self.polltime * 1000), lambda: self._poll_settled(generation))
+
+    def _finish_settle(self):
+        """
+        Add the settle time to the settle time model with the size of the wavelength step and emit the laser stable
+        signal.
+        """
+        settle_time = self.stability.settled()
+        if self.settle_step is not None:
+            self.settle_model.record(self.settle_step, settle_time)
+        self.last_setpoint_wavelength = self.setpoint_wavelength
+        stats = self.stability.stats(self.setpoint_wavelength)
+        self.logger.info(f'laser stable at {self.setpoint_wavelength} after {settle_time:.2f} s, '
+                         f"mean settle time {stats['mean']:.2f} s, maximum {stats['max']:.2f} s over "
+                         f"{stats['count']} settles")
         self.laser_stable.emit()
 
+    def wavelength_step(self, wavelength):
+        """ Return the wavelength step in nm from the last setpoint to a wavelength, None before the first setpoint """
+        if self.last_setpoint_wavelength is None:
+            return None
+        return abs(wavelength - self.last_setpoint_wavelength)
+
+    def predict_settle_time(self, wavelength):
+        """ Return the predicted time in seconds to set the laser from the last setpoint to a wavelength """
+        step = self.wavelength_step(wavelength)
+        return self.settle_model.predict(step if step is not None else float('inf'))
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.connected:
             self.disconnect()
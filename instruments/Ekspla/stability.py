@@ -0,0 +1,117 @@
+import collections
+import logging
+import time
+import numpy as np
+
+
+class PowerStabilityMonitor:
+    """
+    Decides if the laser power is stable from a rolling window of power readings.
+
+    The power is stable when the window holds at least the minimum number of readings and their relative standard
+    deviation is below the tolerance. Readings are kept between checks, so a check on an already stable laser needs
+    a single new reading. Readings older than the maximum age are dropped, and the window is reset when the
+    wavelength changes. The time it takes to become stable after a wavelength change is kept per wavelength.
+    """
+
+    def __init__(self, window=5, min_samples=5, tolerance=0.05, max_age=2.):
+        """
+        :param window: maximum number of readings in the window
+        :param min_samples: minimum number of readings before the power can be stable
+        :param tolerance: maximum relative standard deviation of a stable power
+        :param max_age: maximum age of a reading in seconds
+        """
+        self.logger = logging.getLogger('Qinstrument.Qlaser.stability')
+        self.window = window
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.max_age = max_age
+        self.samples = collections.deque(maxlen=window)
+        self.settle_times = {}
+        self._settle_start = None
+        self._settle_wavelength = None
+
+    def add(self, power, t=None):
+        """ Add a power reading, taken at time t (time.monotonic) or now """
+        t = time.monotonic() if t is None else t
+        while self.samples and t - self.samples[0][0] > self.max_age:
+            self.samples.popleft()
+        self.samples.append((t, power))
+
+    def enough_samples(self):
+        """ Return True if the window has enough readings to decide on stability """
+        return len(self.samples) >= self.min_samples
+
+    def stable(self):
+        """ Return True if there are enough readings and their relative standard deviation is below the tolerance """
+        if not self.enough_samples():
+            return False
+        powers = np.array([power for _, power in self.samples])
+        mean = np.mean(powers)
+        return bool(mean > 0 and np.std(powers) / mean < self.tolerance)
+
+    def reset(self):
+        """ Forget the readings """
+        self.samples.clear()
+
+    def start_settling(self, wavelength):
+        """ Reset the window for a new wavelength and start timing how long the laser takes to settle """
+        self.reset()
+        self._settle_wavelength = wavelength
+        self._settle_start = time.monotonic()
+
+    def settled(self):
+        """ Store and return the settle time of the current wavelength in seconds """
+        if self._settle_start is None:
+            return None
+        settle_time = time.monotonic() - self._settle_start
+        self.settle_times.setdefault(self._settle_wavelength, []).append(settle_time)
+        self._settle_start = None
+        return settle_time
+
+    def stats(self, wavelength=None):
+        """ Return the number, mean and maximum of the settle times per wavelength, or of a single wavelength """
+        stats = {wl: {'count': len(times), 'mean': float(np.mean(times)), 'max': float(np.max(times))}
+                 for wl, times in self.settle_times.items()}
+        return stats if wavelength is None else stats.get(wavelength)
+
+
+class SettleTimeModel:
+    """
+    Predicts how long the laser takes to become stable after a wavelength change, from the measured settle times.
+
+    The settle times are grouped by the size of the wavelength step. The prediction is the mean settle time of the
+    group of the step, or of the nearest group with settle times if the group has none yet.
+    """
+
+    STEP_EDGES = (0, 1, 5, 20, 100, 500)   # lower edges of the wavelength step groups in nm
+
+    def __init__(self, default=1.):
+        """
+        :param default: settle time in seconds predicted before any settle time is measured
+        """
+        self.default = default
+        self.settle_times = {}
+
+    def _group(self, step):
+        """ Return the index of the group of a wavelength step """
+        return int(np.searchsorted(self.STEP_EDGES, abs(step), side='right')) - 1
+
+    def record(self, step, settle_time):
+        """ Add a measured settle time after a wavelength step in nm """
+        self.settle_times.setdefault(self._group(step), []).append(settle_time)
+
+    def predict(self, step):
+        """ Return the predicted settle time in seconds after a wavelength step in nm """
+        if not self.settle_times:
+            return self.default
+        group = self._group(step)
+        nearest = min(self.settle_times, key=lambda g: (abs(g - group), -g))
+        return float(np.mean(self.settle_times[nearest]))
+
+    def stats(self):
+        """ Return the number, mean and maximum of the settle times per wavelength step group """
+        edges = self.STEP_EDGES + (np.inf,)
+        return {f'{edges[g]}-{edges[g + 1]} nm': {'count': len(times), 'mean': float(np.mean(times)),
+                                                  'max': float(np.max(times))}
+                for g, times in sorted(self.settle_times.items())}
@@ -0,0 +1,82 @@
+import json
+import logging
+import time
+import numpy as np
+
+
+class DarkCache:
+    """
+    Stores measured dark spectra per spectrometer serial, pixel region, integration time and number of averages, so a
+    dark spectrum can be reused by following experiments instead of being measured again.
+
+    An entry is fresh as long as it is younger than the maximum age and the detector temperature did not change more
+    than the maximum temperature change since the dark was measured. The entries are kept in a small json file, so
+    they survive a restart of the program.
+    """
+
+    def __init__(self, filename, max_age=1800., max_temperature_change=1.):
+        """
+        :param filename: json file the dark spectra are stored in
+        :param max_age: maximum age of a dark spectrum in seconds
+        :param max_temperature_change: maximum change of the detector temperature in degrees, ignored when the
+                                       spectrometer has no temperature sensor
+        """
+        self.logger = logging.getLogger('QInstrument.QSpectrometer.DarkCache')
+        self.filename = filename
+        self.max_age = max_age
+        self.max_temperature_change = max_temperature_change
+        self.entries = {}
+        self.load()
+
+    @staticmethod
+    def key(serial, region, integrationtime, average_measurements):
+        """ Return the key of a dark spectrum """
+        return f'{serial}/{region}/{float(integrationtime):g}/{int(average_measurements)}'
+
+    def load(self):
+        """ Load the stored dark spectra, start empty if the file does not exist or cannot be read """
+        try:
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            self.logger.warning(f'could not read dark cache {self.filename}, starting empty: {e}')
+            self.entries = {}
+
+    def save(self):
+        """ Remove the expired dark spectra and write the others to the file """
+        now = time.time()
+        self.entries = {key: entry for key, entry in self.entries.items() if now - entry['time'] < self.max_age}
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump(self.entries, f)
+        except OSError as e:
+            self.logger.warning(f'could not write dark cache {self.filename}: {e}')
+
+    def get(self, serial, region, integrationtime, average_measurements, temperature=None):
+        """
+        Return the dark spectrum entry if it is fresh, otherwise None. The entry is a dictionary with the dark
+        spectrum, its standard deviation, the time it was measured and the detector temperature.
+        """
+        entry = self.entries.get(self.key(serial, region, integrationtime, average_measurements))
+        if entry is None:
+            return None
+        age = time.time() - entry['time']
+        if age >= self.max_age:
+            self.logger.info(f'cached dark spectrum expired, {age:.0f} s old')
+            return None
+        if temperature is not None and entry['temperature'] is not None and \
+                abs(temperature - entry['temperature']) > self.max_temperature_change:
+            self.logger.info(f"detector temperature changed from {entry['temperature']:.1f} to {temperature:.1f} "
+                             f"degrees since the cached dark spectrum")
+            return None
+        return {'dark': np.array(entry['dark']), 'std': np.array(entry['std']), 'time': entry['time'],
+                'temperature': entry['temperature']}
+
+    def put(self, serial, region, integrationtime, average_measurements, dark, std, temperature=None):
+        """ Store a measured dark spectrum and write the cache to file """
+        self.entries[self.key(serial, region, integrationtime, average_measurements)] = {
+            'dark': np.asarray(dark).tolist(), 'std': np.asarray(std).tolist(), 'time': time.time(),
+            'temperature': temperature}
+        self.save()
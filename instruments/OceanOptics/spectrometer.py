@@ -1,9 +1,15 @@
 import seabreeze.spectrometers as sb
+from seabreeze.spectrometers import SeaBreezeError
 import time
 import numpy as np
 from PyQt5.QtCore import QObject, QMutexLocker, QMutex, pyqtSignal, pyqtSlot
 import logging
 
+# Number of complete scans a free running spectrometer buffers, per seabreeze model name, as measured with
+# QSpectrometer.measure_stale_scans on the spectrometer. These scans and the scan in progress at a request were
+# integrated (partly) before the request and are discarded. Models not in this table are measured when connecting.
+STALE_SCANS = {}
+
 
 class QSpectrometer(QObject):
     """
@@ -34,10 +40,40 @@ class QSpectrometer(QObject):
         self._integrationtime = integrationtime
         self._average_measurements = average_measurements
         self.dark = []
+        self.dark_cache = None
+        self.last_dark_cached = None
+        self._reserved_darks = {}
         self.lamp = []
+        self.ladder_darks = {}
+        self.ladder_lamps = {}
         self.min_integrationtime = None
+        self.model = None
+        self.serial = None
+        self.stale_scans = None
+        self.last_discarded = 0
+        self.max_intensity = None
+        self.auto_integration = False
+        self.auto_min_integrationtime = 10
+        self.auto_max_integrationtime = 5000
+        self.auto_probe_integrationtime = 10
+        self.auto_target_fraction = 0.7
+        self.auto_ladder_factor = None
+        self.last_integrationtime = integrationtime
         self.last_intensity = []
+        self.last_std = []
         self.last_times = []
+        self.pixels = 0
+        self.roi = None
+        self.binning = 1
+        self._region = slice(None)
+        self._all_wavelengths = np.empty(0)
+        self._wavelengths = np.empty(0)
+        self._binned = np.empty(0)
+        self._mean = np.empty(0)
+        self._m2 = np.empty(0)
+        self._delta = np.empty(0)
+        self._step = np.empty(0)
+        self._times = np.empty(0)
         self.transmission = False
         self.plotinfo = None
 
@@ -58,7 +94,19 @@ class QSpectrometer(QObject):
         else:
             self.spec = spec
         self.min_integrationtime = self.spec.minimum_integration_time_micros / 1000
-        self.integrationtime = self._integrationtime
+        self.model = self.spec.model
+        self.serial = self.spec.serial_number
+        self.max_intensity = self.spec.max_intensity
+        self.stale_scans = STALE_SCANS.get(self.model)
+        # the wavelength axis is fixed for a spectrometer, read it once
+        self._all_wavelengths = self.spec.wavelengths()
+        self.set_region(self.roi, self.binning)
+        integrationtime = self._integrationtime
+        if self.stale_scans is None:
+            self.logger.info(f'stale scans of spectrometer model {self.model} unknown, measuring them')
+            self.integrationtime = max(100, self.min_integrationtime)
+            self.stale_scans = self.measure_stale_scans()
+        self.integrationtime = integrationtime
         self.connected = True
 
     def disconnect(self):
@@ -73,8 +121,50 @@ class QSpectrometer(QObject):
     def wavelengths(self):
         """The wavelengths this spectrometer can measure (Read-only) """
         self.logger.info('requesting spectrometer wavelengths')
-        wls = self.spec.wavelengths()
-        return wls.tolist()
+        return self._wavelengths.tolist()
+
+    def set_region(self, roi=None, binning=1):
+        """
+        Set the wavelength region of interest and the pixel binning of the spectra. Only the pixels in the region are
+        kept, every bin of neighbouring pixels is averaged into one pixel at the average wavelength of the bin. Pixels
+        at the end of the region that do not fill a complete bin are dropped. The dark and lamp spectra are cleared
+        when the region changes.
+
+        :param roi: (minimum, maximum) wavelength in nm, None for all pixels
+        :param binning: number of neighbouring pixels averaged into one pixel
+        """
+        wavelengths = self._all_wavelengths
+        binning = max(int(binning), 1)
+        start, stop = 0, len(wavelengths)
+        if roi is not None:
+            start, stop = np.searchsorted(wavelengths, roi[0]), np.searchsorted(wavelengths, roi[1], side='right')
+        stop -= (stop - start) % binning
+        if stop <= start:
+            self.logger.warning(f'no complete bin of {binning} pixels between {roi} nm, using all pixels')
+            roi, binning, start, stop = None, 1, 0, len(wavelengths)
+        region = slice(int(start), int(stop))
+        changed = region != self._region or binning != self.binning
+        self.roi, self.binning, self._region = roi, binning, region
+        self._wavelengths = wavelengths[region].reshape(-1, binning).mean(axis=1)
+        self.pixels = len(self._wavelengths)
+        self._binned = np.zeros(self.pixels)
+        self.logger.info(f'spectrometer region set to pixels {start} to {stop}, binning {binning}, '
+                         f'{self.pixels} pixels')
+        if changed:
+            self.clear_dark()
+            self.clear_lamp()
+            self._release_reserved_dark()
+
+    @property
+    def region(self):
+        """ The pixel region and binning as string, 'start:stop:binning' """
+        return f'{self._region.start}:{self._region.stop}:{self.binning}'
+
+    def _reduce(self, scan):
+        """ Return the binned pixels in the region of interest of a scan, the binned result is reused """
+        if self.binning == 1:
+            return scan[self._region]
+        return np.mean(scan[self._region].reshape(-1, self.binning), axis=1, out=self._binned)
 
     @property
     def integrationtime(self):
@@ -94,6 +184,8 @@ class QSpectrometer(QObject):
             self.logger.warning('Integration time set to mimimal value')
             v = min_v
         self.spec.integration_time_micros(v)
+        if v / 1000 != self._integrationtime:
+            self._release_reserved_dark()
         self._integrationtime = v / 1000
 
     @property
@@ -107,40 +199,49 @@ class QSpectrometer(QObject):
         """ Set the number of measurements to average over. """
         self.logger.debug(f'Setting the number of measurements to average over to {value}')
         self.measuring = False
+        if value != self._average_measurements:
+            self._release_reserved_dark()
         self._average_measurements = value
 
     @pyqtSlot()
-    def measurement(self):
+    def measurement(self, sync=True):
         """
         Measure a spectrum with the spectrometer.
 
         Due to internal working of the spectrometer, it continuously acquires data and returns a spectrum when the
-        buffer is full. Therefore the first result is awaited and timed. When the time is above a certain treshold,
-        it measures again.
+        buffer is full. Therefore the stale scans are discarded first, see _flush_stale_scans.
+
+        The scans are averaged with Welford's algorithm, which also gives the standard deviation of the scans per
+        pixel (last_std) without keeping the scans.
+
+        :param sync: emit cache_cleared when the stale scans are discarded, to start synchronized measurements
         """
         with(QMutexLocker(self.mutex)):
-            cache_cleared = False
-            while self.measuring and not cache_cleared:
-                self.logger.info('spectrometer cache not cleared, requesting measurement')
-                tstart = time.perf_counter()
-                self.spec.intensities()
-                tstop = time.perf_counter()
-                self.logger.info(f'time first measurement {1000*(tstop-tstart):.1f} miliseconds')
-                cache_cleared = self.integrationtime/1000 * 0.1 < tstop-tstart < self.integrationtime/1000 * 3
-            self.logger.info('spectrometer cache cleared')
-            self.cache_cleared.emit()
-            t = []
+            self.last_discarded = self._flush_stale_scans()
+            self.logger.info(f'spectrometer cache cleared, {self.last_discarded} scans discarded')
+            if sync:
+                self.cache_cleared.emit()
+            mean, m2, delta, step, times = self._allocate_buffers()
             t1 = time.perf_counter()
             self.logger.info(f'spectrometer measurment started')
-            intensity = np.zeros(len(self.spec.wavelengths()))
-            n = 1
-            while self.measuring and n <= self.average_measurements:
-                t.append(time.time())
-                intensity += (1. / self.average_measurements *
-                              self.spec.intensities(self.correct_dark_counts,
-                                                    self.correct_nonlinearity))
-                t.append(time.time())
+            n = 0
+            while self.measuring and n < self.average_measurements:
+                times[2 * n] = time.time()
+                scan = self._reduce(self.spec.intensities(self.correct_dark_counts, self.correct_nonlinearity))
+                times[2 * n + 1] = time.time()
                 n += 1
+                # welford update, in place: mean += (x - mean) / n, m2 += (x - mean_old) * (x - mean_new)
+                np.subtract(scan, mean, out=delta)
+                np.divide(delta, n, out=step)
+                mean += step
+                np.subtract(scan, mean, out=step)
+                step *= delta
+                m2 += step
+            # the buffers are reused for the next measurement, the results are new arrays
+            intensity = mean.copy()
+            self.last_std = np.sqrt(m2 / (n - 1)) if n > 1 else np.zeros(self.pixels)
+            t = times[:2 * n].copy()
+            self.last_integrationtime = self.integrationtime
 
         t2 = time.perf_counter()
         self.measurement_parameters.emit(self.integrationtime, self.average_measurements)
@@ -149,56 +250,319 @@ class QSpectrometer(QObject):
         self.last_times = t
         return intensity, t
 
+    def _flush_stale_scans(self):
+        """
+        Discard the scans that were (partly) integrated before the measurement was requested, returns the number of
+        discarded scans.
+
+        With a known number of buffered scans, these and the scan in progress at the request are discarded. Otherwise
+        scans are requested until one takes between 0.1 and 3 times the integration time, a scan that returns faster
+        was already waiting in the buffer. That scan is discarded too, it may have started before the request.
+        """
+        if self.stale_scans is not None:
+            discarded = 0
+            while self.measuring and discarded < self.stale_scans + 1:
+                self.spec.intensities()
+                discarded += 1
+            return discarded
+        discarded = 0
+        cache_cleared = False
+        while self.measuring and not cache_cleared:
+            self.logger.info('spectrometer cache not cleared, requesting measurement')
+            tstart = time.perf_counter()
+            self.spec.intensities()
+            tstop = time.perf_counter()
+            discarded += 1
+            self.logger.info(f'time first measurement {1000*(tstop-tstart):.1f} miliseconds')
+            cache_cleared = self.integrationtime/1000 * 0.1 < tstop-tstart < self.integrationtime/1000 * 3
+        return discarded
+
+    def measure_stale_scans(self, requests=5):
+        """
+        Measure the number of complete scans the spectrometer buffers, the value for the STALE_SCANS table of its
+        model. After waiting a few integration times, scans are requested back to back. Buffered scans return much
+        faster than the integration time, use an integration time of at least 100 ms for a reliable timing.
+
+        :param requests: maximum number of scans requested
+        """
+        with(QMutexLocker(self.mutex)):
+            time.sleep(3 * self.integrationtime / 1000)
+            buffered = 0
+            while buffered < requests:
+                tstart = time.perf_counter()
+                self.spec.intensities()
+                if time.perf_counter() - tstart > 0.1 * self.integrationtime / 1000:
+                    break
+                buffered += 1
+        self.logger.info(f'spectrometer model {self.model} buffers {buffered} complete scans')
+        return buffered
+
+    def _auto_range(self):
+        """
+        Set the integration time that brings the peak of the spectrum to the target fraction of full scale.
+
+        A probe scan is measured at the probe integration time, which is shortened while the probe saturates. The
+        signal above the baseline (the lowest pixel) scales with the integration time, so the integration time for
+        the target peak follows from the probe and is limited to the auto ranging bounds. With an integration time
+        ladder, the integration time is rounded down to the ladder, so the peak stays below the target.
+        """
+        with(QMutexLocker(self.mutex)):
+            self.integrationtime = max(self.auto_probe_integrationtime, self.auto_min_integrationtime)
+            while self.measuring:
+                self._flush_stale_scans()
+                probe = self.spec.intensities()[self._region]
+                peak, baseline = np.max(probe), np.min(probe)
+                if peak < 0.98 * self.max_intensity or self.integrationtime <= self.min_integrationtime:
+                    break
+                self.logger.info(f'auto ranging probe saturated at {self.integrationtime} ms')
+                self.integrationtime = self.integrationtime / 4
+            if not self.measuring:
+                return
+            probetime = self.integrationtime
+            target = self.auto_target_fraction * self.max_intensity - baseline
+            integrationtime = float(np.clip(probetime * target / max(peak - baseline, 1),
+                                            self.auto_min_integrationtime, self.auto_max_integrationtime))
+            if (ladder := self.integration_ladder()):
+                integrationtime = max([t for t in ladder if t <= integrationtime], default=ladder[0])
+            self.integrationtime = integrationtime
+            self.logger.info(f'auto ranging: peak {peak:.0f} counts at {probetime} ms, integration time set to '
+                             f'{self.integrationtime:.1f} ms')
+
+    def _allocate_buffers(self):
+        """
+        Return the zeroed running mean and sum of squared differences of the spectra, two work buffers and the buffer
+        for the start and stop time of every scan. The buffers are only allocated when the number of pixels or
+        averages changed, otherwise they are reused.
+        """
+        if len(self._mean) != self.pixels:
+            self.logger.debug(f'allocating spectrum accumulators for {self.pixels} pixels')
+            self._mean, self._m2, self._delta, self._step = (np.zeros(self.pixels) for _ in range(4))
+        if len(self._times) != 2 * self.average_measurements:
+            self._times = np.zeros(2 * self.average_measurements)
+        self._mean.fill(0)
+        self._m2.fill(0)
+        return self._mean, self._m2, self._delta, self._step, self._times
+
+    def integration_ladder(self):
+        """
+        Return the integration times in ms auto ranging chooses from, starting at the minimum auto ranging integration
+        time and a factor auto_ladder_factor apart up to the maximum. Dark and lamp spectra are measured at all of
+        them, so auto ranged spectra can be referenced. Empty without a ladder factor, auto ranging then sets any
+        integration time but is skipped while a dark or lamp spectrum is set.
+        """
+        if not self.auto_ladder_factor or self.auto_ladder_factor <= 1:
+            return []
+        ladder = [float(max(self.auto_min_integrationtime, self.min_integrationtime))]
+        while ladder[-1] * self.auto_ladder_factor <= self.auto_max_integrationtime:
+            ladder.append(round(ladder[-1] * self.auto_ladder_factor, 3))
+        return ladder
+
+    @property
+    def ladder_active(self):
+        """ True if the integration time is auto ranged over a ladder """
+        return self.auto_integration and bool(self.integration_ladder())
+
+    def _reference_times(self):
+        """ Return the integration times to measure dark and lamp spectra at, the ladder if it is active """
+        return self.integration_ladder() if self.ladder_active else [self.integrationtime]
+
+    @property
+    def referenced(self):
+        """ True if a dark or lamp spectrum is set, these are only valid at the integration time they were measured """
+        return bool(np.any(self.dark) or np.any(self.lamp))
+
+    @property
+    def ladder_referenced(self):
+        """ True if the dark and lamp spectra that are set were measured at every integration time of the ladder """
+        ladder = self.integration_ladder()
+        return bool(ladder) and all(not np.any(spectrum) or all(t in references for t in ladder)
+                                    for spectrum, references in ((self.dark, self.ladder_darks),
+                                                                 (self.lamp, self.ladder_lamps)))
+
+    def _select_references(self):
+        """ Set the dark and lamp spectra to those of the ladder at the current integration time """
+        if self.ladder_darks:
+            self.dark = self.ladder_darks[self._nearest(self.ladder_darks)]['spectrum']
+        if self.ladder_lamps:
+            self.lamp = self.ladder_lamps[self._nearest(self.ladder_lamps)]['spectrum']
+
+    def _nearest(self, references):
+        """ Return the integration time of the reference spectra closest to the current integration time """
+        return min(references, key=lambda t: abs(t - self.integrationtime))
+
     @pyqtSlot()
     def measure(self):
-        """ Perform a regular measurement"""
+        """
+        Perform a regular measurement. With auto integration the integration time is auto ranged first. A dark or lamp
+        spectrum that is set is swapped for the one of the ladder at the auto ranged integration time. Auto ranging is
+        skipped if a dark or lamp spectrum is set that was not measured at every integration time of the ladder.
+        """
         self.measuring = True
         self.logger.info('measuring a spectrum with the spectrometer')
+        if self.auto_integration and self.referenced and not self.ladder_referenced:
+            self.logger.warning('not auto ranging the integration time, the dark or lamp spectrum was not measured at '
+                                'every integration time of the ladder')
+        elif self.auto_integration:
+            self._auto_range()
+            self._select_references()
         spectrum, t = self.measurement()
         self.measurement_complete.emit(spectrum)
         self.measurement_done.emit()
         self.measuring = False
         return self.dark, t
 
+    def temperature(self):
+        """ Return the detector temperature in degrees, None if the spectrometer has no temperature sensor """
+        try:
+            return float(self.spec.f.temperature.read_temperature(0))
+        except (AttributeError, SeaBreezeError):
+            return None
+
+    def cached_darks(self, reserve=False):
+        """
+        Return the fresh cached dark spectrum entries for the current settings per integration time, None unless the
+        dark spectra are cached at every integration time the next dark measurement needs, see _reference_times.
+
+        :param reserve: use the returned entries for the next dark measurement, even if they expire in the meantime
+        """
+        if self.dark_cache is None:
+            return None
+        with(QMutexLocker(self.mutex)):
+            temperature = self.temperature()
+            entries = {t: self.dark_cache.get(self.serial, self.region, t, self.average_measurements, temperature)
+                       for t in self._reference_times()}
+        if not all(entries.values()):
+            entries = None
+        if reserve:
+            self._reserved_darks = entries or {}
+        return entries
+
+    def _cached_dark(self):
+        """ Return the fresh cached dark spectrum entry at the current settings, None if there is none """
+        if self.dark_cache is None:
+            return None
+        return self.dark_cache.get(self.serial, self.region, self.integrationtime, self.average_measurements,
+                                   self.temperature())
+
+    def _release_reserved_dark(self):
+        """
+        Forget the dark spectra reserved for the next dark measurement, after the measurement settings changed. The
+        cached dark spectra are kept, they are stored per setting and reused when the settings are changed back.
+        """
+        self._reserved_darks = {}
+
+    def _set_reference_time(self, integrationtime):
+        """ Set the integration time for a reference spectrum, without setting it again if it did not change """
+        if integrationtime != self.integrationtime:
+            self.integrationtime = integrationtime
+
+    def _use_reference(self, references, integrationtime):
+        """
+        Restore the integration time after measuring reference spectra and set the last measurement attributes to the
+        reference spectrum at that integration time, which is returned.
+
+        :param references: reference spectra per integration time, dictionaries with the spectrum, std, times,
+                           integration time and the time the spectrum was measured if it came from the dark cache
+        :param integrationtime: integration time to restore
+        """
+        self._set_reference_time(integrationtime)
+        reference = references[self._nearest(references)]
+        self.last_intensity, self.last_std, self.last_times = reference['spectrum'], reference['std'], reference['t']
+        self.last_integrationtime = reference['integrationtime']
+        return reference
+
     @pyqtSlot()
-    def measure_dark(self):
+    def measure_dark(self, force=False):
         """
         Perform a measurement and store the result in the dark spectrum attribute.
+
+        With a dark cache, a fresh cached dark spectrum for the same integration time and averages is used instead of
+        measuring and a measured dark spectrum is added to the cache. last_dark_cached is the time the used dark
+        spectrum was measured if it came from the cache, otherwise None.
+
+        With auto integration and an integration time ladder, a dark spectrum is taken at every integration time of the
+        ladder (ladder_darks), so auto ranged spectra are referenced at their own integration time. The dark spectrum
+        and last measurement attributes are those at the current integration time. The signals are emitted once.
+
+        :param force: measure new dark spectra, also if fresh ones are cached
         """
         self.measuring = True
-        self.logger.info('measuring a dark spectrum with the spectrometer')
-        dark, t = self.measurement()
-        self.measurement_dark_complete.emit(dark)
+        integrationtime = self.integrationtime
+        reserved, self._reserved_darks = self._reserved_darks, {}
+        darks = {}
+        for n, reference_time in enumerate(self._reference_times()):
+            if n and not self.measuring:
+                break
+            self._set_reference_time(reference_time)
+            entry = None if force else reserved.get(reference_time) or self._cached_dark()
+            if entry is not None:
+                self.logger.info(f"using cached dark spectrum at {self.integrationtime} ms, "
+                                 f"{time.time() - entry['time']:.0f} s old")
+                if not n:
+                    self.cache_cleared.emit()
+                darks[reference_time] = {'spectrum': entry['dark'], 'std': entry['std'],
+                                         't': np.full(2 * self.average_measurements, np.nan),
+                                         'integrationtime': self.integrationtime, 'cached': entry['time']}
+                continue
+            self.logger.info(f'measuring a dark spectrum with the spectrometer at {self.integrationtime} ms')
+            dark, t = self.measurement(sync=not n)
+            if self.dark_cache is not None and self.measuring:
+                self.dark_cache.put(self.serial, self.region, self.integrationtime, self.average_measurements, dark,
+                                    self.last_std, self.temperature())
+            darks[reference_time] = {'spectrum': dark, 'std': self.last_std, 't': t,
+                                     'integrationtime': self.integrationtime, 'cached': None}
+        self.ladder_darks = darks if self.ladder_active else {}
+        reference = self._use_reference(darks, integrationtime)
+        self.last_dark_cached = reference['cached']
+        self.dark = reference['spectrum']
+        self.measurement_dark_complete.emit(self.dark)
         self.measurement_done.emit()
-        self.dark = dark
         self.measuring = False
-        return self.dark, t
+        return self.dark, self.last_times
+
+    @pyqtSlot()
+    def measure_new_dark(self):
+        """ Measure a new dark spectrum without using the dark cache, for dark spectra requested by the user """
+        return self.measure_dark(force=True)
 
     @pyqtSlot()
     def clear_dark(self):
         """ Clear the dark spectrum. """
         self.logger.info('clearing the dark spectrum')
-        self.dark = np.zeros(len(self.spec.wavelengths()))
+        self.dark = np.zeros(self.pixels)
+        self.ladder_darks = {}
 
     @pyqtSlot()
     def measure_lamp(self):
         """
-        Perform a measurement and store the result in the lamp spectrum attribute.
+        Perform a measurement and store the result in the lamp spectrum attribute. With auto integration and an
+        integration time ladder, a lamp spectrum is taken at every integration time of the ladder (ladder_lamps), as
+        for the dark spectrum.
         """
         self.measuring = True
-        self.logger.info('measuring a lamp spectrum with the spectrometer')
-        lamp, t = self.measurement()
-        self.measurement_lamp_complete.emit(lamp)
+        integrationtime = self.integrationtime
+        lamps = {}
+        for n, reference_time in enumerate(self._reference_times()):
+            if n and not self.measuring:
+                break
+            self._set_reference_time(reference_time)
+            self.logger.info(f'measuring a lamp spectrum with the spectrometer at {self.integrationtime} ms')
+            lamp, t = self.measurement(sync=not n)
+            lamps[reference_time] = {'spectrum': lamp, 'std': self.last_std, 't': t,
+                                     'integrationtime': self.integrationtime}
+        self.ladder_lamps = lamps if self.ladder_active else {}
+        self.lamp = self._use_reference(lamps, integrationtime)['spectrum']
+        self.measurement_lamp_complete.emit(self.lamp)
         self.measurement_done.emit()
-        self.lamp = lamp
         self.measuring = False
-        return self.dark, t
+        return self.dark, self.last_times
 
     @pyqtSlot()
     def clear_lamp(self):
         """ Clear the lamp spectrum. """
         self.logger.info('Clearing the lamp spectrum.')
-        self.lamp = np.zeros(len(self.spec.wavelengths()))
+        self.lamp = np.zeros(self.pixels)
+        self.ladder_lamps = {}
 
     @pyqtSlot()
     def set_transmission(self):
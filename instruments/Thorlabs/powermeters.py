@@ -4,6 +4,7 @@ import numpy as np
 import pyvisa as visa
 import logging
 import pyvisa.errors
+from instruments.Thorlabs.statecache import StateCache
 
 
 def list_available_devices():
@@ -22,11 +23,14 @@ class PowerMeter:
         self.pm = None
         self.connected = False
         self.measuring = False
+        # settings only change by writing them, so they are cached until the device is reset
+        self.state_cache = StateCache('powermeter')
 
     def connect_device(self):
         try:
             self.logger_instrument.info('Attempting to connect powermeter')
             self.pm = visa.ResourceManager().open_resource(self.name)
+            self.state_cache.invalidate()
             self.connected = True
             # Set spectrometer to power mode
             self.pm.write('conf:pow')
@@ -38,14 +42,14 @@ class PowerMeter:
     @property
     def wavelength(self):
         """ Current wavelength the powermeter is scanning on [nm]. """
-        wavelength = self.pm.query_ascii_values("sense:corr:wav?")[0]
+        wavelength = self.state_cache.get('wavelength', lambda: self.pm.query_ascii_values("sense:corr:wav?")[0])
         self.logger_instrument.info(f'current wavelength = {wavelength}')
         return wavelength
 
     @wavelength.setter
     def wavelength(self, value):
         self.logger_instrument.info(f'setting the powermeter wavelength to {value}')
-        self.pm.write(f'sense:corr:wav {value}')
+        self.state_cache.set('wavelength', float(value), lambda v: self.pm.write(f'sense:corr:wav {v}'))
 
     @property
     def averageing(self):
@@ -53,7 +57,7 @@ class PowerMeter:
         Return the number of measurements being averaged over.
         one measurement takes approximately 3 ms.
         """
-        averaging = int(self.pm.query('sens:aver:coun?').strip())
+        averaging = self.state_cache.get('averageing', lambda: int(self.pm.query('sens:aver:coun?').strip()))
         self.logger_instrument.info(f'averaging powermeter = {averaging}')
         return averaging
 
@@ -65,8 +69,7 @@ class PowerMeter:
         timeout not automatically adjusted
         """
         self.logger_instrument.info(f'setting averageing to {value}')
-        value = int(value)
-        self.pm.write(f'sens:aver:coun {value}')
+        self.state_cache.set('averageing', int(value), lambda v: self.pm.write(f'sens:aver:coun {v}'))
 
     @property
     def timeout(self):
@@ -114,6 +117,25 @@ class PowerMeter:
         power = self.pm.query_ascii_values('read?')[0]
         return power
 
+    def read_power_burst(self, count):
+        """
+        Read multiple power values with a single query. The read? queries are sent as one compound SCPI message, the
+        readings come back in one response separated by semicolons, saving a USB round trip per reading.
+        """
+        self.logger_instrument.debug(f'Reading {count} power values')
+        return self.pm.query_ascii_values(';'.join(['read?'] * count), separator=';', container=np.array)
+
+    def supports_burst(self):
+        """ Return True if the powermeter answers a compound read? query with all readings. """
+        try:
+            supported = len(self.read_power_burst(2)) == 2
+        except (pyvisa.errors.VisaIOError, ValueError) as e:
+            self.logger_instrument.info(f'Compound read queries not supported: {e}')
+            supported = False
+        if not supported:
+            self.pm.write('*CLS')
+        return supported
+
     def zero_device(self):
         """ Zero the current reading of the device. """
         self.logger_instrument.info('Zeroing powermeter')
@@ -126,6 +148,7 @@ class PowerMeter:
         self.logger_instrument.info('Resetting default settings')
         self.pm.write('*RST')
         self.pm.write('*CLS')
+        self.state_cache.invalidate()
 
     @property
     def sensitivity_photodiode(self):
@@ -151,16 +174,14 @@ class PowerMeter:
     def autorange(self):
         """ Read autorange status. """
         self.logger_instrument.info('Reading autorange status.')
-        autorange = int(self.pm.query('sens:pow:rang:auto?').strip())
-        autorange = bool(autorange)
+        autorange = self.state_cache.get('autorange', lambda: bool(int(self.pm.query('sens:pow:rang:auto?').strip())))
         return autorange
 
     @autorange.setter
     def autorange(self, value):
         """ Turn autorange on or off. """
         self.logger_instrument.info(f'Set autorange to {value}')
-        integervalue = int(value)
-        self.pm.write(f'sens:pow:rang:auto {integervalue}')
+        self.state_cache.set('autorange', bool(value), lambda v: self.pm.write(f'sens:pow:rang:auto {int(v)}'))
 
     @property
     def accelerator(self):
@@ -221,8 +242,9 @@ class PowerMeter:
 
     def disconnect(self):
         """ Disconnect the powermeter. """
-        self.logger_instrument.info('Disconnecting powermeter')
+        self.logger_instrument.info(f'Disconnecting powermeter, bus transactions {self.state_cache.stats()}')
         self.pm.close()
+        self.state_cache.invalidate()
         self.connected = False
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -22,7 +22,7 @@ class QPowerMeter(PowerMeter, QObject):
     Includes additional measurement functions and signals.
     """
     measurement_complete = pyqtSignal(float)
-    measurement_complete_multiple = pyqtSignal(list, list, str)
+    measurement_complete_multiple = pyqtSignal(np.ndarray, np.ndarray, str)
     measurement_done = pyqtSignal()
     measurement_parameters = pyqtSignal(int, int)
     zero_complete = pyqtSignal()
@@ -35,8 +35,12 @@ class QPowerMeter(PowerMeter, QObject):
         self.mutex = QMutex(QMutex.Recursive)
         self.integration_time = integration_time
         self.measurements_multiple = 40
-        self.last_powers = []
-        self.last_times = []
+        self.burst_size = 10
+        self.burst = False
+        self.last_powers = np.empty(0)
+        self.last_times = np.empty(0)
+        self._sample_times = np.empty(0)
+        self._sample_powers = np.empty(0)
         self.plotinfo = None
         self.sensorinfo_plot = None
         self.modelinfo_plot = None
@@ -54,6 +58,8 @@ class QPowerMeter(PowerMeter, QObject):
         self.averageing = 1
         self.integration_time = 200
         self.autorange = True
+        self.burst = self.burst_size > 1 and self.supports_burst()
+        self.logger_q_instrument.info(f'burst readout of {self.burst_size} values per query: {self.burst}')
 
     @property
     def integration_time(self):
@@ -114,32 +120,59 @@ class QPowerMeter(PowerMeter, QObject):
         Take multiple single measurements for the duration of integration time
 
         Interpolate these measurements with a fixed number of values based on integration time
-        each reading takes approx 5 ms.
+        each reading takes approx 5 ms. In burst mode burst_size readings are taken per query, their times are spread
+        evenly over the duration of the query.
         """
         self.measuring = True
         self.logger_q_instrument.info('Measuring powermeter with multiple measurements, external averageing.')
         plotinfo = self.plotinfo if self.plotinfo else ''
         t1 = time.perf_counter()
-        measurements = []
-        t = []
+        n = 0
         with(QMutexLocker(self.mutex)):
+            t, measurements = self._allocate_samples()
             self.pm.write('*CLS')
             time.sleep(0.002)
             while time.perf_counter() - t1 < self.integration_time/1000:
-                power = self.read_power()
-                measurements.append(power)
-                t.append(time.perf_counter() - t1)
+                if n + self.burst_size > len(t):
+                    t, measurements = self._allocate_samples(2 * len(t))
+                if self.burst:
+                    tsend = time.perf_counter() - t1
+                    powers = self.read_power_burst(self.burst_size)
+                    tread = time.perf_counter() - t1
+                    k = len(powers)
+                    measurements[n:n + k] = powers
+                    t[n:n + k] = np.linspace(tsend, tread, k + 1)[1:]
+                    n += k
+                    continue
+                measurements[n] = self.read_power()
+                t[n] = time.perf_counter() - t1
+                n += 1
                 time.sleep(0.002)
         t2 = time.perf_counter()
         self.logger_q_instrument.info(f'powermeter completed,  time with all measurements {t2-t1:.3f}, '
-                                      f'number of measurements = {len(measurements)}')
-        self.last_times = list(np.linspace(0, t[-1], self.measurements_multiple))
-        self.last_powers = list(np.interp(self.last_times, t, measurements))
+                                      f'number of measurements = {n}, {n / (t2 - t1):.0f} readings/s')
+        self.last_times = np.linspace(0, t[n - 1], self.measurements_multiple)
+        self.last_powers = np.interp(self.last_times, t[:n], measurements[:n])
         self.measurement_complete_multiple.emit(self.last_times, self.last_powers, plotinfo)
         self.measurement_done.emit()
         self.measuring = False
         return self.last_times, self.last_powers
 
+    def _allocate_samples(self, size=None):
+        """
+        Return the buffers for the sample times and powers of a measurement. The buffers are reused between
+        measurements and sized for the integration time at one reading per millisecond, or grown to the given size
+        keeping their contents.
+        """
+        size = size or math.ceil(self.integration_time) + 2 * self.burst_size
+        if len(self._sample_times) < size:
+            self.logger_q_instrument.debug(f'allocating powermeter sample buffers for {size} samples')
+            times, powers = np.zeros(size), np.zeros(size)
+            times[:len(self._sample_times)] = self._sample_times
+            powers[:len(self._sample_powers)] = self._sample_powers
+            self._sample_times, self._sample_powers = times, powers
+        return self._sample_times, self._sample_powers
+
     @pyqtSlot()
     def zero(self):
         """ Zero the powermeter. """
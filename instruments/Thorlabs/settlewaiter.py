@@ -0,0 +1,128 @@
+import logging
+import time
+import numpy as np
+
+# Status bits of the apt motor controllers
+MOTION_BITS = 0x00000010 | 0x00000020 | 0x00000040 | 0x00000080 | 0x00000200
+TRACKING_BIT = 0x00001000
+SETTLED_BIT = 0x00002000
+
+
+def move_time(distance, velocity, acceleration):
+    """
+    Return the time in seconds of a move with a trapezoidal velocity profile, or a triangular one if the move is too
+    short to reach the maximum velocity. Moves take no time if the velocity parameters are unknown.
+
+    :param distance: distance of the move in mm, a number or an array
+    :param velocity: maximum velocity in mm/s
+    :param acceleration: acceleration in mm/s^2
+    """
+    distance = np.abs(distance)
+    if velocity <= 0 or acceleration <= 0:
+        times = np.zeros_like(distance, dtype=float)
+    else:
+        times = np.where(distance <= velocity ** 2 / acceleration, 2 * np.sqrt(distance / acceleration),
+                         velocity / acceleration + distance / velocity)
+    return times if times.ndim else float(times)
+
+
+def reports_settling(status_bits):
+    """ Return True if the status bits of a motor at rest show the motor reports tracking or settling """
+    return bool(status_bits & (TRACKING_BIT | SETTLED_BIT))
+
+
+def motion_done(status_bits, settling=True):
+    """
+    Return True if the status bits show the motor stopped moving, and also settled if the motor reports settling.
+
+    :param status_bits: status bits of the motor
+    :param settling: True if the motor reports settling, see reports_settling
+    """
+    if status_bits & MOTION_BITS:
+        return False
+    return not settling or bool(status_bits & SETTLED_BIT)
+
+
+class SettleWaiter:
+    """
+    Decides how long to sleep between status polls while waiting for a move to finish.
+
+    The move time is predicted from the distance and the velocity parameters of the stage, plus the mean time the
+    moves took longer than predicted so far. Until shortly before the predicted arrival the waiter sleeps long, with
+    at most the slow interval between polls, then it polls at the fast interval. Moves that take much longer than
+    predicted fall back to the slow interval.
+
+    Motors reporting settling may never set the settled bit, for example if the settle window is set too tight. The
+    waiter tells when the motion stopped longer than the settle timeout ago, so waiting can fall back to the move
+    complete bits.
+    """
+
+    def __init__(self, fast=0.005, slow=0.1, margin=0.02, window=0.5, settle_timeout=1.):
+        """
+        :param fast: interval in seconds between polls around the predicted arrival
+        :param slow: maximum interval in seconds between polls
+        :param margin: time in seconds before the predicted arrival the fast polling starts
+        :param window: time in seconds after the predicted arrival the fast polling stops
+        :param settle_timeout: time in seconds to wait for the settled bit after the motion stopped
+        """
+        self.logger = logging.getLogger('Qinstrument.QXYStage.settlewaiter')
+        self.fast = fast
+        self.slow = slow
+        self.margin = margin
+        self.window = window
+        self.settle_timeout = settle_timeout
+        self.settle_timeouts = 0
+        self.offset = 0.
+        self.moves = 0
+        self.polls = 0
+        self.predicted = 0.
+        self._start = None
+        self._stopped = None
+
+    def start(self, predicted, t=None):
+        """ Start waiting for a move predicted to take the given time in seconds, started at time t or now """
+        self._start = time.monotonic() if t is None else t
+        self.predicted = predicted + self.offset
+        self._stopped = None
+
+    def interval(self, t=None):
+        """ Return the time in seconds to sleep before the next status poll, at time t or now """
+        t = time.monotonic() if t is None else t
+        self.polls += 1
+        remaining = self._start + self.predicted - t
+        if remaining > self.margin:
+            return min(remaining - self.margin, self.slow)
+        if -remaining < self.window:
+            return self.fast
+        return self.slow
+
+    def settle_timed_out(self, stopped, t=None):
+        """
+        Return True if the motion stopped longer than the settle timeout ago, at time t or now, without settling.
+
+        :param stopped: True if the status bits show the motion stopped, see motion_done with settling False
+        """
+        t = time.monotonic() if t is None else t
+        if not stopped:
+            self._stopped = None
+            return False
+        if self._stopped is None:
+            self._stopped = t
+        if t - self._stopped < self.settle_timeout:
+            return False
+        self.settle_timeouts += 1
+        return True
+
+    def done(self, t=None):
+        """ Finish the move at time t or now, learn from the difference with the prediction and return the move time """
+        t = time.monotonic() if t is None else t
+        elapsed = t - self._start
+        self.moves += 1
+        self.offset = max(0., self.offset + (elapsed - self.predicted) / self.moves)
+        self.logger.debug(f'move took {elapsed:.3f} s, predicted {self.predicted:.3f} s')
+        return elapsed
+
+    def stats(self):
+        """ Return the number of moves, the polls per move, the learned extra move time and the settle timeouts """
+        return {'moves': self.moves, 'polls_per_move': self.polls / self.moves if self.moves else 0.,
+                'offset': self.offset, 'settle_timeouts': self.settle_timeouts}
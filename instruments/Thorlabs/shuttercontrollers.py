@@ -2,6 +2,7 @@ import serial
 import serial.tools.list_ports
 import logging
 from PyQt5.QtCore import QObject, QMutexLocker, QMutex, pyqtSignal, pyqtSlot
+from instruments.Thorlabs.statecache import StateCache
 
 
 class QShutterControl(QObject):
@@ -10,7 +11,7 @@ class QShutterControl(QObject):
     """
     shutter_status = pyqtSignal(bool)
 
-    def __init__(self, parent=None, port=None, timeout=10, polltime=0.1):
+    def __init__(self, parent=None, port=None, timeout=10, polltime=0.1, state_max_age=1.):
         super().__init__(parent=parent)
         self.logger = logging.getLogger('Qinstrument.QShutterControl')
         self.logger.info('init QShutterControl')
@@ -23,6 +24,8 @@ class QShutterControl(QObject):
         self.polltime = polltime
         self.port = port
         self.measuring = False
+        # the shutter can also be toggled on the controller itself, so its state is only cached shortly
+        self.state_cache = StateCache('shuttercontrol', max_age=state_max_age)
 
     def connect(self, name=None):
         """ Connect the shuttercontroller. """
@@ -31,6 +34,7 @@ class QShutterControl(QObject):
             if not name:
                 name = self.get_port('THORLABS SC10')
             self.sc = serial.Serial(name, 9600, parity=serial.PARITY_NONE, timeout=0.1)
+            self.state_cache.invalidate()
             self.connected = True
         except NameError as e:
             self.logger.error('Could not connect to Thorlabs SC10 shuttercontroller')
@@ -41,16 +45,27 @@ class QShutterControl(QObject):
         if not self.connected:
             self.logger.info('Shuttercontroller already disconnected')
             return
-        self.logger.info('Disconnecting shuttercontroller')
+        self.logger.info(f'Disconnecting shuttercontroller, bus transactions {self.state_cache.stats()}')
         self.sc.close()
+        self.state_cache.invalidate()
         self.connected = False
 
+    def _set_enabled(self, enabled):
+        """
+        Open or close the shutter. 'ens' toggles the shutter, so the state has to be known right before toggling. It is
+        taken from the state cache if it was read or set less than the maximum age ago, otherwise it is queried, as the
+        shutter can also be toggled on the controller itself. The state is not verified after toggling, as the shutter
+        may still be moving, the next status measurement reads it again.
+        """
+        with(QMutexLocker(self.mutex)):
+            if self.state_cache.get('enabled', lambda: bool(self.query_value('ens'))) == enabled:
+                return
+            self.state_cache.set('enabled', enabled, lambda v: self.write_value('ens'))
+
     def enable(self):
         """ Open the shutter. """
         self.logger.info('Enabling shutter unless already open')
-        with(QMutexLocker(self.mutex)):
-            if not int(self.query_value('ens')):
-                self.write_value('ens')
+        self._set_enabled(True)
 
     def measure(self):
         """ Measure the shutter status. """
@@ -58,18 +73,15 @@ class QShutterControl(QObject):
         self.measuring = True
         with(QMutexLocker(self.mutex)):
             # returns true is shutter is enabled
-            if self.query_value('ens') == 1:
-                self.shutter_status.emit(True)
-            else:
-                self.shutter_status.emit(False)
+            enabled = self.query_value('ens') == 1
+            self.state_cache.update('enabled', enabled)
+            self.shutter_status.emit(enabled)
             self.measuring = False
 
     def disable(self):
         """ Close the shutter """
         self.logger.info('disabling shutter')
-        with(QMutexLocker(self.mutex)):
-            if int(self.query_value('ens')):
-                self.write_value('ens')
+        self._set_enabled(False)
 
     def get_port(self, modelname):
         """
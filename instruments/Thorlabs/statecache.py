@@ -0,0 +1,78 @@
+import logging
+import time
+
+
+class StateCache:
+    """
+    Write-through cache of instrument settings, to skip bus transactions for settings that are already known.
+
+    Writing a setting that has the same value as the last written or read value is skipped. Reading a setting is
+    served from the cache once it is known. The cache of a setting is invalidated by invalidate, for example after a
+    reset of the instrument, and optionally after a maximum age for settings that can also be changed on the
+    instrument itself. The bus transactions done and saved are counted. Settings changed by toggle commands can only
+    be cached with a short maximum age, their state has to be known right before every toggle.
+    """
+
+    def __init__(self, name, max_age=None):
+        """
+        :param name: name of the instrument, used for logging
+        :param max_age: maximum age of a cached value in seconds, None to keep the values until invalidated
+        """
+        self.logger = logging.getLogger(f'instrument.statecache.{name}')
+        self.max_age = max_age
+        self.values = {}
+        self.transactions = 0
+        self.saved = 0
+
+    def _fresh(self, setting):
+        """ Return True if the setting is cached and not too old """
+        if setting not in self.values:
+            return False
+        return self.max_age is None or time.monotonic() - self.values[setting][1] < self.max_age
+
+    def get(self, setting, query):
+        """
+        Return the value of a setting, from the cache if it is known, otherwise from the instrument.
+
+        :param setting: name of the setting
+        :param query: function reading the setting from the instrument
+        """
+        if self._fresh(setting):
+            self.saved += 1
+            return self.values[setting][0]
+        value = query()
+        self.transactions += 1
+        self.update(setting, value)
+        return value
+
+    def set(self, setting, value, write):
+        """
+        Write a setting to the instrument, unless it already has the value. Returns True if the value was written.
+
+        :param setting: name of the setting
+        :param value: value to write
+        :param write: function writing the value to the instrument
+        """
+        if self._fresh(setting) and self.values[setting][0] == value:
+            self.saved += 1
+            self.logger.debug(f'{setting} already {value}, write skipped')
+            return False
+        write(value)
+        self.transactions += 1
+        self.update(setting, value)
+        return True
+
+    def update(self, setting, value):
+        """ Store the value of a setting that was read or changed without the cache """
+        self.values[setting] = (value, time.monotonic())
+
+    def invalidate(self, *settings):
+        """ Forget the cached settings, all settings if none are given """
+        if not settings:
+            self.values = {}
+        for setting in settings:
+            self.values.pop(setting, None)
+
+    def stats(self):
+        """ Return the number of bus transactions done and saved by the cache """
+        return {'transactions': self.transactions, 'saved': self.saved}
@@ -1,6 +1,7 @@
 import logging
 from instruments.Thorlabs import apt
 from instruments.Thorlabs.apt.core import APTError
+from instruments.Thorlabs.settlewaiter import SettleWaiter, move_time, motion_done, reports_settling
 import time
 from PyQt5.QtCore import QObject, QMutexLocker, QMutex, pyqtSignal, pyqtSlot
 
@@ -39,6 +40,12 @@ class QXYStage(QObject):
         self.yhomed = None
         self.setpoint_x = 0
         self.setpoint_y = 0
+        # Motion parameters for waiting on moves: (velocity, acceleration, reports settling) per stage
+        self.settle_waiter = SettleWaiter(slow=polltime)
+        self.xmotion = (0., 0., False)
+        self.ymotion = (0., 0., False)
+        self.target_x = None
+        self.target_y = None
 
     @property
     def name(self):
@@ -65,6 +72,7 @@ class QXYStage(QObject):
             self.logger.warning('Retaining position x=%.2f mm', self.x)
             return
         self.xstage.move_to(value, blocking=False)
+        self.target_x = value
 
     @property
     def y(self):
@@ -81,6 +89,7 @@ class QXYStage(QObject):
             self.logger.warning('Retaining position y=%.2f mm', self.y)
             return
         self.ystage.move_to(value, blocking=False)
+        self.target_y = value
 
     def connect(self):
         """ Connect the xy stages. """
@@ -88,6 +97,7 @@ class QXYStage(QObject):
             self.logger.info('Attempting to connect to XY stages.')
             self.xstage = apt.Motor(self.xstage_serial)
             self.ystage = apt.Motor(self.ystage_serial)
+            self._read_motion_parameters()
             self.connected = True
             self.xhomed = self.xstage.has_homing_been_completed
             self.yhomed = self.ystage.has_homing_been_completed
@@ -121,6 +131,7 @@ class QXYStage(QObject):
                 apt.reconnect()
                 self.xstage = apt.Motor(self.xstage_serial)
                 self.ystage = apt.Motor(self.ystage_serial)
+                self._read_motion_parameters()
                 self.connected = True
             except Exception as e:
                 self.logger.error(f'Failed to connect to XYStage... reattempting! - error = {e}')
@@ -133,6 +144,39 @@ class QXYStage(QObject):
         self.ystage = None
         apt.close()
 
+    @staticmethod
+    def _motion_parameters(stage):
+        """ Return the velocity, the acceleration and if the stage reports settling when it is at rest """
+        _, acceleration, velocity = stage.get_velocity_parameters()
+        status_bits = stage._status_bits
+        settling = motion_done(status_bits, settling=False) and reports_settling(status_bits)
+        return velocity, acceleration, settling
+
+    def _read_motion_parameters(self):
+        """ Read the motion parameters of the stages, used to predict how long moves take. """
+        self.xmotion = self._motion_parameters(self.xstage)
+        self.ymotion = self._motion_parameters(self.ystage)
+        self.target_x = None
+        self.target_y = None
+        self.logger.info(f'x stage motion (velocity, acceleration, settling): {self.xmotion}, '
+                         f'y stage: {self.ymotion}')
+
+    def _stages_done(self):
+        """
+        Return True if both stages stopped moving and settled, reading the status bits once per stage. If the stages
+        stopped moving but did not settle within the settle timeout, the move complete bits are used instead.
+        """
+        xbits = self.xstage._status_bits
+        ybits = self.ystage._status_bits
+        if motion_done(xbits, self.xmotion[2]) and motion_done(ybits, self.ymotion[2]):
+            return True
+        stopped = motion_done(xbits, settling=False) and motion_done(ybits, settling=False)
+        if self.settle_waiter.settle_timed_out(stopped):
+            self.logger.warning(f'stages stopped but not settled within {self.settle_waiter.settle_timeout} s '
+                                f'(status bits x {xbits:#010x}, y {ybits:#010x}), continuing without settling')
+            return True
+        return False
+
     def settled(self):
         """ Query if the stages are settled or not. """
         if not self.xstage.is_in_motion and not self.ystage.is_in_motion:
@@ -160,6 +204,8 @@ class QXYStage(QObject):
         self.logger.info('Homing xy stage.')
         self.xstage.move_home()
         self.ystage.move_home()
+        self.target_x = None
+        self.target_y = None
 
     @pyqtSlot(float, float)
     def move(self, x, y):
@@ -172,13 +218,21 @@ class QXYStage(QObject):
         """
         Move the stages to their setpoints.
 
-        Keep checking status until stages settled. Function to be used in multithreaded applications where setpoints
-        are set prior to calling this function.
+        Keep checking status until stages settled, polling fast around the arrival time predicted from the distance
+        and the velocity parameters. Function to be used in multithreaded applications where setpoints are set prior
+        to calling this function.
         """
+        start_x = self.xstage.position if self.target_x is None else self.target_x
+        start_y = self.ystage.position if self.target_y is None else self.target_y
         self.x = self.setpoint_x
         self.y = self.setpoint_y
-        while not self.settled():
-            time.sleep(0.1)
+        self.settle_waiter.start(max(move_time(self.setpoint_x - start_x, *self.xmotion[:2]),
+                                     move_time(self.setpoint_y - start_y, *self.ymotion[:2])))
+        while not self._stages_done():
+            time.sleep(self.settle_waiter.interval())
+        elapsed = self.settle_waiter.done()
+        self.logger.info(f'stages settled after {elapsed:.3f} s')
+        self.stage_settled.emit()
 
     @pyqtSlot()
     @pyqtSlot(float, float)
@@ -0,0 +1,147 @@
+import logging
+import numpy as np
+from instruments.Thorlabs.settlewaiter import move_time
+
+ORDERINGS = ('raster', 'serpentine', 'wavelength_major', 'greedy')
+
+
+class ScanCostModel:
+    """
+    Dead time between two measurement points of a scan.
+
+    The stages move at the same time, so a move takes as long as the slowest stage. The laser is retuned while the
+    stages move, so the dead time is the longest of the move time and the retune time.
+    """
+
+    def __init__(self, xmotion=(0., 0.), ymotion=(0., 0.), retune_time=None):
+        """
+        :param xmotion: maximum velocity in mm/s and acceleration in mm/s^2 of the x stage
+        :param ymotion: maximum velocity in mm/s and acceleration in mm/s^2 of the y stage
+        :param retune_time: function returning the time in seconds the laser takes to settle after a wavelength step
+                            in nm, None if retuning takes no time
+        """
+        self.xmotion = xmotion
+        self.ymotion = ymotion
+        self.retune_time = retune_time
+
+    def tables(self, x, y, wl):
+        """ Return the x move, y move and retune times between all values of x, y and wl as square tables """
+        xmove = move_time(np.subtract.outer(x, x), *self.xmotion)
+        ymove = move_time(np.subtract.outer(y, y), *self.ymotion)
+        steps = np.abs(np.subtract.outer(wl, wl))
+        if self.retune_time is None:
+            retune = np.zeros_like(steps, dtype=float)
+        else:
+            retune = np.array([[self.retune_time(step) if step else 0. for step in row] for row in steps])
+        return xmove, ymove, retune
+
+
+class ScanPlanner:
+    """
+    Orders the measurement points of an x, y and wavelength grid to reduce the dead time of a scan.
+
+    The points are numbered as in a raster scan: x is the outer loop, then y, then wl. An order is an array of these
+    point numbers, so the grid indices of every measured point are known for any order.
+
+    Orderings:
+        | raster: x, y and wl loops, every loop starting at its first value
+        | serpentine: the raster loops, every loop reversing its direction at the next value of the outer loop, so the
+          stages and laser never jump back to the start of a row
+        | wavelength_major: the wl loop outside a serpentine over the positions, so the laser is retuned once per
+          wavelength
+        | greedy: always the cheapest next point, improved by 2-opt segment reversals for small grids
+    """
+
+    def __init__(self, x, y, wl=None, cost_model=None, max_two_opt=1000):
+        """
+        :param x: x positions of the grid
+        :param y: y positions of the grid
+        :param wl: excitation wavelengths of the grid, None for a scan without wavelengths
+        :param cost_model: ScanCostModel, moves and retunes take no time if None
+        :param max_two_opt: maximum number of points for 2-opt improvement of the greedy ordering
+        """
+        self.logger = logging.getLogger('statemachine.scanplanner')
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.wl = np.zeros(1) if wl is None else np.asarray(wl)
+        self.shape = (len(self.x), len(self.y), len(self.wl))
+        self.size = int(np.prod(self.shape))
+        self.max_two_opt = max_two_opt
+        cost_model = ScanCostModel() if cost_model is None else cost_model
+        self.xmove, self.ymove, self.retune = cost_model.tables(self.x, self.y, self.wl)
+
+    def grid_indices(self, points):
+        """ Return the x, y and wl grid indices of point numbers """
+        return np.unravel_index(points, self.shape)
+
+    def cost(self, start, stop):
+        """ Return the dead time in seconds between the points start and stop, point numbers or arrays of them """
+        xa, ya, wa = self.grid_indices(start)
+        xb, yb, wb = self.grid_indices(stop)
+        return np.maximum(np.maximum(self.xmove[xa, xb], self.ymove[ya, yb]), self.retune[wa, wb])
+
+    def total_cost(self, order):
+        """ Return the total dead time in seconds of a scan in the given order """
+        order = np.asarray(order)
+        return float(np.sum(self.cost(order[:-1], order[1:])))
+
+    def plan(self, ordering='serpentine'):
+        """ Return the point numbers in the order of the given ordering, one of ORDERINGS """
+        if ordering == 'raster':
+            return np.arange(self.size)
+        if ordering == 'serpentine':
+            return self._serpentine((0, 1, 2))
+        if ordering == 'wavelength_major':
+            return self._serpentine((2, 0, 1))
+        if ordering == 'greedy':
+            order = self._greedy()
+            if self.size <= self.max_two_opt:
+                order = self._two_opt(order)
+            else:
+                self.logger.info(f'{self.size} points, skipping 2-opt improvement of the greedy ordering')
+            return order
+        raise ValueError(f'unknown scan ordering {ordering}, choose from {ORDERINGS}')
+
+    def _serpentine(self, loops):
+        """ Return the point numbers of nested loops over the grid axes, outer loop first, reversing inner loops """
+        indices = np.zeros((1, 0), dtype=int)
+        for axis in loops:
+            n = self.shape[axis]
+            forward, backward = np.arange(n), np.arange(n)[::-1]
+            values = np.concatenate([forward if i % 2 == 0 else backward for i in range(len(indices))])
+            indices = np.column_stack((np.repeat(indices, n, axis=0), values))
+        grid = indices[:, np.argsort(loops)]
+        return np.ravel_multi_index(tuple(grid.T), self.shape)
+
+    def _greedy(self):
+        """ Return the point numbers of a nearest neighbour tour starting at the first point """
+        order = np.empty(self.size, dtype=int)
+        unvisited = np.arange(1, self.size)
+        order[0] = 0
+        for i in range(1, self.size):
+            nearest = np.argmin(self.cost(order[i - 1], unvisited))
+            order[i] = unvisited[nearest]
+            unvisited = np.delete(unvisited, nearest)
+        return order
+
+    def _two_opt(self, order, max_passes=10):
+        """ Improve an order by reversing segments as long as this shortens the scan, keeping the first point """
+        order = order.copy()
+        n = len(order)
+        for _ in range(max_passes):
+            improved = False
+            for i in range(1, n - 1):
+                a, b = order[i - 1], order[i]
+                ends = order[i + 1:]
+                nexts = np.append(order[i + 2:], -1)
+                last = nexts < 0
+                old = self.cost(a, b) + np.where(last, 0., self.cost(ends, np.where(last, 0, nexts)))
+                new = self.cost(a, ends) + np.where(last, 0., self.cost(b, np.where(last, 0, nexts)))
+                gain = old - new
+                j = int(np.argmax(gain))
+                if gain[j] > 1e-9:
+                    order[i:i + j + 2] = order[i:i + j + 2][::-1]
+                    improved = True
+            if not improved:
+                break
+        return order
@@ -7,17 +7,21 @@ import math
 from yaml import safe_load as yaml_safe_load
 from yaml import dump as yaml_dump
 from instruments.OceanOptics.spectrometer import QSpectrometer
+from instruments.OceanOptics.darkcache import DarkCache
 from instruments.Thorlabs import apt
 from instruments.Thorlabs.xystage import QXYStage
 from instruments.Thorlabs.shuttercontrollers import QShutterControl
 from instruments.Thorlabs.qpowermeter import QPowerMeter
 from instruments.Ekspla import QLaser
 from instruments.CAEN.Qdigitizer import QDigitizer
+from instruments.CAEN.rawrecorder import RawPulseRecorder
+from instruments.CAEN.readoutlatency import AdaptiveReadoutLatency
 from instruments.CAEN.definitions import TIMERANGES, COMPRESSIONFACTORS
 from pathlib import Path
 from netCDF4 import Dataset
 import pandas as pd
 from statemachine.multiple_signals import MultipleSignal
+from statemachine.scanplanner import ScanPlanner, ScanCostModel
 
 instrument_parser = {
     'xystage': QXYStage,
@@ -84,6 +88,8 @@ class StateMachine(QObject):
         self.settings_ui = None
         self.instruments = {}
         self.measurement_parameters = {}
+        self.measurement_grid = {}
+        self.scan_order = None
         self.position_offsets = {}
         self.timekeeper = None
         self.timeout = 60
@@ -101,10 +107,13 @@ class StateMachine(QObject):
         self.spectrometertimes = None
         self.pulserecord = None
         self.experimentdate = None
+        self.filename = None
         self.is_done = False
         self.storage_dir = None
         self.calibration_dataframe = None
         self.calibration_position = None
+        self.laser_pretuned = None
+        self.measured_wavelength = None
         self.startingtime = time.time()
 
     def _init_poll(self):
@@ -137,6 +146,16 @@ class StateMachine(QObject):
             self.instruments.pop(inst)
         for inst in to_add:
             self.instruments[inst] = instrument_parser[inst]()
+        if 'spectrometer' in to_add:
+            self._reset_auto_integration()
+        if 'spectrometer' in to_add and self.config['spectrometer']['dark_cache']:
+            self.instruments['spectrometer'].dark_cache = DarkCache(
+                Path(__file__).parent.parent / 'config/darkcache.json', self.config['spectrometer']['dark_max_age'],
+                self.config['spectrometer']['dark_max_temperature_change'])
+        if 'digitizer' in to_add:
+            self.instruments['digitizer'].readout_latency = AdaptiveReadoutLatency(
+                probing=self.config['digitizer']['readout_latency_probing'],
+                filename=Path(__file__).parent.parent / 'config/readoutlatency.json')
         self.connect_all(page)
 
     def _connect_all(self, page):
@@ -324,6 +343,7 @@ class StateMachine(QObject):
         self.logger.info('parsing configuration beamsplitter calibration')
         self.calibration_status.emit('started calibration')
         self.measurement_parameters = {}
+        self.measurement_grid = {}
         self._add_measurement_parameter('x', np.array([0]))
         self._add_measurement_parameter('y', np.array([0]))
         self._parse_excitation_wavelengths()
@@ -339,6 +359,7 @@ class StateMachine(QObject):
         """ Parse transmission configuration """
         self.logger.info(f'parsing configuration {self.experiment}')
         self._parse_xypositions()
+        self._plan_scan()
         self._add_lamp_measurement()
         self._add_dark_measurement()
         self._parse_spectrometersettings()
@@ -348,6 +369,7 @@ class StateMachine(QObject):
         self.logger.info(f'parsing configuration {self.experiment}')
         self._parse_xypositions()
         self._parse_excitation_wavelengths()
+        self._plan_scan()
         self._add_dark_measurement()
         self._parse_spectrometersettings()
         self._parse_powermetersettings()
@@ -359,6 +381,7 @@ class StateMachine(QObject):
         self.logger.info('parsing decay configuration')
         self._parse_xypositions()
         self._parse_excitation_wavelengths()
+        self._plan_scan()
         self._parse_digitizersettings()
         self._parse_lasersettings()
 
@@ -384,6 +407,7 @@ class StateMachine(QObject):
         height_sample_usable = substratesettings['hs']
         y = self._define_positions(y_num, y_off_bottom, y_off_top, y_start, height_sample, height_sample_usable, 'y')
         self.measurement_parameters = {}
+        self.measurement_grid = {}
         self.logger.info(f'x positions = {x}, y positions = {y}')
         self._add_measurement_parameter('x', x)
         self._add_measurement_parameter('y', y)
@@ -401,6 +425,7 @@ class StateMachine(QObject):
     def _add_measurement_parameter(self, name, parameter):
         """ Add a measurement parameter by repeating all existing measurement parameters for the new parameter """
         self.logger.debug('adding measurement parameter')
+        self.measurement_grid[name] = parameter
         length = None
         for keys, values in self.measurement_parameters.items():
             length = len(values)
@@ -410,6 +435,27 @@ class StateMachine(QObject):
         self.measurement_parameters[name] = parameter
         return parameter
 
+    def _plan_scan(self):
+        """
+        Reorder the measurement points to reduce the time spent moving the stages and retuning the laser, with the
+        ordering from the configuration. The measurement parameters are in raster order before planning, which are
+        the point numbers of the planner, so scan_order holds the raster point number of every measurement. The data
+        is written to the same place in the file for any order, see _variable_index.
+        """
+        ordering = self.config['scan']['ordering']
+        laser = self.instruments.get('laser')
+        cost_model = ScanCostModel(xmotion=self.instruments['xystage'].xmotion[:2],
+                                   ymotion=self.instruments['xystage'].ymotion[:2],
+                                   retune_time=laser.settle_model.predict if laser else None)
+        planner = ScanPlanner(self.measurement_grid['x'], self.measurement_grid['y'], self.measurement_grid.get('wl'),
+                              cost_model)
+        self.scan_order = planner.plan(ordering)
+        self.logger.info(f'{ordering} scan order of {planner.size} points, predicted dead time '
+                         f'{planner.total_cost(self.scan_order):.1f} s, raster '
+                         f'{planner.total_cost(planner.plan("raster")):.1f} s')
+        for name in self.measurement_parameters:
+            self.measurement_parameters[name] = self.measurement_parameters[name][self.scan_order]
+
     def _add_dark_measurement(self):
         """
         Add a measurement position and excitation wavelength for a dark measurement.
@@ -441,10 +487,24 @@ class StateMachine(QObject):
         smsettings = self.settings_ui[self.experiment][f'widget_spectrometer_{self.experiment}']
         self.instruments['spectrometer'].integrationtime = smsettings['spinBox_integration_time_experiment']
         self.instruments['spectrometer'].average_measurements = smsettings['spinBox_averageing_experiment']
+        self.instruments['spectrometer'].set_region(self.config['spectrometer']['roi'],
+                                                    self.config['spectrometer']['binning'])
         self.instruments['spectrometer'].clear_dark()
         self.instruments['spectrometer'].clear_lamp()
         self.instruments['spectrometer'].transmission = False
 
+    def _reset_auto_integration(self):
+        """ Set the auto ranging of the spectrometer integration time from the configuration """
+        self.instruments['spectrometer'].auto_integration = self.config['spectrometer']['auto_integration']
+        self.instruments['spectrometer'].auto_min_integrationtime = \
+            self.config['spectrometer']['auto_min_integrationtime']
+        self.instruments['spectrometer'].auto_max_integrationtime = \
+            self.config['spectrometer']['auto_max_integrationtime']
+        self.instruments['spectrometer'].auto_probe_integrationtime = \
+            self.config['spectrometer']['auto_probe_integrationtime']
+        self.instruments['spectrometer'].auto_target_fraction = self.config['spectrometer']['auto_target_fraction']
+        self.instruments['spectrometer'].auto_ladder_factor = self.config['spectrometer']['auto_ladder_factor']
+
     def _parse_powermetersettings(self, *integrationtime):
         """
         Parse the powermeter settings. Set integration time according to spectrometer or according to input.
@@ -493,6 +553,12 @@ class StateMachine(QObject):
         self.instruments['digitizer'].jitter_correction_enabled = digitizersettings[
             'checkBox_jitter_correction_experiment']
         self.instruments['digitizer'].measurement_mode = digitizersettings['comboBox_measurement_mode_experiment']
+        self.instruments['digitizer'].list_mode = self.config['digitizer']['list_mode']
+        self.instruments['digitizer'].convergence_enabled = self.config['digitizer']['convergence']
+        self.instruments['digitizer'].convergence.target_relative_error = \
+            self.config['digitizer']['target_relative_error']
+        self.instruments['digitizer'].convergence.target_counts = self.config['digitizer']['target_counts']
+        self.instruments['digitizer'].convergence.min_pulses = self.config['digitizer']['min_pulses']
         self.instruments['digitizer'].polltime_enabled = False
         self.instruments['digitizer'].pulses_per_measurement = digitizersettings['spinBox_number_pulses_experiment']
         self.instruments['digitizer'].post_trigger_size = digitizersettings['spinBox_post_trigger_size_experiment']
@@ -612,6 +678,24 @@ class StateMachine(QObject):
         self._write_lasersettings()
         self._write_digitizersettings()
         self._create_dimensions_decay()
+        self._open_raw_recording()
+
+    def _open_raw_recording(self):
+        """ Attach a raw pulse recorder to the digitizer if raw recording is enabled in the config. """
+        if not self.config['digitizer']['raw_recording']:
+            return
+        self.logger.info(f'recording raw digitizer pulses next to {self.filename}')
+        self.instruments['digitizer'].raw_recorder = RawPulseRecorder(
+            self.filename, self.config['digitizer']['raw_queue_depth'])
+        self.dataset['settings/digitizer'].raw_recording = f'{self.filename}_raw_pulses.npy'
+
+    def _close_raw_recording(self):
+        """ Close the raw pulse recorder of the digitizer if one is attached and log the recording statistics. """
+        if 'digitizer' not in self.instruments or not self.instruments['digitizer'].raw_recorder:
+            return
+        stats = self.instruments['digitizer'].raw_recorder.close()
+        self.instruments['digitizer'].raw_recorder = None
+        self.logger.info(f'raw digitizer pulse recording closed, {stats}')
 
     def _load_create_file(self):
         """
@@ -624,6 +708,7 @@ class StateMachine(QObject):
         self.startingtime = time.time()
         self.experimentdate = time.strftime("%y%m%d%H%M", time.localtime(self.startingtime))
         fname = f'{storage_dir}/{sample}_{self.experiment}_{self.experimentdate}'
+        self.filename = fname
         self.logger.info(f'creating hdf5 dataset with filename: {fname}')
         comment = filesettings['plainTextEdit_comments']
         substrate = filesettings['comboBox_substrate']
@@ -650,6 +735,11 @@ class StateMachine(QObject):
         paramdict = {'transmission': 2, 'excitation_emission': 1, 'decay': 0}
         positionsettings.xnum = len(np.unique(self.measurement_parameters['x'][paramdict[self.experiment]:]))
         positionsettings.ynum = len(np.unique(self.measurement_parameters['y'][paramdict[self.experiment]:]))
+        positionsettings.scan_ordering = self.config['scan']['ordering']
+        # raster point number (x outer, y, wl inner loop) of every measurement, after the dark and lamp measurements
+        positionsettings.createDimension('scan_points', len(self.scan_order))
+        scan_order = positionsettings.createVariable('scan_order', 'i4', 'scan_points')
+        scan_order[:] = self.scan_order
         positionsettings.sample_width = self.position_offsets['x']['sample_width']
         positionsettings.sample_width_effective = self.position_offsets['x']['sample_width_effective']
         positionsettings.offset_left = self.position_offsets['x']['offset_left']
@@ -669,6 +759,14 @@ class StateMachine(QObject):
         spectrometersettings.average_measurements = self.instruments['spectrometer'].average_measurements
         spectrometersettings.spectrometer = str(self.instruments['spectrometer'].spec)
         spectrometersettings.wlnum = len(self.instruments['spectrometer'].wavelengths)
+        spectrometersettings.region = self.instruments['spectrometer'].region
+        spectrometersettings.binning = self.instruments['spectrometer'].binning
+        spectrometersettings.auto_integration = int(self.instruments['spectrometer'].auto_integration)
+        spectrometersettings.auto_min_integrationtime = self.instruments['spectrometer'].auto_min_integrationtime
+        spectrometersettings.auto_max_integrationtime = self.instruments['spectrometer'].auto_max_integrationtime
+        spectrometersettings.auto_probe_integrationtime = self.instruments['spectrometer'].auto_probe_integrationtime
+        spectrometersettings.auto_target_fraction = self.instruments['spectrometer'].auto_target_fraction
+        spectrometersettings.auto_ladder_factor = self.instruments['spectrometer'].auto_ladder_factor or 0
 
     def _write_lasersettings(self):
         """ Create a laser folder in the settings folder and write laser settings as folder attributes. """
@@ -697,6 +795,12 @@ class StateMachine(QObject):
         digitizersettings.model = self.instruments['digitizer'].model
         digitizersettings.pulses = self.instruments['digitizer'].pulses_per_measurement
         digitizersettings.measurement_mode = self.instruments['digitizer'].measurement_mode
+        digitizersettings.list_mode = str(self.instruments['digitizer'].list_mode_active)
+        digitizersettings.convergence = str(self.instruments['digitizer'].convergence_enabled)
+        if self.instruments['digitizer'].convergence_enabled:
+            digitizersettings.target_relative_error = self.instruments['digitizer'].convergence.target_relative_error
+            digitizersettings.target_counts = self.instruments['digitizer'].convergence.target_counts
+            digitizersettings.min_pulses = self.instruments['digitizer'].convergence.min_pulses
         digitizersettings.jitter_correction = str(self.instruments['digitizer'].jitter_correction_enabled)
         digitizersettings.jitter_channel = self.instruments['digitizer'].jitter_channel
         digitizersettings.single_photon_counting_treshold = \
@@ -751,6 +855,13 @@ class StateMachine(QObject):
         self.dataset.createDimension('spectrometer_intervals',
                                      self.instruments['spectrometer'].average_measurements * 2)
         self.dataset.createDimension('single', 1)
+        self._create_dimension_ladder()
+
+    def _create_dimension_ladder(self):
+        """ Create the dimension of the integration time ladder the reference spectra are measured at, if active """
+        if self.instruments['spectrometer'].ladder_active:
+            ladder = self.instruments['spectrometer'].integration_ladder()
+            self.dataset.createDimension('integration_ladder', len(ladder))
 
     def _create_dimensions_excitation_emission(self):
         """ Create dimensions for the hdf5 file excitation emission data. """
@@ -763,6 +874,7 @@ class StateMachine(QObject):
         excitation_wavelenghts = len(np.unique(self.measurement_parameters['wl'][1:]))
         self.dataset.createDimension('excitation_wavelengths', excitation_wavelenghts)
         self.dataset.createDimension('power_measurements', self.instruments['powermeter'].measurements_multiple)
+        self._create_dimension_ladder()
 
     def _create_dimensions_decay(self):
         """ Create dimensions for the hdf5 file decay data. """
@@ -773,6 +885,8 @@ class StateMachine(QObject):
         self.dataset.createDimension('excitation_wavelengths', excitation_wavelenghts)
         samples = int(self.instruments['digitizer'].record_length)
         self.dataset.createDimension('samples', samples)
+        if self.instruments['digitizer'].list_mode_active:
+            self.dataset.createVLType(np.uint32, 'photon_list')
 
     # endregion
     # region prepare measurement
@@ -813,7 +927,7 @@ class StateMachine(QObject):
         """ Prepare measurement excitation emission. """
         self.logger.info(f"preparing {self.experiment} measurement {self.measurement_index} of "
                          f"{len(self.measurement_parameters['x'])}")
-        self.wait_signals_prepare_measurement.reset()
+        self._reset_prepare_signals()
         self._prepare_powermeter()
         self._control_shutter()
         self._prepare_laser()
@@ -822,17 +936,24 @@ class StateMachine(QObject):
     def _prepare_measurement_decay(self):
         self.logger.info(f"preparing {self.experiment} measurement {self.measurement_index} of "
                          f"{len(self.measurement_parameters['x'])}")
-        self.wait_signals_prepare_measurement.reset()
+        self._reset_prepare_signals()
         self._control_shutter()
         self._prepare_digitizer()
         self._prepare_laser()
         self._prepare_move_stage()
 
     def _prepare_move_stage(self):
-        """ Move the stages to the next position. Set the setpoints, then call move to setpoints. """
+        """
+        Move the stages to the next position. Set the setpoints, then call move to setpoints. The stages stay where
+        they are for a dark spectrum that is taken from the dark cache.
+        """
         try:
             x = self.measurement_parameters['x'][self.measurement_index]
             y = self.measurement_parameters['y'][self.measurement_index]
+            if self._dark_cached():
+                self.logger.info('dark spectrum cached, not moving to the dark position')
+                x = self.instruments['xystage'].setpoint_x
+                y = self.instruments['xystage'].setpoint_y
             self.logger.info(f'moving stages to x = {x}, y = {y}')
             self.instruments['xystage'].setpoint_x = x
             self.instruments['xystage'].setpoint_y = y
@@ -841,6 +962,12 @@ class StateMachine(QObject):
             self.logger.error(f'position index out of range {e}')
             raise IndexError
 
+    def _dark_cached(self):
+        """ Return True if the current measurement is a dark spectrum that will be taken from the dark cache """
+        return self.measurement_index == 0 and not self.calibration and \
+            self.experiment in ('transmission', 'excitation_emission') and \
+            self.instruments['spectrometer'].cached_darks(reserve=True) is not None
+
     def _control_shutter(self):
         """
         Enable shutter except when a dark measurement is taken,
@@ -897,9 +1024,40 @@ class StateMachine(QObject):
     def _prepare_laser(self):
         """
         Set the a new setpoint for the laser wavelength and call the set to setpoint method in the laser thread.
+        Nothing to do if the laser was already pretuned to this measurement.
         """
+        if self.laser_pretuned == self.measurement_index:
+            self.logger.info('laser already pretuned for this measurement')
+            return
         wl = self.measurement_parameters['wl'][self.measurement_index]
-        self.logger.info(f'setting laser to {wl} nm for next measurement')
+        self.logger.info(f'setting laser to {wl} nm for next measurement, predicted settle time '
+                         f"{self.instruments['laser'].predict_settle_time(wl):.2f} s")
+        self.instruments['laser'].setpoint_wavelength = wl
+        QTimer.singleShot(0, self.instruments['laser'].set_wavelength_to_setpoint)
+
+    def _reset_prepare_signals(self):
+        """ Reset the prepare signals, except the laser signal when the laser is pretuned for this measurement """
+        if self.laser_pretuned == self.measurement_index:
+            self.wait_signals_prepare_measurement.signals['xystage'].reset()
+        else:
+            self.wait_signals_prepare_measurement.reset()
+
+    def _pretune_laser(self):
+        """
+        Set the laser to the wavelength of the next measurement as soon as the current measurement is done, so the
+        laser settles while the data is written and the stages move. The wavelength of the current measurement is
+        read before retuning, for writing it to file.
+        """
+        self.laser_pretuned = None
+        self.measured_wavelength = self.instruments['laser'].wavelength
+        next_index = self.measurement_index + 1
+        if not self.config['laser']['pretune'] or next_index >= len(self.measurement_parameters['wl']):
+            return
+        wl = self.measurement_parameters['wl'][next_index]
+        self.logger.info(f'pretuning laser to {wl} nm for the next measurement, predicted settle time '
+                         f"{self.instruments['laser'].predict_settle_time(wl):.2f} s")
+        self.wait_signals_prepare_measurement.reset()
+        self.laser_pretuned = next_index
         self.instruments['laser'].setpoint_wavelength = wl
         QTimer.singleShot(0, self.instruments['laser'].set_wavelength_to_setpoint)
 
@@ -994,6 +1152,7 @@ class StateMachine(QObject):
                          f'Y = {y_iny + 1} of {ynum}\nWavelength = {wl_inwl + 1} of {wlnum} ({wl} nm)')
         self.instruments['digitizer'].plotinfo = f'X = {x_inx + 1} of {xnum}, Y = {y_iny + 1} of {ynum} \n' \
                                                  f'Wavelength = {wl_inwl + 1} of {wlnum} ({wl} nm)'
+        self.instruments['digitizer'].raw_point = int(self.scan_order[self.measurement_index])
         QTimer.singleShot(0, self.instruments['digitizer'].measure)
 
     # endregion
@@ -1005,6 +1164,8 @@ class StateMachine(QObject):
         time_measuring = time.time() - self.timekeeper
         self.measurement_duration += time_measuring
         self.logger.info(f'processing data {self.experiment}, measurement time = {time_measuring}')
+        if self.experiment in ('excitation_emission', 'decay') and not self.calibration:
+            self._pretune_laser()
         self.write_file()
 
     # endregion
@@ -1057,12 +1218,20 @@ class StateMachine(QObject):
             self.logger.info(f'creating folder for xidx = {x_inx} and yidx = {y_iny}')
             datagroup = self.dataset.createGroup(f'x{x_inx + 1}y{y_iny + 1}')
 
-        xy_pos, em_wl, spectrum, spectrum_t = self._create_variables_transmission(datagroup)
+        xy_pos, em_wl, spectrum, spectrum_std, spectrum_t, integrationtime = \
+            self._create_variables_transmission(datagroup)
 
+        if self.measurement_index == 0:
+            self._write_dark_cached(datagroup)
+            self._write_ladder(datagroup, self.instruments['spectrometer'].ladder_darks)
+        elif self.measurement_index == 1:
+            self._write_ladder(datagroup, self.instruments['spectrometer'].ladder_lamps)
         xy_pos[:] = self._write_position()
         em_wl[:] = self.instruments['spectrometer'].wavelengths
         spectrum[:] = self.instruments['spectrometer'].last_intensity
+        spectrum_std[:] = self.instruments['spectrometer'].last_std
         spectrum_t[:] = np.array(self.instruments['spectrometer'].last_times) - self.startingtime
+        integrationtime[:] = self.instruments['spectrometer'].last_integrationtime
 
     def _write_file_excitation_emission(self):
         """
@@ -1090,34 +1259,68 @@ class StateMachine(QObject):
             xy_pos = datagroup['position']
             em_wl = datagroup['emission']
             spectrum = datagroup['spectrum']
+            spectrum_std = datagroup['spectrum_std']
             spectrum_t = datagroup['spectrum_t']
+            integrationtime = datagroup['integrationtime']
             ex_wl = datagroup['excitation']
             t_power = datagroup['power_t']
             power = datagroup['power']
             self.logger.info('variables exist in folder, appending data to variables')
         except IndexError:
             self.logger.info('variables non-existent in current folder, creating variables')
-            xy_pos, em_wl, spectrum, spectrum_t, ex_wl, t_power, power = \
+            xy_pos, em_wl, spectrum, spectrum_std, spectrum_t, integrationtime, ex_wl, t_power, power = \
                 self._create_variables_excitation_emission(datagroup)
 
         # write data to variables with distinction between first measurement (dark spectrum) and the rest.
         if self.measurement_index == 0:
+            self._write_dark_cached(datagroup)
+            self._write_ladder(datagroup, self.instruments['spectrometer'].ladder_darks)
             em_wl[:] = self.instruments['spectrometer'].wavelengths
             spectrum[:] = self.instruments['spectrometer'].last_intensity
+            spectrum_std[:] = self.instruments['spectrometer'].last_std
             spectrum_t[:] = np.array(self.instruments['spectrometer'].last_times) - self.startingtime
+            integrationtime[:] = self.instruments['spectrometer'].last_integrationtime
             xy_pos[:] = self._write_position()
-            ex_wl[:] = self.instruments['laser'].wavelength
+            ex_wl[:] = self.measured_wavelength
             t_power[:] = self.instruments['powermeter'].last_times
             power[:] = self.instruments['powermeter'].last_powers
         else:
             em_wl[:] = self.instruments['spectrometer'].wavelengths
             spectrum[wl_in_wl, :] = self.instruments['spectrometer'].last_intensity
+            spectrum_std[wl_in_wl, :] = self.instruments['spectrometer'].last_std
             spectrum_t[wl_in_wl, :] = np.array(self.instruments['spectrometer'].last_times) - self.startingtime
+            integrationtime[wl_in_wl] = self.instruments['spectrometer'].last_integrationtime
             xy_pos[:] = self._write_position()
-            ex_wl[wl_in_wl] = self.instruments['laser'].wavelength
+            ex_wl[wl_in_wl] = self.measured_wavelength
             t_power[:] = self.instruments['powermeter'].last_times
             power[wl_in_wl] = self.instruments['powermeter'].last_powers
 
+    def _write_dark_cached(self, datagroup):
+        """ Write if the dark spectrum came from the dark cache and when it was measured, relative to the start """
+        cached = self.instruments['spectrometer'].last_dark_cached
+        datagroup.cached = int(cached is not None)
+        if cached is not None:
+            datagroup.measured = cached - self.startingtime
+
+    def _write_ladder(self, datagroup, references):
+        """ Write the reference spectra measured at every integration time of the integration time ladder """
+        if not references:
+            return
+        self.logger.info(f'writing reference spectra at {len(references)} integration times')
+        integrationtime = datagroup.createVariable('ladder_integrationtime', 'f8', 'integration_ladder',
+                                                   fill_value=np.nan)
+        spectrum = datagroup.createVariable('ladder_spectrum', 'f8', ('integration_ladder', 'emission_wavelengths'),
+                                            fill_value=np.nan)
+        spectrum_std = datagroup.createVariable('ladder_spectrum_std', 'f8',
+                                                ('integration_ladder', 'emission_wavelengths'), fill_value=np.nan)
+        integrationtime.units = 'ms'
+        spectrum.units = 'a.u.'
+        spectrum_std.units = 'a.u.'
+        for i, reference in enumerate(references.values()):
+            integrationtime[i] = reference['integrationtime']
+            spectrum[i, :] = reference['spectrum']
+            spectrum_std[i, :] = reference['std']
+
     def _write_file_decay(self):
         """
         Write the measured decay spectrum to a file.
@@ -1136,16 +1339,25 @@ class StateMachine(QObject):
         try:
             xy_pos = datagroup['position']
             ex_wl = datagroup['excitation']
-            pulses = datagroup['pulses']
+            if self.instruments['digitizer'].list_mode_active:
+                pulses = (datagroup['photon_times'], datagroup['photon_counts'])
+            else:
+                pulses = datagroup['pulses']
+            pulses_measured = datagroup['pulses_measured']
             self.logger.info('variables exist in folder, appending to variables')
         except IndexError:
             self.logger.info('variables dont exist, create variables')
-            xy_pos, ex_wl, pulses = self._create_variables_decay(datagroup)
+            xy_pos, ex_wl, pulses, pulses_measured = self._create_variables_decay(datagroup)
 
         xy_pos[:] = self._write_position()
-        ex_wl[wl_in_wl] = self.instruments['laser'].wavelength
+        ex_wl[wl_in_wl] = self.measured_wavelength
+        pulses_measured[wl_in_wl] = self.instruments['digitizer'].last_pulses_measured
         if self.instruments['digitizer'].measurement_mode == 'averageing':
             pulses[wl_in_wl] = self.instruments['digitizer'].average_pulses
+        elif self.instruments['digitizer'].list_mode_active:
+            photon_times, photon_counts = self.instruments['digitizer'].list_mode_data()
+            pulses[0][wl_in_wl] = photon_times
+            pulses[1][wl_in_wl] = photon_counts
         elif self.instruments['digitizer'].measurement_mode == 'single photon counting':
             pulses[wl_in_wl] = self.instruments['digitizer'].single_photon_counts
 
@@ -1177,10 +1389,14 @@ class StateMachine(QObject):
         em_wl = datagroup.createVariable('emission', 'f8', 'emission_wavelengths', fill_value=np.nan)
         em_wl.units = 'nm'
         spectrum = datagroup.createVariable('spectrum', 'f8', 'emission_wavelengths', fill_value=np.nan)
+        spectrum_std = datagroup.createVariable('spectrum_std', 'f8', 'emission_wavelengths', fill_value=np.nan)
         spectrum_t = datagroup.createVariable('spectrum_t', 'f8', 'spectrometer_intervals', fill_value=np.nan)
+        integrationtime = datagroup.createVariable('integrationtime', 'f8', 'single', fill_value=np.nan)
         spectrum.units = 'a.u.'
+        spectrum_std.units = 'a.u.'
         spectrum_t.units = 's'
-        return xy_pos, em_wl, spectrum, spectrum_t
+        integrationtime.units = 'ms'
+        return xy_pos, em_wl, spectrum, spectrum_std, spectrum_t, integrationtime
 
     def _create_variables_excitation_emission(self, datagroup):
         """ Create variable for the excitation emission data. """
@@ -1191,32 +1407,42 @@ class StateMachine(QObject):
         em_wl.units = 'nm'
         if self.measurement_index == 0:
             spectrum = datagroup.createVariable('spectrum', 'f8', 'emission_wavelengths', fill_value=np.nan)
+            spectrum_std = datagroup.createVariable('spectrum_std', 'f8', 'emission_wavelengths', fill_value=np.nan)
             spectrum_t = datagroup.createVariable('spectrum_t', 'f8', 'spectrometer_intervals', fill_value=np.nan)
+            integrationtime = datagroup.createVariable('integrationtime', 'f8', 'single', fill_value=np.nan)
             ex_wl = datagroup.createVariable('excitation', 'f8', 'single', fill_value=np.nan)
             t_power = datagroup.createVariable('power_t', 'f8', 'power_measurements', fill_value=np.nan)
             power = datagroup.createVariable('power', 'f8', 'power_measurements', fill_value=np.nan)
             spectrum.units = 'a.u.'
+            spectrum_std.units = 'a.u.'
             spectrum_t.units = 's'
+            integrationtime.units = 'ms'
             ex_wl.units = 'nm'
             t_power.units = 's'
             power.units = 'W'
-            return xy_pos, em_wl, spectrum, spectrum_t, ex_wl, t_power, power
+            return xy_pos, em_wl, spectrum, spectrum_std, spectrum_t, integrationtime, ex_wl, t_power, power
         else:
             spectrum = datagroup.createVariable('spectrum', 'f8', ('excitation_wavelengths',
                                                                    'emission_wavelengths'), fill_value=np.nan)
+            spectrum_std = datagroup.createVariable('spectrum_std', 'f8', ('excitation_wavelengths',
+                                                                           'emission_wavelengths'), fill_value=np.nan)
             spectrum_t = datagroup.createVariable('spectrum_t', 'f8', ('excitation_wavelengths',
                                                                        'spectrometer_intervals'), fill_value=np.nan)
+            integrationtime = datagroup.createVariable('integrationtime', 'f8', 'excitation_wavelengths',
+                                                       fill_value=np.nan)
             ex_wl = datagroup.createVariable('excitation', 'f8', 'excitation_wavelengths', fill_value=np.nan)
             t_power = datagroup.createVariable('power_t', 'f8', ('excitation_wavelengths', 'power_measurements')
                                                , fill_value=np.nan)
             power = datagroup.createVariable('power', 'f8', ('excitation_wavelengths', 'power_measurements')
                                              , fill_value=np.nan)
             spectrum.units = 'a.u.'
+            spectrum_std.units = 'a.u.'
             spectrum_t.units = 's'
+            integrationtime.units = 'ms'
             ex_wl.units = 'nm'
             t_power.units = 's'
             power.units = 'W'
-            return xy_pos, em_wl, spectrum, spectrum_t, ex_wl, t_power, power
+            return xy_pos, em_wl, spectrum, spectrum_std, spectrum_t, integrationtime, ex_wl, t_power, power
 
     def _create_variables_decay(self, datagroup):
         """ Create variable for the decay data. """
@@ -1225,11 +1451,22 @@ class StateMachine(QObject):
         xy_pos.units = 'mm'
         ex_wl = datagroup.createVariable('excitation', 'f8', 'excitation_wavelengths', fill_value=np.nan)
         ex_wl.units = 'nm'
+        pulses_measured = datagroup.createVariable('pulses_measured', 'i4', 'excitation_wavelengths', fill_value=0)
+        pulses_measured.units = 'pulses'
+        if self.instruments['digitizer'].list_mode_active:
+            # list mode, the photon counts of pulse i are photon_times[offsets[i]:offsets[i + 1]] with offsets the
+            # cumulative sum of photon_counts starting at 0
+            photon_list = self.dataset.vltypes['photon_list']
+            photon_times = datagroup.createVariable('photon_times', photon_list, 'excitation_wavelengths')
+            photon_times.units = 'samples'
+            photon_counts = datagroup.createVariable('photon_counts', photon_list, 'excitation_wavelengths')
+            photon_counts.units = 'photon counts per pulse'
+            return xy_pos, ex_wl, (photon_times, photon_counts), pulses_measured
         pulses = datagroup.createVariable('pulses', 'f8',
                                           ('excitation_wavelengths', 'samples'),
                                           fill_value=np.nan)
         pulses.units = 'normalized adc counts'
-        return xy_pos, ex_wl, pulses
+        return xy_pos, ex_wl, pulses, pulses_measured
 
     def _write_position(self):
         """ Get the x and y position"""
@@ -1314,6 +1551,7 @@ class StateMachine(QObject):
         self.logger.warning('experiment aborted')
         if not self.calibration:
             self.dataset.close()
+            self._close_raw_recording()
         else:
             self.calibration_complete_signal.emit()
         # QTimer.singleShot(0, self.instruments['xystage'].stop_motors)
@@ -1327,6 +1565,7 @@ class StateMachine(QObject):
         self.logger.info('measurement completed!')
         if not self.calibration:
             self.dataset.close()
+            self._close_raw_recording()
         else:
             self.calibration_complete_signal.emit()
         self.is_done = True
@@ -1345,9 +1584,13 @@ class StateMachine(QObject):
         elif self.experiment == 'transmission':
             self.logger.info(f'{self.experiment} done - resetting instruments for align mode')
             self.instruments['spectrometer'].plotinfo = None
+            self.instruments['spectrometer'].set_region()
+            self._reset_auto_integration()
         elif self.experiment == 'excitation_emission':
             self.logger.info(f'{self.experiment} done - resetting instruments for align mode')
             self.instruments['spectrometer'].plotinfo = None
+            self.instruments['spectrometer'].set_region()
+            self._reset_auto_integration()
             self.instruments['spectrometer'].cache_cleared.disconnect()
             self.instruments['powermeter'].plotinfo = None
             self.instruments['powermeter'].integration_time = 200
@@ -1357,6 +1600,7 @@ class StateMachine(QObject):
             self.instruments['digitizer'].polltime = self.polltime
             self.instruments['digitizer'].pulses_per_measurement = math.ceil(self.polltime * 101)
             self.instruments['digitizer'].polltime_enabled = True
+            self.instruments['digitizer'].convergence_enabled = False
             self.instruments['digitizer'].plotinfo = None
             self.instruments['laser'].energylevel = 'Off'
 
@@ -0,0 +1,30 @@
+"""
+Tests for the convergence monitor of decay measurements.
+"""
+import numpy as np
+from instruments.CAEN.convergence import ConvergenceMonitor
+
+
+def test_block_merged_variance_equals_full_variance():
+    integrals = np.random.default_rng(3).normal(10, 2, 1000)
+    monitor = ConvergenceMonitor()
+    for block in np.array_split(integrals, 17):
+        monitor.add_integrals(block)
+    assert monitor.pulses == 1000
+    assert np.isclose(monitor.mean, np.mean(integrals))
+    expected = np.std(integrals, ddof=1) / np.sqrt(1000) / np.mean(integrals)
+    assert np.isclose(monitor.relative_error(), expected)
+
+
+def test_counts_converge_on_relative_error_and_total_counts():
+    monitor = ConvergenceMonitor(target_relative_error=0.1, min_pulses=10)
+    monitor.add_counts(200, 5)
+    assert not monitor.converged()
+    monitor.add_counts(0, 5)
+    assert monitor.converged()
+
+    monitor = ConvergenceMonitor(target_relative_error=0, target_counts=500, min_pulses=1)
+    monitor.add_counts(499, 100)
+    assert not monitor.converged()
+    monitor.add_counts(1, 1)
+    assert monitor.converged()
@@ -0,0 +1,46 @@
+"""
+Tests for the cache of measured dark spectra.
+"""
+import numpy as np
+from instruments.OceanOptics import darkcache
+from instruments.OceanOptics.darkcache import DarkCache
+
+
+def filled_cache(tmp_path, temperature=20.):
+    cache = DarkCache(tmp_path / 'darkcache.json', max_age=100., max_temperature_change=1.)
+    cache.put('SIM00001', '0:100:1', 500, 10, np.arange(3.), np.ones(3), temperature)
+    return cache
+
+
+def test_key_separates_settings():
+    assert DarkCache.key('SIM00001', '0:100:1', 500, 10) == 'SIM00001/0:100:1/500/10'
+    assert DarkCache.key('SIM00001', '0:100:1', 500., 10.) == DarkCache.key('SIM00001', '0:100:1', 500, 10)
+    settings = [('SIM00001', '0:100:1', 500, 10), ('SIM00002', '0:100:1', 500, 10), ('SIM00001', '0:50:2', 500, 10),
+                ('SIM00001', '0:100:1', 50, 10), ('SIM00001', '0:100:1', 500, 1)]
+    assert len({DarkCache.key(*setting) for setting in settings}) == 5
+
+
+def test_entry_reused_from_file(tmp_path):
+    filled_cache(tmp_path)
+    entry = DarkCache(tmp_path / 'darkcache.json').get('SIM00001', '0:100:1', 500, 10, 20.)
+    assert np.array_equal(entry['dark'], np.arange(3.))
+    assert np.array_equal(entry['std'], np.ones(3))
+    assert DarkCache(tmp_path / 'darkcache.json').get('SIM00001', '0:100:1', 100, 10, 20.) is None
+
+
+def test_entry_expires(tmp_path, monkeypatch):
+    cache = filled_cache(tmp_path)
+    now = darkcache.time.time()
+    monkeypatch.setattr(darkcache.time, 'time', lambda: now + 99.)
+    assert cache.get('SIM00001', '0:100:1', 500, 10, 20.) is not None
+    monkeypatch.setattr(darkcache.time, 'time', lambda: now + 101.)
+    assert cache.get('SIM00001', '0:100:1', 500, 10, 20.) is None
+
+
+def test_temperature_drift(tmp_path):
+    cache = filled_cache(tmp_path)
+    assert cache.get('SIM00001', '0:100:1', 500, 10, 20.9) is not None
+    assert cache.get('SIM00001', '0:100:1', 500, 10, 21.5) is None
+    # without a temperature sensor only the age counts
+    assert cache.get('SIM00001', '0:100:1', 500, 10, None) is not None
+    assert filled_cache(tmp_path, temperature=None).get('SIM00001', '0:100:1', 500, 10, 30.) is not None
@@ -0,0 +1,41 @@
+"""
+Tests for the rolling window laser stability monitor.
+"""
+from instruments.Ekspla.stability import PowerStabilityMonitor
+
+
+def test_stable_after_minimum_samples():
+    monitor = PowerStabilityMonitor(window=5, min_samples=3, tolerance=0.05)
+    monitor.add(1.0, t=0.)
+    monitor.add(1.01, t=0.1)
+    assert not monitor.stable()
+    monitor.add(0.99, t=0.2)
+    assert monitor.stable()
+
+
+def test_fluctuation_and_window():
+    monitor = PowerStabilityMonitor(window=3, min_samples=3, tolerance=0.05, max_age=10.)
+    for t, power in enumerate([0.5, 1.0, 1.0]):
+        monitor.add(power, t=t)
+    assert not monitor.stable()
+    # the fluctuating reading leaves the window
+    monitor.add(1.0, t=3)
+    assert monitor.stable()
+
+
+def test_old_samples_dropped():
+    monitor = PowerStabilityMonitor(window=5, min_samples=3, max_age=1.)
+    for t in [0., 0.1, 0.2]:
+        monitor.add(1.0, t=t)
+    monitor.add(1.0, t=2.)
+    assert not monitor.enough_samples()
+
+
+def test_settle_statistics():
+    monitor = PowerStabilityMonitor()
+    monitor.start_settling(500)
+    monitor.settled()
+    monitor.start_settling(500)
+    monitor.settled()
+    assert monitor.stats(500)['count'] == 2
+    assert monitor.stats(600) is None
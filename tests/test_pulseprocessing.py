@@ -0,0 +1,149 @@
+"""
+Compare the vectorized block processing of digitizer pulses with processing the pulses one by one, as the QDigitizer
+did before block processing.
+"""
+import numpy as np
+import pytest
+import scipy.ndimage as sp
+from instruments.CAEN import pulseprocessing
+
+
+def jitter_correction_single(data, jitter, startsample):
+    """ Per pulse jitter correction as previously done in QDigitizer._jitter_correction """
+    if (jitterspread := np.max(jitter) - np.min(jitter)) < 100:
+        return data, startsample
+    treshold = np.min(jitter) + int(0.5 * jitterspread)
+    over_treshold = np.argmax(jitter > treshold)
+    if not startsample:
+        return data, over_treshold
+    shift = startsample - over_treshold
+    if shift == 0:
+        return data, startsample
+    elif shift > 0:
+        data = np.hstack((data[(shift-1):-1], np.ones(shift)*data[-1]))
+    else:
+        shift = abs(shift)
+        data = np.hstack((np.ones(shift)*data[0], data[0:-shift]))
+    return data, startsample
+
+
+def single_photon_counts_single(data, treshold):
+    """ Per pulse photon counting as previously done in QDigitizer._single_photon_counting """
+    data_over_treshold = data > treshold
+    filter_doublecounts = np.array([1, 0])
+    data_corrected = data_over_treshold > sp.maximum_filter(
+        data_over_treshold, footprint=filter_doublecounts, mode='constant', cval=-np.inf)
+    return data_corrected.astype(int)
+
+
+def make_jitter(rng, pulses, samples, edges, amplitude=1500):
+    """ Make trigger pulses with their rising edge at the given samples """
+    jitter = rng.integers(0, 20, size=(pulses, samples)).astype(float)
+    jitter[np.arange(samples) >= np.asarray(edges)[:, np.newaxis]] += amplitude
+    return jitter
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1234)
+
+
+@pytest.mark.parametrize('startsample', [0, 50])
+def test_jitter_correction(rng, startsample):
+    pulses, samples = 200, 256
+    data = rng.integers(0, 2**14, size=(pulses, samples)).astype(float)
+    jitter = make_jitter(rng, pulses, samples, rng.integers(45, 56, size=pulses))
+    # some pulses without jitter signal, some with the edge at the first sample
+    jitter[rng.random(pulses) < 0.1] = 10
+    jitter[:3] = 10
+    jitter[5, :] = 1500
+
+    expected = np.empty_like(data)
+    expected_startsample = startsample
+    for pulse in range(pulses):
+        expected[pulse], expected_startsample = jitter_correction_single(data[pulse], jitter[pulse],
+                                                                         expected_startsample)
+
+    corrected, valid, corrected_startsample = pulseprocessing.jitter_correction(data, jitter, startsample)
+    assert np.array_equal(corrected, expected)
+    assert corrected_startsample == expected_startsample
+    assert not valid[:3].any()
+
+
+def test_jitter_correction_no_valid_pulses(rng):
+    data = rng.random((10, 64))
+    jitter = np.full((10, 64), 10.0)
+    corrected, valid, startsample = pulseprocessing.jitter_correction(data, jitter, 0)
+    assert np.array_equal(corrected, data)
+    assert not valid.any()
+    assert startsample == 0
+
+
+def test_invert(rng):
+    data = rng.integers(0, 2**14, size=(20, 128))
+    expected = np.array([-(pulse - (pow(2, 14) - 1)) for pulse in data])
+    assert np.array_equal(pulseprocessing.invert(data, 14), expected)
+
+
+def test_uint16_blocks_processed_as_float(rng):
+    data = rng.integers(0, 2**14, size=(20, 128)).astype(np.uint16)
+    jitter = make_jitter(rng, 20, 128, rng.integers(45, 56, size=20)).astype(np.uint16)
+    corrected, _, _ = pulseprocessing.jitter_correction(data, jitter, 50)
+    expected, _, _ = pulseprocessing.jitter_correction(data.astype(float), jitter.astype(float), 50)
+    assert np.array_equal(corrected, expected)
+    inverted, expected = pulseprocessing.invert(corrected, 14), pulseprocessing.invert(expected, 14)
+    assert inverted.dtype == np.uint16
+    assert np.array_equal(inverted, expected)
+    assert np.allclose(pulseprocessing.normalize(inverted), pulseprocessing.normalize(expected))
+
+
+def test_average(rng):
+    data = rng.random((50, 128)) + np.linspace(0, 5, 128)
+    average, counter = np.empty(0), 0
+    expected, expected_counter = np.empty(0), 0
+    for block in np.split(data, [7, 30]):
+        average, counter = pulseprocessing.accumulate_average(average, counter, pulseprocessing.normalize(block))
+    for pulse in data:
+        pulse = pulse - np.mean(pulse[0:30])
+        pulse = pulse / np.max(pulse)
+        expected_counter += 1
+        try:
+            expected = (expected * (expected_counter - 1) + pulse) / expected_counter
+        except ValueError:
+            expected_counter = 1
+            expected = pulse
+    assert counter == expected_counter
+    assert np.allclose(average, expected)
+
+
+def test_single_photon_counting(rng):
+    data = rng.integers(0, 100, size=(40, 256))
+    data[:, 0] = 99
+    treshold = 80
+    counts, counter = np.empty(0), 0
+    for block in np.split(data, [13, 27]):
+        counts, counter = pulseprocessing.accumulate_counts(counts, counter,
+                                                            pulseprocessing.photon_edges(block, treshold))
+    expected = np.sum([single_photon_counts_single(pulse, treshold) for pulse in data], axis=0)
+    assert counter == len(data)
+    assert np.array_equal(counts, expected)
+
+
+def test_counts_reset_on_sample_change(rng):
+    counts, counter = pulseprocessing.accumulate_counts(np.zeros(100, dtype=int), 12,
+                                                        rng.random((3, 64)) > 0.5)
+    assert counts.shape == (64,)
+    assert counter == 3
+
+
+def test_list_mode_histogram(rng):
+    data = rng.integers(0, 100, size=(30, 256))
+    edges = pulseprocessing.photon_edges(data, 90)
+    times, counts = pulseprocessing.photon_times(edges)
+    assert times.dtype == np.uint32
+    assert np.array_equal(counts, np.count_nonzero(edges, axis=1))
+    offsets = np.concatenate(([0], np.cumsum(counts, dtype=int)))
+    assert np.array_equal(times[offsets[4]:offsets[5]], np.flatnonzero(edges[4]))
+    dense = np.count_nonzero(edges, axis=0)
+    assert np.array_equal(pulseprocessing.photon_histogram(times, 256), dense)
+    assert np.array_equal(pulseprocessing.photon_histogram(times, 256, 8), dense.reshape(32, 8).sum(axis=1))
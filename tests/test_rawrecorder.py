@@ -0,0 +1,49 @@
+"""
+Tests for the raw pulse recorder and the .npy files it writes.
+"""
+import numpy as np
+from instruments.CAEN.rawrecorder import NpyStream, RawPulseRecorder
+
+
+def test_npy_stream_appends_blocks(tmp_path):
+    stream = NpyStream(tmp_path / 'stream.npy', np.uint16, (2, 5))
+    blocks = [np.arange(i * 30, i * 30 + n * 10).reshape(n, 2, 5) for i, n in enumerate((3, 1, 4))]
+    for block in blocks:
+        assert stream.append(block) == block.size * 2
+    stream.close()
+    array = np.load(tmp_path / 'stream.npy', mmap_mode='r')
+    assert array.dtype == np.uint16
+    assert array.shape == (8, 2, 5)
+    assert np.array_equal(array, np.concatenate(blocks))
+
+
+def test_empty_npy_stream(tmp_path):
+    NpyStream(tmp_path / 'stream.npy', np.int32, ()).close()
+    array = np.load(tmp_path / 'stream.npy', mmap_mode='r')
+    assert array.dtype == np.int32
+    assert array.shape == (0,)
+
+
+def test_recorder_aligns_events_and_points(tmp_path):
+    recorder = RawPulseRecorder(tmp_path / 'scan')
+    rng = np.random.default_rng(0)
+    blocks = [rng.integers(0, 16384, (2, n, 6)) for n in (5, 2, 7)]
+    points = (4, 0, 9)
+    for block, point in zip(blocks, points):
+        recorder.record(block, point)
+    assert recorder.close()['events written'] == 14
+    pulses = np.load(tmp_path / 'scan_raw_pulses.npy', mmap_mode='r')
+    assert pulses.dtype == np.uint16
+    assert pulses.shape == (14, 2, 6)
+    assert np.array_equal(pulses, np.concatenate([block.transpose(1, 0, 2) for block in blocks]))
+    point_numbers = np.load(tmp_path / 'scan_raw_points.npy', mmap_mode='r')
+    assert point_numbers.dtype == np.int32
+    assert np.array_equal(point_numbers, np.repeat(points, [block.shape[1] for block in blocks]))
+
+
+def test_empty_recording(tmp_path):
+    recorder = RawPulseRecorder(tmp_path / 'scan')
+    stats = recorder.close()
+    assert stats['events written'] == 0
+    assert stats['dropped events'] == 0
+    assert list(tmp_path.iterdir()) == []
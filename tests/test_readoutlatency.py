@@ -0,0 +1,94 @@
+"""
+Tests for the adaptive readout latency of the digitizer.
+"""
+from instruments.CAEN.readoutlatency import AdaptiveReadoutLatency, backoff_wait
+
+
+def test_latency_not_below_fallback_without_probing():
+    latency = AdaptiveReadoutLatency({10: 0.9}, decrease=0.5, successes_to_decrease=3)
+    for _ in range(30):
+        latency.success(10)
+    assert latency.latency(10) == 0.9
+    assert latency.latency(5) == 0
+
+
+def test_probing_lowers_latency_below_fallback():
+    latency = AdaptiveReadoutLatency({10: 0.8}, decrease=0.5, successes_to_decrease=2, minimum=0.1, probing=True)
+    for _ in range(2):
+        latency.success(10)
+    assert latency.latency(10) == 0.4
+    for _ in range(4):
+        latency.success(10)
+    assert latency.latency(10) == 0.1
+    for _ in range(2):
+        latency.success(10)
+    assert latency.latency(10) == 0
+    assert latency.stats()[10]['safe'] == 0.1
+
+
+def test_failed_probe_returns_to_safe_latency_and_backs_off():
+    latency = AdaptiveReadoutLatency({10: 0.8}, decrease=0.5, successes_to_decrease=2, probing=True)
+    for _ in range(4):
+        latency.success(10)
+    assert latency.latency(10) == 0.2
+    latency.failure(10)
+    assert latency.latency(10) == 0.4
+    for _ in range(2):
+        latency.success(10)
+    assert latency.latency(10) == 0.4
+    for _ in range(20):
+        latency.success(10)
+    # 0.2 failed, so it is not probed again
+    assert latency.latency(10) == 0.4
+    assert latency.required[10] == 4
+    assert latency.stats()[10] == {'latency': 0.4, 'safe': 0.4, 'fallback': 0.8, 'failures': 1}
+
+
+def test_learned_latencies_persist_per_record_length(tmp_path):
+    filename = tmp_path / 'readoutlatency.json'
+    latency = AdaptiveReadoutLatency({9: 0.4, 10: 0.8}, decrease=0.5, successes_to_decrease=1, probing=True,
+                                     filename=filename)
+    for _ in range(2):
+        latency.success(10)
+    latency.failure(10)
+    assert latency.latency(10) == 0.4
+    restored = AdaptiveReadoutLatency({9: 0.4, 10: 0.8}, decrease=0.5, successes_to_decrease=1, probing=True,
+                                      filename=filename)
+    assert restored.latency(10) == 0.4
+    assert restored.latency(9) == 0.4
+    restored.success(10)
+    assert restored.latency(10) == 0.4
+
+
+def test_invalid_latency_file_falls_back(tmp_path):
+    filename = tmp_path / 'readoutlatency.json'
+    filename.write_text('not json')
+    latency = AdaptiveReadoutLatency({10: 0.8}, filename=filename)
+    assert latency.latency(10) == 0.8
+
+
+def test_failure_raises_latency_and_successes_lower_it_to_fallback():
+    latency = AdaptiveReadoutLatency({10: 0.4}, decrease=0.5, successes_to_decrease=1)
+    latency.failure(10)
+    assert latency.latency(10) == 0.8
+    latency.success(10)
+    assert latency.latency(10) == 0.4
+    latency.success(10)
+    assert latency.latency(10) == 0.4
+    assert latency.stats()[10] == {'latency': 0.4, 'safe': 0.4, 'fallback': 0.4, 'failures': 1}
+
+
+def test_failure_without_fallback_and_maximum():
+    latency = AdaptiveReadoutLatency({9: 0.4}, successes_to_decrease=1, minimum=0.01, maximum=1.)
+    latency.failure(5)
+    assert latency.latency(5) == 0.01
+    latency.success(5)
+    assert latency.latency(5) == 0
+    for _ in range(3):
+        latency.failure(9)
+    assert latency.latency(9) == 1.
+
+
+def test_backoff_wait_polls_until_condition():
+    polls = iter([False, False, False, True])
+    assert backoff_wait(lambda: next(polls), initial=0.0001, maximum=0.0002) == 4
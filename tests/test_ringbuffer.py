@@ -0,0 +1,59 @@
+"""
+Tests for the ring buffer passing digitizer event blocks from the acquisition thread to the processing thread.
+"""
+import threading
+from instruments.CAEN.ringbuffer import EventRingBuffer
+
+
+def produce(ring, blocks, events):
+    """ Write blocks numbered by their index into the ring buffer, then close it """
+    for block in range(blocks):
+        slot, out = ring.begin_write()
+        if slot is None:
+            ring.drop(events)
+            continue
+        out[:, :events, :] = block
+        ring.end_write(slot, events, out.shape[2])
+    ring.close()
+
+
+def test_blocks_arrive_in_order():
+    ring = EventRingBuffer(3, (2, 4, 16))
+    producer = threading.Thread(target=produce, args=(ring, 50, 3))
+    producer.start()
+    received = []
+    while True:
+        slot, block = ring.begin_read(timeout=5)
+        if slot is None:
+            break
+        assert block.shape == (2, 3, 16)
+        received.append(block[0, 0, 0])
+        ring.end_read(slot)
+    producer.join()
+    assert received == list(range(50))
+    assert ring.stats()['dropped blocks'] == 0
+    assert ring.stats()['high water'] <= 3
+
+
+def test_drop_policy_counts_dropped_blocks():
+    ring = EventRingBuffer(2, (1, 4, 8), policy='drop')
+    produce(ring, 5, 4)
+    stats = ring.stats()
+    assert stats['high water'] == 2
+    assert stats['dropped blocks'] == 3
+    assert stats['dropped events'] == 12
+    assert stats['overruns'] == 3
+
+
+def test_close_releases_waiting_producer():
+    ring = EventRingBuffer(2, (1, 1, 4))
+    for _ in range(2):
+        slot, _ = ring.begin_write()
+        ring.end_write(slot, 1, 4)
+    result = []
+    producer = threading.Thread(target=lambda: result.append(ring.begin_write()))
+    producer.start()
+    ring.close()
+    producer.join(timeout=5)
+    assert result == [(None, None)]
+    assert ring.overruns == 1
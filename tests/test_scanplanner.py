@@ -0,0 +1,43 @@
+"""
+Tests for the scan path planner.
+"""
+import numpy as np
+import pytest
+from statemachine.scanplanner import ScanPlanner, ScanCostModel
+
+
+def planner(wl=(400, 500, 600)):
+    cost_model = ScanCostModel(xmotion=(2., 4.), ymotion=(2., 4.), retune_time=lambda step: 1. + step / 100)
+    return ScanPlanner(np.arange(4.), np.arange(3.), wl, cost_model)
+
+
+@pytest.mark.parametrize('ordering', ['raster', 'serpentine', 'wavelength_major', 'greedy'])
+def test_orderings_visit_every_point_once(ordering):
+    scan = planner()
+    order = scan.plan(ordering)
+    assert sorted(order) == list(range(scan.size))
+
+
+def test_raster_matches_measurement_parameters():
+    scan = planner()
+    x, y, wl = scan.grid_indices(scan.plan('raster'))
+    assert np.array_equal(x, np.repeat(np.arange(4), 9))
+    assert np.array_equal(y, np.tile(np.repeat(np.arange(3), 3), 4))
+    assert np.array_equal(wl, np.tile(np.arange(3), 12))
+
+
+def test_serpentine_and_wavelength_major():
+    scan = planner(wl=None)
+    x, y, _ = scan.grid_indices(scan.plan('serpentine'))
+    assert list(y[:6]) == [0, 1, 2, 2, 1, 0]
+    _, _, wl = planner().grid_indices(planner().plan('wavelength_major'))
+    assert np.count_nonzero(np.diff(wl)) == 2
+
+
+def test_optimised_orderings_are_cheaper_than_raster():
+    scan = planner()
+    raster = scan.total_cost(scan.plan('raster'))
+    assert scan.total_cost(scan.plan('serpentine')) < raster
+    assert scan.total_cost(scan.plan('greedy')) < raster
+    with pytest.raises(ValueError):
+        scan.plan('spiral')
@@ -0,0 +1,46 @@
+"""
+Tests for the adaptive settle waiter of the xy stages.
+"""
+import pytest
+from instruments.Thorlabs.settlewaiter import SettleWaiter, move_time, motion_done, MOTION_BITS, SETTLED_BIT
+
+
+def test_move_time_profiles():
+    # triangular profile: the move is too short to reach the maximum velocity
+    assert move_time(1., velocity=2., acceleration=4.) == pytest.approx(1.)
+    # trapezoidal profile: 0.5 s accelerating and 0.5 s decelerating plus 5 mm at full velocity
+    assert move_time(-6., velocity=2., acceleration=4.) == pytest.approx(3.5)
+    assert move_time(0., velocity=2., acceleration=4.) == 0.
+
+
+def test_motion_done_uses_settled_bit():
+    assert not motion_done(MOTION_BITS)
+    assert not motion_done(0, settling=True)
+    assert motion_done(SETTLED_BIT, settling=True)
+    assert motion_done(0, settling=False)
+
+
+def test_polls_fast_around_predicted_arrival():
+    waiter = SettleWaiter(fast=0.005, slow=0.1, margin=0.02, window=0.5)
+    waiter.start(1., t=0.)
+    assert waiter.interval(t=0.) == pytest.approx(0.1)
+    assert waiter.interval(t=0.93) == pytest.approx(0.05)
+    assert waiter.interval(t=0.99) == pytest.approx(0.005)
+    assert waiter.interval(t=2.) == pytest.approx(0.1)
+    assert waiter.done(t=1.2) == pytest.approx(1.2)
+    assert waiter.offset == pytest.approx(0.2)
+
+
+def test_settle_timeout_after_motion_stopped():
+    waiter = SettleWaiter(settle_timeout=1.)
+    waiter.start(1., t=0.)
+    assert not waiter.settle_timed_out(False, t=0.5)
+    assert not waiter.settle_timed_out(True, t=1.)
+    assert not waiter.settle_timed_out(True, t=1.9)
+    assert waiter.settle_timed_out(True, t=2.)
+    # the timeout restarts when the motor moves again and for every move
+    assert not waiter.settle_timed_out(False, t=2.1)
+    assert not waiter.settle_timed_out(True, t=2.2)
+    waiter.start(1., t=3.)
+    assert not waiter.settle_timed_out(True, t=3.5)
+    assert waiter.stats()['settle_timeouts'] == 1
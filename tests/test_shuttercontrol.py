@@ -0,0 +1,67 @@
+"""
+Tests for the shutter controller, with a simulated SC10 on the serial port.
+"""
+from instruments.Thorlabs.shuttercontrollers import QShutterControl
+
+
+class SimulatedSC10:
+    """ Serial port of an SC10 shutter controller, 'ens' toggles the shutter unless the shutter is stuck """
+    def __init__(self, enabled=0, stuck=False):
+        self.enabled = enabled
+        self.stuck = stuck
+        self.commands = []
+        self.response = b''
+
+    def write(self, data):
+        command = data.decode().strip()
+        self.commands.append(command)
+        if command == 'ens' and not self.stuck:
+            self.enabled = 1 - self.enabled
+        self.response = f'{command}\r{self.enabled}\r> '.encode() if command == 'ens?' else b''
+
+    def readline(self):
+        return self.response
+
+    def close(self):
+        pass
+
+
+def shutter(port, state_max_age=1.):
+    shuttercontrol = QShutterControl(state_max_age=state_max_age)
+    shuttercontrol.sc = port
+    shuttercontrol.connected = True
+    return shuttercontrol
+
+
+def test_state_queried_once_then_cached():
+    port = SimulatedSC10()
+    shuttercontrol = shutter(port)
+    shuttercontrol.enable()
+    shuttercontrol.enable()
+    shuttercontrol.disable()
+    assert port.enabled == 0
+    # no verify after toggling, the state after the first query is known from the cache
+    assert port.commands == ['ens?', 'ens', 'ens']
+    assert shuttercontrol.state_cache.stats() == {'transactions': 3, 'saved': 2}
+
+
+def test_state_queried_again_after_max_age():
+    port = SimulatedSC10()
+    shuttercontrol = shutter(port, state_max_age=0)
+    shuttercontrol.enable()
+    assert port.enabled == 1
+    # closed on the controller itself, disable must not toggle the shutter open again
+    port.enabled = 0
+    shuttercontrol.disable()
+    assert port.enabled == 0
+    assert port.commands == ['ens?', 'ens', 'ens?']
+
+
+def test_measure_updates_cached_state():
+    port = SimulatedSC10(enabled=1, stuck=True)
+    shuttercontrol = shutter(port)
+    shuttercontrol.disable()
+    # a stuck shutter is not noticed when toggling, but read by the next status measurement
+    shuttercontrol.measure()
+    shuttercontrol.disable()
+    assert port.commands == ['ens?', 'ens', 'ens?', 'ens']
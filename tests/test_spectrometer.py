@@ -0,0 +1,266 @@
+"""
+Tests for the spectrometer, with a simulated seabreeze spectrometer.
+"""
+import time
+import numpy as np
+import pytest
+from instruments.OceanOptics.spectrometer import QSpectrometer, STALE_SCANS
+from instruments.OceanOptics.darkcache import DarkCache
+
+
+class SimulatedSpectrometer:
+    """
+    Seabreeze spectrometer stand-in measuring a baseline plus a signal proportional to the integration time. Queued
+    scans are returned first, without delay as buffered scans. In real time the other scans take the integration time.
+    """
+    model = 'SIMULATED'
+    serial_number = 'SIM00001'
+    minimum_integration_time_micros = 1000
+    max_intensity = 65535.
+
+    def __init__(self, signal=None, baseline=1000., pixels=100, realtime=False):
+        self._wavelengths = np.linspace(300., 399., pixels)
+        self.signal = np.linspace(0., 100., pixels) if signal is None else signal
+        self.baseline = baseline
+        self.integration_time = None
+        self.scans = []
+        self.requests = 0
+        self.realtime = realtime
+
+    def wavelengths(self):
+        return self._wavelengths
+
+    def integration_time_micros(self, value):
+        self.integration_time = value
+
+    def intensities(self, *args):
+        """ Return the queued scans first, then simulated scans """
+        self.requests += 1
+        if self.scans:
+            return self.scans.pop(0)
+        if self.realtime:
+            time.sleep(self.integration_time / 1e6)
+        return np.minimum(self.baseline + self.signal * self.integration_time / 1000, self.max_intensity)
+
+    def close(self):
+        pass
+
+
+# the simulated spectrometer buffers no scans, so connecting does not measure them
+STALE_SCANS[SimulatedSpectrometer.model] = 0
+
+
+def connected(spec=None, stale_scans=0, **kwargs):
+    """ Return a spectrometer connected to a simulated spectrometer, which buffers no scans unless told otherwise """
+    spectrometer = QSpectrometer(**kwargs)
+    spectrometer.connect(SimulatedSpectrometer() if spec is None else spec)
+    spectrometer.stale_scans = stale_scans
+    return spectrometer
+
+
+def test_buffered_and_in_progress_scans_discarded():
+    spectrometer = connected(stale_scans=1, integrationtime=100, average_measurements=2)
+    spectrometer.spec.scans = [np.zeros(100), np.full(100, 500.)]
+    spectrometer.measuring = True
+    intensity, _ = spectrometer.measurement()
+    assert spectrometer.last_discarded == 2
+    assert np.allclose(intensity, 1000. + np.linspace(0., 100., 100) * 100)
+
+
+def test_unknown_model_flushed_by_timing():
+    spectrometer = connected(SimulatedSpectrometer(realtime=True), stale_scans=None, integrationtime=20)
+    spectrometer.spec.scans = [np.zeros(100)]
+    spectrometer.measuring = True
+    intensity, _ = spectrometer.measurement()
+    # the buffered scan and the first timed scan, which may have started before the request
+    assert spectrometer.last_discarded == 2
+    assert np.allclose(intensity, 1000. + np.linspace(0., 100., 100) * 20)
+
+
+def test_stale_scans_of_unknown_model_measured_at_connect():
+    spec = SimulatedSpectrometer(realtime=True)
+    spec.model = 'UNKNOWN'
+    spec.scans = [np.zeros(100)]
+    spectrometer = QSpectrometer(integrationtime=20)
+    spectrometer.connect(spec)
+    assert spectrometer.stale_scans == 1
+    assert spectrometer.integrationtime == 20
+
+
+def test_measure_stale_scans():
+    spectrometer = connected(SimulatedSpectrometer(realtime=True), integrationtime=20)
+    spectrometer.spec.scans = [np.zeros(100), np.zeros(100)]
+    assert spectrometer.measure_stale_scans() == 2
+
+
+def test_auto_range_brings_peak_to_target():
+    spectrometer = connected()
+    spectrometer.auto_integration = True
+    spectrometer.measure()
+    # probe at 10 ms: peak 2000 counts, 1000 above the baseline
+    expected = 10 * (0.7 * 65535 - 1000) / 1000
+    assert spectrometer.integrationtime == pytest.approx(expected)
+    assert spectrometer.last_integrationtime == pytest.approx(expected)
+
+
+def test_auto_range_shortens_saturated_probe():
+    spectrometer = connected(SimulatedSpectrometer(signal=np.linspace(0., 10000., 100)))
+    spectrometer.auto_integration = True
+    spectrometer.auto_min_integrationtime = 1
+    spectrometer.measure()
+    # the probe saturates at 10 ms and not at 2.5 ms, with a peak 25000 counts above the baseline
+    assert spectrometer.integrationtime == pytest.approx(2.5 * (0.7 * 65535 - 1000) / 25000)
+
+
+def test_auto_range_limited_to_bounds():
+    spectrometer = connected(SimulatedSpectrometer(signal=np.full(100, 0.01)))
+    spectrometer.auto_integration = True
+    spectrometer.measure()
+    assert spectrometer.integrationtime == spectrometer.auto_max_integrationtime
+
+
+def test_no_auto_range_with_reference_spectra():
+    spectrometer = connected(integrationtime=100)
+    spectrometer.measure_dark()
+    spectrometer.auto_integration = True
+    spectrometer.measure()
+    assert spectrometer.integrationtime == 100
+    spectrometer.clear_dark()
+    spectrometer.measure()
+    assert spectrometer.integrationtime != 100
+
+
+def ladder_spectrometer(tmp_path):
+    """ Return a spectrometer auto ranging over a ladder of 10, 20, 40 ... 2560 ms, with a dark cache """
+    spectrometer = connected(integrationtime=100)
+    spectrometer.dark_cache = DarkCache(tmp_path / 'darkcache.json')
+    spectrometer.auto_integration = True
+    spectrometer.auto_ladder_factor = 2
+    return spectrometer
+
+
+def test_integration_ladder(tmp_path):
+    spectrometer = ladder_spectrometer(tmp_path)
+    assert spectrometer.integration_ladder() == [10. * 2 ** i for i in range(9)]
+    spectrometer.auto_ladder_factor = None
+    assert spectrometer.integration_ladder() == []
+
+
+def test_references_measured_at_every_ladder_time(tmp_path):
+    spectrometer = ladder_spectrometer(tmp_path)
+    done = []
+    spectrometer.measurement_done.connect(lambda: done.append(True))
+    spectrometer.measure_dark()
+    spectrometer.measure_lamp()
+    assert done == [True, True]
+    assert spectrometer.integrationtime == 100
+    ladder = spectrometer.integration_ladder()
+    for references in (spectrometer.ladder_darks, spectrometer.ladder_lamps):
+        assert list(references) == ladder
+        for t, reference in references.items():
+            assert reference['integrationtime'] == t
+            assert np.allclose(reference['spectrum'], np.minimum(1000. + np.linspace(0., 100., 100) * t, 65535.))
+    assert set(spectrometer.cached_darks()) == set(ladder)
+    requests = spectrometer.spec.requests
+    spectrometer.measure_dark()
+    assert spectrometer.spec.requests == requests
+
+
+def test_auto_range_with_ladder_references(tmp_path):
+    spectrometer = ladder_spectrometer(tmp_path)
+    spectrometer.measure_dark()
+    spectrometer.measure_lamp()
+    assert spectrometer.ladder_referenced
+    spectrometer.measure()
+    # 449 ms brings the peak to the target, rounded down to the ladder
+    assert spectrometer.integrationtime == 320
+    assert spectrometer.last_integrationtime == 320
+    assert np.array_equal(spectrometer.dark, spectrometer.ladder_darks[320.]['spectrum'])
+    assert np.array_equal(spectrometer.lamp, spectrometer.ladder_lamps[320.]['spectrum'])
+    assert np.allclose(spectrometer.last_intensity, spectrometer.dark)
+
+
+def cached_spectrometer(tmp_path):
+    spectrometer = connected(integrationtime=100)
+    spectrometer.dark_cache = DarkCache(tmp_path / 'darkcache.json')
+    spectrometer.measure_dark()
+    return spectrometer
+
+
+def test_cached_dark_reused_unless_forced(tmp_path):
+    spectrometer = cached_spectrometer(tmp_path)
+    requests = spectrometer.spec.requests
+    spectrometer.measure_dark()
+    assert spectrometer.spec.requests == requests
+    assert spectrometer.last_dark_cached is not None
+    spectrometer.measure_new_dark()
+    assert spectrometer.spec.requests > requests
+    assert spectrometer.last_dark_cached is None
+
+
+@pytest.mark.parametrize('change', [lambda s: setattr(s, 'integrationtime', 200),
+                                    lambda s: setattr(s, 'average_measurements', 5),
+                                    lambda s: s.set_region((320, 380))])
+def test_settings_change_keeps_cached_darks(tmp_path, change):
+    spectrometer = cached_spectrometer(tmp_path)
+    key = DarkCache.key(spectrometer.serial, spectrometer.region, 100, 1)
+    spectrometer.cached_darks(reserve=True)
+    change(spectrometer)
+    assert spectrometer._reserved_darks == {}
+    spectrometer.measure_dark()
+    assert spectrometer.last_dark_cached is None
+    assert key in spectrometer.dark_cache.entries
+    # changing the settings back reuses the dark spectrum cached for them
+    spectrometer.integrationtime, spectrometer.average_measurements = 100, 1
+    spectrometer.set_region(None)
+    requests = spectrometer.spec.requests
+    spectrometer.measure_dark()
+    assert spectrometer.spec.requests == requests
+    assert spectrometer.last_dark_cached is not None
+    assert len(spectrometer.dark_cache.entries) == 2
+
+
+def test_buffers_reused_and_results_kept():
+    spectrometer = connected(average_measurements=3)
+    spectrometer.measuring = True
+    # the scan in progress is discarded first
+    spectrometer.spec.scans = [np.zeros(100), np.full(100, 1.), np.full(100, 2.), np.full(100, 3.)]
+    first, _ = spectrometer.measurement()
+    mean = spectrometer._mean
+    second, _ = spectrometer.measurement()
+    assert spectrometer._mean is mean
+    assert np.allclose(first, 2.)
+    assert not np.shares_memory(first, second)
+
+
+@pytest.mark.parametrize('averages', [1, 2, 7])
+def test_welford_matches_numpy(averages):
+    spectrometer = connected(average_measurements=averages)
+    scans = np.random.default_rng(averages).normal(1000., 50., (averages, 100))
+    spectrometer.spec.scans = [np.zeros(100)] + list(scans)
+    spectrometer.measuring = True
+    intensity, _ = spectrometer.measurement()
+    assert np.allclose(intensity, np.mean(scans, axis=0))
+    assert np.allclose(spectrometer.last_std, np.std(scans, axis=0, ddof=1) if averages > 1 else 0.)
+
+
+@pytest.mark.parametrize('roi, binning, region', [(None, 1, '0:100:1'),
+                                                  (None, 3, '0:99:3'),
+                                                  ((320, 380), 4, '20:80:4'),
+                                                  ((319.5, 320.5), 1, '20:21:1'),
+                                                  ((320, 321), 4, '0:100:1')])
+def test_region_and_binning(roi, binning, region):
+    spectrometer = connected()
+    spectrometer.set_region(roi, binning)
+    assert spectrometer.region == region
+    start, stop, binning = (int(value) for value in region.split(':'))
+    wavelengths = np.array(spectrometer.wavelengths)
+    assert len(wavelengths) == spectrometer.pixels == (stop - start) // binning
+    assert wavelengths[0] == pytest.approx(300. + start + (binning - 1) / 2)
+    assert wavelengths[-1] == pytest.approx(300. + stop - 1 - (binning - 1) / 2)
+    # the pixel values equal their wavelength offsets, so the reduced spectrum follows the wavelength axis
+    spectrometer.spec.scans = [np.zeros(100), np.arange(100.)]
+    spectrometer.measuring = True
+    intensity, _ = spectrometer.measurement()
+    assert intensity.shape == wavelengths.shape
+    assert np.allclose(intensity, wavelengths - 300.)
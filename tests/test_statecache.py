@@ -0,0 +1,68 @@
+"""
+Tests for the write-through cache of instrument settings.
+"""
+from instruments.Thorlabs import statecache
+from instruments.Thorlabs.statecache import StateCache
+
+
+class Instrument:
+    """ Instrument with a single setting, counting the reads and writes """
+    def __init__(self, value=0):
+        self.value = value
+        self.reads = 0
+        self.writes = 0
+
+    def read(self):
+        self.reads += 1
+        return self.value
+
+    def write(self, value):
+        self.writes += 1
+        self.value = value
+
+
+def test_read_once_then_cached():
+    instrument, cache = Instrument(5), StateCache('test')
+    assert cache.get('setting', instrument.read) == 5
+    assert cache.get('setting', instrument.read) == 5
+    assert instrument.reads == 1
+    assert cache.stats() == {'transactions': 1, 'saved': 1}
+
+
+def test_write_skipped_for_known_value():
+    instrument, cache = Instrument(), StateCache('test')
+    assert cache.set('setting', 3, instrument.write)
+    assert not cache.set('setting', 3, instrument.write)
+    assert cache.set('setting', 4, instrument.write)
+    assert instrument.writes == 2
+    # a write updates the cached value, so a read needs no bus transaction
+    assert cache.get('setting', instrument.read) == 4
+    assert instrument.reads == 0
+
+
+def test_invalidate_forces_transactions():
+    instrument, cache = Instrument(), StateCache('test')
+    cache.set('setting', 3, instrument.write)
+    instrument.value = 7    # changed on the instrument itself
+    cache.invalidate('setting')
+    assert cache.get('setting', instrument.read) == 7
+    cache.invalidate()
+    assert cache.set('setting', 7, instrument.write)
+    assert instrument.writes == 2
+
+
+def test_values_expire(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(statecache.time, 'monotonic', lambda: now[0])
+    instrument, cache = Instrument(1), StateCache('test', max_age=10)
+    cache.get('setting', instrument.read)
+    now[0] += 9
+    cache.get('setting', instrument.read)
+    assert instrument.reads == 1
+    now[0] += 2
+    instrument.value = 2
+    assert cache.get('setting', instrument.read) == 2
+    assert instrument.reads == 2
+    assert cache.set('setting', 2, instrument.write) is False
+    now[0] += 11
+    assert cache.set('setting', 2, instrument.write)
@@ -0,0 +1,93 @@
+"""
+Tests for the statemachine, on a statemachine without instruments other than a simulated spectrometer.
+"""
+import logging
+import types
+import numpy as np
+import yaml
+from pathlib import Path
+from netCDF4 import Dataset
+from statemachine.statemachine import StateMachine
+from test_spectrometer import connected
+
+
+def statemachine(experiment):
+    """ Return a bare statemachine with the main configuration and a connected simulated spectrometer """
+    machine = StateMachine.__new__(StateMachine)
+    machine.logger = logging.getLogger('statemachine')
+    with open(Path(__file__).parent.parent / 'config/config_main.yaml') as f:
+        machine.config = yaml.safe_load(f)
+    machine.calibration = False
+    machine.experiment = experiment
+    machine.instruments = {'spectrometer': connected()}
+    return machine
+
+
+def test_reset_restores_auto_integration():
+    machine = statemachine('transmission')
+    machine.config['spectrometer']['auto_integration'] = False
+    machine.instruments['spectrometer'].auto_integration = True
+    machine.reset_instruments()
+    assert not machine.instruments['spectrometer'].auto_integration
+    machine.config['spectrometer']['auto_integration'] = True
+    machine.reset_instruments()
+    assert machine.instruments['spectrometer'].auto_integration
+    assert machine.instruments['spectrometer'].auto_max_integrationtime == \
+        machine.config['spectrometer']['auto_max_integrationtime']
+
+
+def test_experiment_keeps_auto_integration(tmp_path):
+    machine = statemachine('transmission')
+    machine.config['spectrometer']['auto_integration'] = True
+    machine._reset_auto_integration()
+    machine.settings_ui = {'transmission': {'widget_spectrometer_transmission': {
+        'spinBox_integration_time_experiment': 100, 'spinBox_averageing_experiment': 1}}}
+    machine._parse_spectrometersettings()
+    spectrometer = machine.instruments['spectrometer']
+    assert spectrometer.auto_integration
+    assert spectrometer.ladder_active
+    spectrometer.measure_dark()
+    machine.dataset = Dataset(tmp_path / 'transmission.hdf5', 'w', format='NETCDF4')
+    machine._create_dimensions_transmission()
+    machine._write_ladder(machine.dataset.createGroup('dark'), spectrometer.ladder_darks)
+    machine.dataset.close()
+    with Dataset(tmp_path / 'transmission.hdf5') as dataset:
+        ladder = spectrometer.integration_ladder()
+        assert np.array_equal(dataset['dark']['ladder_integrationtime'][:], ladder)
+        assert np.array_equal(dataset['dark']['ladder_spectrum'][-1], spectrometer.ladder_darks[ladder[-1]]['spectrum'])
+
+
+def planned_statemachine(ordering):
+    """ Return a bare statemachine with a planned decay scan over a 3 x 2 x 2 grid """
+    machine = statemachine('decay')
+    machine.config['scan']['ordering'] = ordering
+    machine.instruments['xystage'] = types.SimpleNamespace(xmotion=(2., 4., False), ymotion=(2., 4., False))
+    machine.measurement_parameters = {}
+    machine.measurement_grid = {}
+    machine._add_measurement_parameter('x', np.array([1., 2., 3.]))
+    machine._add_measurement_parameter('y', np.array([5., 6.]))
+    machine._add_measurement_parameter('wl', np.array([400, 500]))
+    machine._plan_scan()
+    return machine
+
+
+def test_scan_order_maps_to_raster_points():
+    machine = planned_statemachine('greedy')
+    x, y, wl = np.unravel_index(machine.scan_order, (3, 2, 2))
+    assert np.array_equal(machine.measurement_parameters['x'], np.array([1., 2., 3.])[x])
+    assert np.array_equal(machine.measurement_parameters['y'], np.array([5., 6.])[y])
+    assert np.array_equal(machine.measurement_parameters['wl'], np.array([400, 500])[wl])
+
+
+def test_scan_order_written_to_file(tmp_path):
+    machine = planned_statemachine('serpentine')
+    machine.position_offsets = {'x': dict.fromkeys(['sample_width', 'sample_width_effective', 'offset_left',
+                                                    'offset_right'], 0.),
+                                'y': dict.fromkeys(['sample_height', 'sample_height_effective', 'offset_bottom',
+                                                    'offset_top'], 0.)}
+    machine.dataset = Dataset(tmp_path / 'scan.hdf5', 'w', format='NETCDF4')
+    machine._write_positionsettings()
+    machine.dataset.close()
+    with Dataset(tmp_path / 'scan.hdf5') as dataset:
+        assert np.array_equal(dataset['settings/xystage']['scan_order'][:], machine.scan_order)
+        assert dataset['settings/xystage'].scan_ordering == 'serpentine'
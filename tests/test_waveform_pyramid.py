@@ -0,0 +1,33 @@
+"""
+Tests for the min/max waveform pyramid used for plotting long digitizer records.
+"""
+import numpy as np
+from gui_action.waveform_pyramid import WaveformPyramid
+
+
+def test_spikes_survive_decimation():
+    samples = 1_000_000
+    times = np.linspace(0, (samples - 1) / 250e6, samples)
+    data = np.zeros(samples)
+    data[123457] = 50
+    data[876543] = -20
+    pyramid = WaveformPyramid(times, data, max_points=4000)
+    view_times, view_data = pyramid.view()
+    assert len(view_times) <= 4000
+    assert view_data.max() == 50
+    assert view_data.min() == -20
+
+
+def test_zoomed_view_covers_range_at_higher_resolution():
+    samples = 100_000
+    times = np.arange(samples) * 1e-9
+    data = np.sin(np.arange(samples) / 1000)
+    pyramid = WaveformPyramid(times, data, max_points=1000)
+    view_times, _ = pyramid.view(times[20000], times[60000])
+    assert view_times[0] <= times[20000]
+    # the last bin of 128 samples starts at most one bin before the end of the range
+    assert view_times[-1] >= times[60000] - 128e-9
+    assert len(view_times) <= 1002
+    # a range with less samples than the maximum number of points returns the samples themselves
+    view_times, view_data = pyramid.view(times[500], times[1000])
+    assert np.array_equal(view_data, data[500:1002])